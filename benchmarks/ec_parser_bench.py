@@ -0,0 +1,111 @@
+import argparse
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from lxml import html
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ec_entries
+
+# Микро-бенчмарк разбора страниц EC: прежний разбор (отдельный XPath на каждую секцию)
+# против однопроходного parse_ec_page на корпусе сохранённых страниц ExPASy
+
+# Прежний разбор, который заменил ec_entries.parse_ec_page; сохранён для сравнения скорости и результата
+def extract_section_content(tree, section_name):
+    try:
+        section_content = ""
+        section_nodes = tree.xpath(f"//th[text()='{section_name}']/../following-sibling::tr")
+        for node in section_nodes:
+            if node.xpath(".//th"):
+                break
+            section_content += " ".join(node.xpath(".//text()")).strip() + "\n"
+        return section_content.strip()
+    except Exception as e:
+        logging.error(f"Error extracting {section_name}: {e}")
+        return ""
+
+def extract_uniprot_entries(tree, section_name):
+    try:
+        entries = []
+        section_node = tree.xpath(f"//td[text()='{section_name}']")
+        if section_node:
+            entry_nodes = section_node[0].xpath("./following-sibling::td[1]//a[contains(@href, 'uniprot')]")
+            for entry_node in entry_nodes:
+                entry_id = entry_node.get("href").split('/')[-1]
+                entries.append(entry_id)
+                logging.debug(f"Found UniProt entry: {entry_id}")
+        return "\n".join(entries)
+    except Exception as e:
+        logging.error(f"Error extracting {section_name}: {e}")
+        return ""
+
+def legacy_parse(content):
+    tree = html.fromstring(content)
+    result = {
+        "accepted_name": extract_section_content(tree, "Accepted Name"),
+        "alt_names": extract_section_content(tree, "Alternative Name(s)"),
+        "entries": [entry for entry in extract_uniprot_entries(tree, "UniProtKB/Swiss-Prot").split('\n') if entry],
+        "transferred_to": None,
+    }
+    transferred_entry_nodes = tree.xpath('/html/body/main/div/h3/a')
+    if transferred_entry_nodes and transferred_entry_nodes[0].text:
+        result["transferred_to"] = transferred_entry_nodes[0].text.strip()
+    return result
+
+def record_corpus(corpus_dir, ec_numbers):
+    import requests
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    with requests.Session() as session:
+        for ec_number in ec_numbers:
+            response = session.get(f"{ec_entries.EC_URL}/{ec_number}", timeout=30)
+            response.raise_for_status()
+            (corpus_dir / f"{ec_number}.html").write_bytes(response.content)
+            logging.info(f"Сохранена страница {ec_number}")
+
+def measure(parse, pages, repeat):
+    cpu_times = []
+    for _ in range(repeat):
+        start = time.process_time()
+        for content in pages:
+            parse(content)
+        cpu_times.append(time.process_time() - start)
+    return statistics.median(cpu_times)
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора страниц EC")
+    parser.add_argument('corpus', type=Path, help="Каталог с сохранёнными страницами EC (*.html)")
+    parser.add_argument('--repeat', type=int, default=5, help="Количество повторов")
+    parser.add_argument('--record', nargs='+', metavar='EC', help="Сначала скачать страницы для указанных EC номеров в каталог корпуса")
+    args = parser.parse_args()
+
+    if args.record:
+        record_corpus(args.corpus, args.record)
+
+    pages = [path.read_bytes() for path in sorted(args.corpus.glob('*.html'))]
+    if not pages:
+        logging.error(f"В каталоге '{args.corpus}' нет страниц *.html")
+        sys.exit(1)
+
+    # Оба разбора должны давать одинаковый результат
+    mismatches = [index for index, content in enumerate(pages)
+                  if legacy_parse(content) != ec_entries.parse_ec_page(content)]
+    if mismatches:
+        logging.warning(f"Результаты разбора отличаются для {len(mismatches)} страниц")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    legacy = measure(legacy_parse, pages, args.repeat)
+    single_pass = measure(ec_entries.parse_ec_page, pages, args.repeat)
+
+    print(f"Страниц: {len(pages)}, повторов: {args.repeat}")
+    print(f"legacy:      {legacy / len(pages) * 1e6:9.1f} мкс CPU/страница")
+    print(f"single-pass: {single_pass / len(pages) * 1e6:9.1f} мкс CPU/страница")
+    if single_pass:
+        print(f"ускорение:   {legacy / single_pass:9.2f}x")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,122 @@
+import argparse
+import json
+import logging
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Бенчмарк времени импорта модулей этапов (python -X importtime). Каждый модуль импортируется
+# в новом процессе несколько раз, берётся медиана собственного накопленного времени модуля
+# (без site и общих для всех процессов модулей интерпретатора). Заодно проверяется, что импорт
+# не загружает тяжёлые зависимости и не имеет побочных эффектов: не настраивает журнал
+# и не меняет PATH. Нарушение бюджета или проверки — ненулевой код выхода
+
+# Бюджет времени импорта, мс. Паук Rhea наследует scrapy.Spider, поэтому Scrapy (и parsel с lxml.html)
+# загружается сразу
+BUDGETS_MS = {
+    'config': 30,
+    'metrics': 30,
+    'journal': 30,
+    'http_cache': 60,
+    'ratelimit': 30,
+    'ingest': 60,
+    'storage': 60,
+    'enzyme_index': 60,
+    'names_ec': 200,
+    'ec_entries': 200,
+    'ent_seq_v2': 200,
+    'pipeline': 250,
+    'workqueue': 60,
+    'worker': 250,
+    'orchestrator': 150,
+    'smile_spider': 700,
+}
+# Модули, которые должны загружаться только при первом использовании
+HEAVY_MODULES = ['pandas', 'aiohttp', 'redis', 'requests', 'playwright', 'scrapy_playwright', 'tqdm', 'lxml.html',
+                 'pyarrow', 'zstandard', 'scrapy']
+ALLOWED_HEAVY = {'smile_spider': {'scrapy', 'lxml.html'}}
+IMPORTTIME_RE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)')
+
+CHECK_SCRIPT = """
+import json, logging, os, sys
+path = os.environ.get('PATH')
+import {module}
+print(json.dumps({{"handlers": len(logging.getLogger().handlers), "path_changed": os.environ.get('PATH') != path,
+                  "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+def import_time_ms(module):
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match and match.group(3) == module:
+            return int(match.group(2)) / 1000
+    raise RuntimeError(f"нет строки importtime для {module}")
+
+def side_effects(module):
+    process = subprocess.run([sys.executable, '-c', CHECK_SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                             cwd=ROOT, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    return json.loads(process.stdout)
+
+def measure(module, repeat):
+    timings = [import_time_ms(module) for _ in range(repeat)]
+    effects = side_effects(module)
+    problems = []
+    median = statistics.median(timings)
+    budget = BUDGETS_MS.get(module)
+    if budget is not None and median > budget:
+        problems.append(f"импорт {median:.1f} мс при бюджете {budget} мс")
+    unexpected = [name for name in effects["loaded"] if name not in ALLOWED_HEAVY.get(module, ())]
+    if unexpected:
+        problems.append(f"при импорте загружены {', '.join(unexpected)}")
+    if effects["handlers"]:
+        problems.append("импорт настраивает журнал")
+    if effects["path_changed"]:
+        problems.append("импорт меняет PATH")
+    return {"module": module, "median_ms": round(median, 1), "min_ms": round(min(timings), 1),
+            "budget_ms": budget, "loaded": effects["loaded"], "problems": problems}
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк времени импорта модулей этапов")
+    parser.add_argument('--modules', nargs='+', default=list(BUDGETS_MS), help="Проверяемые модули")
+    parser.add_argument('--repeat', type=int, default=5, help="Количество импортов каждого модуля")
+    parser.add_argument('--scale', type=float, default=1.0, help="Множитель бюджетов (для медленных машин CI)")
+    parser.add_argument('--results', type=Path, help="Файл результатов (JSON)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    for module in BUDGETS_MS:
+        BUDGETS_MS[module] *= args.scale
+
+    results = []
+    for module in args.modules:
+        try:
+            entry = measure(module, args.repeat)
+        except RuntimeError as e:
+            entry = {"module": module, "problems": [f"ошибка импорта: {e}"]}
+        results.append(entry)
+        if "median_ms" in entry:
+            logging.info(f"{module}: {entry['median_ms']} мс (бюджет {entry['budget_ms']} мс)")
+        for problem in entry["problems"]:
+            logging.error(f"{module}: {problem}")
+
+    if args.results:
+        with open(args.results, 'w', encoding='utf-8') as f:
+            json.dump({"created": time.time(), "python": sys.version.split()[0], "results": results}, f,
+                      ensure_ascii=False, indent=2)
+        logging.info(f"Результаты сохранены в {args.results}")
+    if any(entry["problems"] for entry in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
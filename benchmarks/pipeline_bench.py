@@ -0,0 +1,334 @@
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from replay_server import synthetic_names
+from storage import EC_ENTRIES, NAMES_EC, REACTIONS, SEQUENCES, RunStore, get_redis
+
+# Бенчмарк этапов и всего orchestrator на локальном сервере-заменителе (replay_server.py).
+# Каждый этап запускается отдельным процессом и берёт вход из Redis, как в режиме --subprocess,
+# поэтому пиковая память (RSS) относится только к этому этапу. Задержка записи — время от
+# начала этапа до появления записи в выходном потоке Redis (по ID записи в потоке);
+# p50/p95 считаются по всем записям этапа. Результаты сохраняются в JSON
+
+STAGES = ['names_ec', 'ec_entries', 'ent_seq_v2', 'smile_spider']
+ORCHESTRATOR_MODES = {
+    'orchestrator': [],
+    'orchestrator_streaming': ['--streaming'],
+}
+OUTPUT_STREAMS = {
+    'names_ec': NAMES_EC,
+    'ec_entries': EC_ENTRIES,
+    'ent_seq_v2': SEQUENCES,
+    'smile_spider': REACTIONS,
+    'orchestrator': REACTIONS,
+    'orchestrator_streaming': REACTIONS,
+}
+
+def load_names(names_file, size):
+    if names_file is None:
+        return synthetic_names(size)
+    with open(names_file, encoding='utf-8') as f:
+        names = [line.strip() for line in f if line.strip()]
+    if len(names) < size:
+        logging.warning(f"В файле '{names_file}' только {len(names)} названий, размер {size} не достигнут")
+    return names[:size]
+
+def peak_rss_mb(who='self'):
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss в килобайтах на Linux и в байтах на macOS
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def redis_time(client):
+    # Время по часам Redis: с ним сравниваются ID записей потоков
+    seconds, microseconds = client.time()
+    return seconds + microseconds / 1e6
+
+# Процесс-исполнитель одного этапа
+
+def run_stage(stage, store, args):
+    import pipeline
+
+    if stage == 'names_ec':
+        enzymes = load_names(args.names, args.size)
+        return len(enzymes), lambda: pipeline.run_names_stage(store, enzymes, concurrency=args.concurrency)
+    if stage == 'ec_entries':
+        names_results = store.read(NAMES_EC)
+        return len(names_results), lambda: pipeline.run_ec_entries_stage(store, names_results)
+    if stage == 'ent_seq_v2':
+        uniprot_entries = store.read(EC_ENTRIES)
+        accessions = {item for entry in uniprot_entries for item in entry.get('Entries', '').split('\n') if item}
+        return len(accessions), lambda: pipeline.run_sequence_stage(store, uniprot_entries)
+    sequence_results = store.read(SEQUENCES)
+    return len(sequence_results), lambda: pipeline.run_rhea_stage(
+        store, sequence_results, output_file='Final_data.csv', batched=args.rhea_mode == 'batched')
+
+def run_orchestrator(stage, store, args):
+    import pandas as pd
+
+    enzymes = load_names(args.names, args.size)
+    if args.duplicate_rate:
+        # Повторы в том же виде, в другом регистре и с лишними пробелами, как во входных таблицах
+        rows = list(enzymes)
+        generator = random.Random(args.seed)
+        for _ in range(int(len(enzymes) * args.duplicate_rate / (1 - args.duplicate_rate))):
+            name = generator.choice(enzymes)
+            rows.insert(generator.randrange(len(rows) + 1), generator.choice([name, name.upper(), f" {name}  "]))
+        enzymes = rows
+    input_file = Path(f"names_{args.size}.xlsx")
+    pd.DataFrame({'Protein': enzymes}).to_excel(input_file, index=False)
+    command = [sys.executable, str(ROOT / 'orchestrator.py'), '--file', str(input_file), '--run-id', store.run_id,
+               '--output', f"orchestrator_{args.size}.csv", '--concurrency', str(args.concurrency),
+               *ORCHESTRATOR_MODES[stage]]
+    if args.rhea_mode == 'batched':
+        command.append('--rhea-batched')
+    return len(enzymes), lambda: subprocess.run(command, check=True)
+
+def worker(args):
+    store = RunStore(args.run_id)
+    if args.worker in ORCHESTRATOR_MODES:
+        items, run = run_orchestrator(args.worker, store, args)
+    else:
+        items, run = run_stage(args.worker, store, args)
+    start = redis_time(store.client)
+    started = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - started
+    rss = [value for value in (peak_rss_mb('self'), peak_rss_mb('children')) if value is not None]
+    print(json.dumps({"items": items, "seconds": seconds, "start": start, "peak_rss_mb": max(rss) if rss else None}))
+
+# Управляющий процесс
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+def record_latencies(store, stream, start):
+    latencies = []
+    last_id = '-'
+    while True:
+        entries = store.client.xrange(store.key(stream), min=last_id, max='+', count=10000)
+        for entry_id, _ in entries:
+            milliseconds = int(entry_id.split(b'-')[0])
+            latencies.append(round(milliseconds - start * 1000, 1))
+        if len(entries) < 10000:
+            return latencies
+        last_id = b'(' + entries[-1][0]
+
+def server_call(url, path, method='GET'):
+    with urlopen(Request(f"{url}{path}", method=method), timeout=10) as response:
+        return json.loads(response.read())
+
+def start_server(args):
+    command = [sys.executable, str(Path(__file__).with_name('replay_server.py')),
+               '--latency', str(args.latency), '--jitter', str(args.jitter), '--error-rate', str(args.error_rate),
+               '--seed', str(args.seed), '--error-status', str(args.error_status)]
+    if args.retry_after is not None:
+        command.extend(['--retry-after', str(args.retry_after)])
+    if args.error_sources:
+        command.extend(['--error-sources', args.error_sources])
+    if args.corpus:
+        command.extend(['--corpus', str(args.corpus)])
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith('READY '):
+        server.kill()
+        raise RuntimeError("Сервер-заменитель не запустился")
+    return server, line.split()[1]
+
+def run_measurement(stage, size, run_id, args, env, workdir, url):
+    command = [sys.executable, __file__, '--worker', stage, '--run-id', run_id, '--size', str(size),
+               '--concurrency', str(args.concurrency), '--rhea-mode', args.rhea_mode,
+               '--duplicate-rate', str(args.duplicate_rate), '--seed', str(args.seed)]
+    if args.names:
+        command.extend(['--names', str(args.names)])
+    server_call(url, '/__reset', 'POST')
+    log_file = workdir / f"{stage}-{size}.log"
+    logging.info(f"{stage}, размер {size}")
+    with open(log_file, 'w') as log:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=log, text=True, env=env, cwd=workdir)
+    stats = server_call(url, '/__stats')
+    result = {"stage": stage, "size": size}
+    if process.returncode != 0:
+        logging.error(f"Этап {stage} (размер {size}) завершился с кодом {process.returncode}, журнал: {log_file}")
+        result["error"] = f"exit code {process.returncode}"
+        return result
+
+    measured = json.loads(process.stdout.strip().splitlines()[-1])
+    store = RunStore(run_id)
+    latencies = record_latencies(store, OUTPUT_STREAMS[stage], measured["start"])
+    seconds = measured["seconds"]
+    result.update({
+        "items": measured["items"],
+        "records": len(latencies),
+        "seconds": round(seconds, 3),
+        "throughput": round(measured["items"] / seconds, 2) if seconds else None,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "peak_rss_mb": round(measured["peak_rss_mb"], 1) if measured["peak_rss_mb"] is not None else None,
+        "requests": sum(value for key, value in stats.items() if key.endswith(':requests')),
+        "injected_errors": sum(value for key, value in stats.items() if key.endswith(':injected_errors')),
+    })
+    return result
+
+def delete_run(run_id):
+    client = get_redis()
+    keys = list(client.scan_iter(match=f"{RunStore(run_id).key('*')}"))
+    if keys:
+        client.delete(*keys)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_file, tolerance):
+    # Регрессия: пропускная способность ниже, а p95 или пиковая память выше базовых больше чем на tolerance
+    with open(baseline_file) as f:
+        baseline = {(entry["stage"], entry["size"]): entry for entry in json.load(f)["results"]}
+    regressions = []
+    for entry in results:
+        base = baseline.get((entry["stage"], entry["size"]))
+        if base is None or "error" in entry or "error" in base:
+            continue
+        if base.get("throughput") and entry["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{entry['stage']}/{entry['size']}: throughput {base['throughput']} -> {entry['throughput']}")
+        for metric in ("p95_ms", "peak_rss_mb"):
+            if base.get(metric) and entry.get(metric) and entry[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{entry['stage']}/{entry['size']}: {metric} {base[metric]} -> {entry[metric]}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн бенчмарк этапов на локальном сервере-заменителе")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help="Количество названий ферментов на входе")
+    parser.add_argument('--stages', nargs='+', default=STAGES + list(ORCHESTRATOR_MODES),
+                        choices=STAGES + list(ORCHESTRATOR_MODES), help="Измеряемые этапы")
+    parser.add_argument('--names', type=Path, help="Файл с названиями ферментов (по одному в строке) вместо синтетических")
+    parser.add_argument('--corpus', type=Path, help="Каталог записанных ответов для replay_server.py")
+    parser.add_argument('--latency', type=float, default=20.0, help="Средняя задержка ответа сервера, мс")
+    parser.add_argument('--jitter', type=float, default=5.0, help="Стандартное отклонение задержки, мс")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Доля ответов с ошибкой")
+    parser.add_argument('--error-sources', help="Сервисы, в ответы которых добавляются ошибки (через запятую)")
+    parser.add_argument('--error-status', type=int, default=503, help="HTTP статус ответов с ошибкой (429 или 503 — ограничение скорости)")
+    parser.add_argument('--retry-after', type=int, help="Заголовок Retry-After (секунды) в ответах с ошибкой")
+    parser.add_argument('--max-rate', type=float, help="Наибольшая скорость запросов к серверу-заменителю в планировщике, запросов/с")
+    parser.add_argument('--seed', type=int, default=0, help="Начальное значение генератора задержек и ошибок")
+    parser.add_argument('--memo', action='store_true', help="Использовать память поиска по названиям из прошлых запусков "
+                        "(по умолчанию отключена, чтобы измерять обращения к сервисам)")
+    parser.add_argument('--duplicate-rate', type=float, default=0.0, help="Доля повторяющихся названий во входном файле orchestrator")
+    parser.add_argument('--concurrency', type=int, default=4, help="Параметр --concurrency этапов")
+    parser.add_argument('--rhea-mode', default='batched', choices=['batched', 'pages'], help="Режим паука Rhea")
+    parser.add_argument('--results', type=Path, default=Path('benchmark_results.json'), help="Файл результатов (JSON)")
+    parser.add_argument('--workdir', type=Path, help="Каталог для выходных файлов и журналов этапов")
+    parser.add_argument('--baseline', type=Path, help="Результаты прошлого запуска для поиска регрессий")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Допустимое ухудшение относительно --baseline")
+    parser.add_argument('--keep-data', action='store_true', help="Не удалять записи запусков из Redis")
+    parser.add_argument('--worker', choices=STAGES + list(ORCHESTRATOR_MODES), help=argparse.SUPPRESS)
+    parser.add_argument('--run-id', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.worker:
+        worker(args)
+        return
+
+    workdir = (args.workdir or Path(tempfile.mkdtemp(prefix='enzyme_bench_'))).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    server, url = start_server(args)
+    env = dict(os.environ, ENZYME_EXPASY_URL=url, ENZYME_UNIPROT_URL=url, ENZYME_RHEA_URL=url,
+               ENZYME_JOURNAL_DIR=str(workdir / '.journal'), ENZYME_RATE_DB=str(workdir / 'ratelimit.sqlite'))
+    # Состояние планировщика запросов своё для каждого запуска бенчмарка: скорость, подобранная
+    # на сервере-заменителе, не должна попадать в общий файл и влиять на другие запуски
+    if args.max_rate:
+        env['ENZYME_RATE_LIMITS'] = f"{urlsplit(url).netloc}={args.max_rate}"
+    # Общий HTTP кэш отключён: иначе повторные запуски измеряли бы кэш, а не сервисы
+    env.pop('ENZYME_CACHE_DIR', None)
+    if not args.memo:
+        env['ENZYME_NAME_MEMO'] = '0'
+
+    results = []
+    run_ids = []
+    try:
+        # Этапы выполняются по цепочке: каждый берёт вход из результатов предыдущего
+        last_stage = max((STAGES.index(stage) for stage in args.stages if stage in STAGES), default=-1)
+        for size in args.sizes:
+            run_id = f"bench-{size}-{uuid.uuid4().hex[:8]}"
+            run_ids.append(run_id)
+            for stage in STAGES[:last_stage + 1]:
+                result = run_measurement(stage, size, run_id, args, env, workdir, url)
+                if stage in args.stages:
+                    results.append(result)
+                if "error" in result:
+                    break
+            for stage in ORCHESTRATOR_MODES:
+                if stage in args.stages:
+                    run_id = f"bench-{stage}-{size}-{uuid.uuid4().hex[:8]}"
+                    run_ids.append(run_id)
+                    results.append(run_measurement(stage, size, run_id, args, env, workdir, url))
+    finally:
+        server.terminate()
+        server.wait()
+        if not args.keep_data:
+            for run_id in run_ids:
+                delete_run(run_id)
+
+    report = {
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {"latency_ms": args.latency, "jitter_ms": args.jitter, "error_rate": args.error_rate,
+                   "error_sources": args.error_sources, "concurrency": args.concurrency,
+                   "rhea_mode": args.rhea_mode, "corpus": str(args.corpus) if args.corpus else None,
+                   "names": str(args.names) if args.names else None},
+        "results": results,
+    }
+    with open(args.results, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'этап':<24}{'размер':>8}{'элементов':>11}{'с':>9}{'эл/с':>10}{'p50 мс':>10}{'p95 мс':>10}{'RSS МБ':>9}")
+    for entry in results:
+        if "error" in entry:
+            print(f"{entry['stage']:<24}{entry['size']:>8}  {entry['error']}")
+            continue
+        print(f"{entry['stage']:<24}{entry['size']:>8}{entry['items']:>11}{entry['seconds']:>9.2f}"
+              f"{entry['throughput'] or 0:>10.1f}{entry['p50_ms'] or 0:>10.0f}{entry['p95_ms'] or 0:>10.0f}"
+              f"{entry['peak_rss_mb'] or 0:>9.1f}")
+    logging.info(f"Результаты сохранены в {args.results}, журналы этапов в {workdir}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            logging.error(f"Регрессия: {regression}")
+        if regressions:
+            sys.exit(1)
+    if any("error" in entry for entry in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,366 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import sys
+from collections import Counter
+from html import escape
+from pathlib import Path
+from urllib.parse import unquote
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+# Локальная замена ExPASy, UniProt и Rhea для офлайн бенчмарков.
+# Ответ ищется в корпусе записанных ответов (каталог --corpus), а если его там нет —
+# строится синтетический ответ в формате настоящего сервиса. Синтетические данные
+# детерминированы: один и тот же запрос всегда даёт один и тот же ответ.
+# В режиме --record промахи корпуса запрашиваются у настоящих сервисов и сохраняются.
+# Задержка и ошибки (--latency, --jitter, --error-rate) добавляются ко всем ответам
+
+UPSTREAMS = {
+    'expasy_byname': "https://enzyme.expasy.org",
+    'expasy_ec': "https://enzyme.expasy.org",
+    'uniprot': "https://rest.uniprot.org",
+    'rhea': "https://www.rhea-db.org",
+}
+# Ошибка поиска по названию переводит names_ec в режим Playwright, поэтому по умолчанию
+# ошибки добавляются только в ответы остальных сервисов
+DEFAULT_ERROR_SOURCES = ('expasy_ec', 'uniprot', 'rhea')
+
+NOT_FOUND_TEXT = "No ENZYME entry was found with name containing"
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+ORGANISMS = [
+    ("Homo sapiens (Human)", 9606),
+    ("Mus musculus (Mouse)", 10090),
+    ("Escherichia coli (strain K12)", 83333),
+    ("Saccharomyces cerevisiae (strain ATCC 204508 / S288c) (Baker's yeast)", 559292),
+    ("Arabidopsis thaliana (Mouse-ear cress)", 3702),
+]
+COMPOUNDS = [
+    ("H2O", "O", 15377), ("H(+)", "[H+]", 15378), ("NAD(+)", "NC(=O)c1ccc[n+](c1)C1OC(COP([O-])(=O)OP([O-])(=O)OCC2OC(C(O)C2O)n2cnc3c(N)ncnc23)C(O)C1O", 57540),
+    ("NADH", "NC(=O)C1=CN(C=CC1)C1OC(COP([O-])(=O)OP([O-])(=O)OCC2OC(C(O)C2O)n2cnc3c(N)ncnc23)C(O)C1O", 57945),
+    ("ATP", "Nc1ncnc2n(cnc12)C1OC(COP([O-])(=O)OP([O-])(=O)OP([O-])([O-])=O)C(O)C1O", 30616),
+    ("ADP", "Nc1ncnc2n(cnc12)C1OC(COP([O-])(=O)OP([O-])([O-])=O)C(O)C1O", 456216),
+    ("phosphate", "OP([O-])([O-])=O", 43474), ("ethanol", "CCO", 16236), ("acetaldehyde", "CC=O", 15343),
+    ("pyruvate", "CC(=O)C([O-])=O", 15361), ("L-lactate", "C[C@H](O)C([O-])=O", 16651),
+    ("CO2", "O=C=O", 16526), ("O2", "O=O", 15379), ("D-glucose", "OC[C@H]1OC(O)[C@H](O)[C@@H](O)[C@@H]1O", 4167),
+    ("L-glutamate", "[NH3+][C@@H](CCC([O-])=O)C([O-])=O", 29985), ("2-oxoglutarate", "[O-]C(=O)CCC(=O)C([O-])=O", 16810),
+]
+RHEA_REACTIONS = 4000  # Размер пула реакций: популярные реакции общие для многих белков
+
+UNIPROT_FIELDS = {
+    'accession': 'Entry',
+    'id': 'Entry Name',
+    'organism_name': 'Organism',
+    'organism_id': 'Organism (ID)',
+    'gene_names': 'Gene Names',
+    'protein_name': 'Protein names',
+    'ec': 'EC number',
+    'sequence': 'Sequence',
+    'length': 'Length',
+    'xref_refseq': 'RefSeq',
+    'reviewed': 'Reviewed',
+    'rhea': 'Rhea ID',
+}
+RHEA_FIELDS = {
+    'rhea-id': 'Reaction identifier',
+    'equation': 'Equation',
+    'chebi-id': 'ChEBI identifier',
+    'smiles': 'Reaction SMILES',
+}
+UNIPROT_QUERY_RE = re.compile(r'uniprot:(\w+)')
+
+def seed(*parts):
+    return int.from_bytes(hashlib.blake2b('|'.join(map(str, parts)).encode(), digest_size=8).digest(), 'big')
+
+def synthetic_names(count):
+    return [f"synthetic enzyme {number}" for number in range(count)]
+
+# Синтетические данные: название -> EC номера -> accession -> реакции Rhea
+
+def name_ec_numbers(name):
+    h = seed('name', name)
+    if h % 10 == 0:
+        return []
+    return [ec_number(seed('name', name, k)) for k in range(1 + h % 3)]
+
+def ec_number(h):
+    # Последняя часть номера не больше 150; номера выше зарезервированы для целей переноса
+    return f"{1 + h % 7}.{1 + (h >> 8) % 20}.{1 + (h >> 16) % 30}.{1 + (h >> 24) % 150}"
+
+def ec_transfer_target(ec):
+    h = seed('transfer', ec)
+    if int(ec.rsplit('.', 1)[1]) > 150 or h % 40:
+        return None
+    return f"{ec.rsplit('.', 1)[0]}.{151 + h % 50}"
+
+def ec_accessions(ec):
+    h = seed('ec', ec)
+    return [accession(seed('ec', ec, k)) for k in range(h % 6)]
+
+def accession(h):
+    # Пул из 150 тысяч accession: на больших входах белки повторяются для разных EC номеров
+    return f"{'PQO'[h % 3]}{(h >> 4) % 50000:05d}"
+
+def accession_rhea_ids(entry):
+    rng = random.Random(seed('rhea', entry))
+    # Ссылки UniProt бывают и на направленные реакции (основной ID + 1..3)
+    return [10000 + 4 * rng.randrange(RHEA_REACTIONS) + rng.randrange(4) for _ in range(rng.randrange(4))]
+
+def master_id(rhea_id):
+    return rhea_id - rhea_id % 4
+
+def reaction(rhea_id):
+    rng = random.Random(seed('reaction', rhea_id))
+    participants = rng.sample(COMPOUNDS, rng.randint(3, 6))
+    split = rng.randint(1, len(participants) - 1)
+    reactants, products = participants[:split], participants[split:]
+    equation = ' + '.join(name for name, _, _ in reactants) + ' = ' + ' + '.join(name for name, _, _ in products)
+    smiles = '.'.join(s for _, s, _ in reactants) + '>>' + '.'.join(s for _, s, _ in products)
+    chebi = ';'.join(f"CHEBI:{chebi_id}" for _, _, chebi_id in participants)
+    return equation, smiles, chebi, participants
+
+def uniprot_values(entry):
+    h = seed('uniprot', entry)
+    if h % 50 == 0:
+        # Часть accession отсутствует в UniProt
+        return None
+    rng = random.Random(h)
+    length = rng.randint(50, 1000)
+    organism, organism_id = ORGANISMS[h % len(ORGANISMS)]
+    return {
+        'accession': entry,
+        'id': f"{entry}_SYNTH",
+        'organism_name': organism,
+        'organism_id': str(organism_id),
+        'gene_names': f"syn{h % 10000}",
+        'protein_name': f"Synthetic protein {entry}",
+        'ec': '',
+        'sequence': ''.join(rng.choices(AMINO_ACIDS, k=length)),
+        'length': str(length),
+        'xref_refseq': f"NP_{h % 1000000:06d}.1;" if h % 3 else '',
+        'reviewed': 'reviewed',
+        'rhea': ' '.join(f"RHEA:{rhea_id}" for rhea_id in accession_rhea_ids(entry)),
+    }
+
+# Синтетические страницы в разметке, которую разбирают этапы
+
+def page(body):
+    return f"<!DOCTYPE html><html><head><title>ENZYME</title></head><body><main><div>{body}</div></main></body></html>"
+
+def byname_page(name):
+    ec_numbers = name_ec_numbers(name)
+    if not ec_numbers:
+        return page(f"<p>{NOT_FOUND_TEXT} '{escape(name)}'</p>")
+    rows = ''.join(
+        f"<tr><td><a href=\"/EC/{ec}\">{ec}</a></td><td>-- {escape(name)}\n-- {escape(name)} ({ec})</td></tr>"
+        for ec in ec_numbers)
+    return page(f"<table class=\"type-1\"><tr><th>EC</th><th>Description</th></tr>{rows}</table>")
+
+def ec_page(ec):
+    target = ec_transfer_target(ec)
+    if target is not None:
+        return page(f"<h3>Transferred entry: <a href=\"/EC/{target}\">{target}</a></h3>")
+    links = ' '.join(f"<a href=\"https://www.uniprot.org/uniprot/{entry}\">{entry}</a>" for entry in ec_accessions(ec))
+    return page(
+        "<table>"
+        f"<tr><th>EC</th><th>{ec}</th></tr>"
+        f"<tr><th colspan=\"2\">Accepted Name</th></tr><tr><td colspan=\"2\">synthetic enzyme {ec}</td></tr>"
+        f"<tr><th colspan=\"2\">Alternative Name(s)</th></tr><tr><td colspan=\"2\">enzyme {ec}</td></tr>"
+        "<tr><th colspan=\"2\">Cross-references</th></tr>"
+        f"<tr><td>UniProtKB/Swiss-Prot</td><td>{links}</td></tr>"
+        "</table>")
+
+def uniprot_tsv(accessions, fields):
+    rows = ['\t'.join(UNIPROT_FIELDS[field] for field in fields)]
+    for entry in dict.fromkeys(accessions):
+        values = uniprot_values(entry)
+        if values is not None:
+            rows.append('\t'.join(values[field] for field in fields))
+    return '\n'.join(rows) + '\n'
+
+def rhea_tsv(query, columns):
+    rhea_ids = {}
+    for entry in UNIPROT_QUERY_RE.findall(query):
+        if uniprot_values(entry) is not None:
+            rhea_ids.update((master_id(rhea_id), None) for rhea_id in accession_rhea_ids(entry))
+    rows = ['\t'.join(RHEA_FIELDS[column] for column in columns)]
+    for rhea_id in rhea_ids:
+        equation, smiles, chebi, _ = reaction(rhea_id)
+        values = {'rhea-id': f"RHEA:{rhea_id}", 'equation': equation, 'chebi-id': chebi, 'smiles': smiles}
+        rows.append('\t'.join(values[column] for column in columns))
+    return '\n'.join(rows) + '\n'
+
+def rhea_search_page(query):
+    rhea_ids = {}
+    for entry in UNIPROT_QUERY_RE.findall(query):
+        rhea_ids.update((master_id(rhea_id), None) for rhea_id in accession_rhea_ids(entry))
+    links = ''.join(f"<li><a href=\"/rhea/{rhea_id}\">RHEA:{rhea_id}</a></li>" for rhea_id in rhea_ids)
+    return page(f"<ul class=\"results\">{links}</ul>")
+
+def rhea_reaction_page(rhea_id):
+    equation, _, _, participants = reaction(master_id(rhea_id))
+    items = ''.join(
+        f"<li class=\"participant\"><span class=\"cell\">{escape(name)}</span>"
+        f"<span class=\"cell\">SMILES</span><span class=\"cell\">{escape(smiles)}</span></li>"
+        for name, smiles, _ in participants)
+    return page(f"<span id=\"equationtext\">{escape(equation)}</span>"
+                f"<div class=\"reaction-participants\"><ul>{items}</ul></div>")
+
+def synthetic_response(source, request):
+    query = request.query
+    if source == 'expasy_byname':
+        return web.Response(text=byname_page(unquote(request.query_string)), content_type='text/html')
+    if source == 'expasy_ec':
+        return web.Response(text=ec_page(request.match_info['ec']), content_type='text/html')
+    if source == 'uniprot':
+        accessions = [entry for entry in query.get('accessions', '').split(',') if entry]
+        fields = [field for field in query.get('fields', 'accession').split(',') if field in UNIPROT_FIELDS]
+        return web.Response(text=uniprot_tsv(accessions, fields), content_type='text/plain')
+    if 'rhea_id' in request.match_info:
+        return web.Response(text=rhea_reaction_page(int(request.match_info['rhea_id'])), content_type='text/html')
+    if query.get('format') == 'tsv':
+        columns = [column for column in query.get('columns', 'rhea-id,equation').split(',') if column in RHEA_FIELDS]
+        return web.Response(text=rhea_tsv(query.get('query', ''), columns), content_type='text/plain')
+    return web.Response(text=rhea_search_page(query.get('query', '')), content_type='text/html')
+
+class ReplayServer:
+    def __init__(self, corpus=None, record=False, synthetic=True, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=503, error_sources=DEFAULT_ERROR_SOURCES, seed_value=0, retry_after=None):
+        self.corpus = Path(corpus) if corpus else None
+        self.record = record
+        self.synthetic = synthetic
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_sources = set(error_sources)
+        self.retry_after = retry_after
+        self.random = random.Random(seed_value)
+        self.stats = Counter()
+        self.client = None
+
+    def corpus_path(self, source, request):
+        key = hashlib.sha1(request.raw_path.encode()).hexdigest()
+        return self.corpus / source / key
+
+    def replay(self, source, request):
+        if self.corpus is None:
+            return None
+        path = self.corpus_path(source, request)
+        meta_path = path.with_suffix('.json')
+        if not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text())
+        return web.Response(body=path.with_suffix('.body').read_bytes(), status=meta['status'],
+                            content_type=meta.get('content_type') or 'text/plain')
+
+    async def fetch_upstream(self, source, request):
+        if self.client is None:
+            self.client = ClientSession(timeout=ClientTimeout(total=120))
+        async with self.client.get(UPSTREAMS[source] + request.raw_path) as response:
+            body = await response.read()
+            status, content_type = response.status, response.content_type
+        if status == 200:
+            path = self.corpus_path(source, request)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.with_suffix('.body').write_bytes(body)
+            path.with_suffix('.json').write_text(json.dumps(
+                {"url": request.raw_path, "status": status, "content_type": content_type}))
+            self.stats[f"{source}:recorded"] += 1
+        return web.Response(body=body, status=status, content_type=content_type)
+
+    def handler(self, source):
+        async def handle(request):
+            self.stats[f"{source}:requests"] += 1
+            if self.latency or self.jitter:
+                await asyncio.sleep(max(0.0, self.random.gauss(self.latency, self.jitter)))
+            if source in self.error_sources and self.random.random() < self.error_rate:
+                self.stats[f"{source}:injected_errors"] += 1
+                headers = {'Retry-After': str(self.retry_after)} if self.retry_after is not None else None
+                return web.Response(status=self.error_status, text="Injected error", headers=headers)
+
+            response = self.replay(source, request)
+            if response is not None:
+                self.stats[f"{source}:replayed"] += 1
+                return response
+            if self.record:
+                return await self.fetch_upstream(source, request)
+            if not self.synthetic:
+                self.stats[f"{source}:missing"] += 1
+                return web.Response(status=404, text="Not in corpus")
+            self.stats[f"{source}:synthetic"] += 1
+            return synthetic_response(source, request)
+        return handle
+
+    async def get_stats(self, request):
+        return web.json_response(dict(self.stats))
+
+    async def reset_stats(self, request):
+        self.stats.clear()
+        return web.json_response({})
+
+    async def close(self, app):
+        if self.client is not None:
+            await self.client.close()
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/cgi-bin/enzyme/enzyme-search-de', self.handler('expasy_byname'))
+        app.router.add_get('/EC/{ec}', self.handler('expasy_ec'))
+        app.router.add_get('/uniprotkb/accessions', self.handler('uniprot'))
+        app.router.add_get('/rhea', self.handler('rhea'))
+        app.router.add_get('/rhea/', self.handler('rhea'))
+        app.router.add_get(r'/rhea/{rhea_id:\d+}', self.handler('rhea'))
+        app.router.add_get('/__stats', self.get_stats)
+        app.router.add_post('/__reset', self.reset_stats)
+        app.on_cleanup.append(self.close)
+        return app
+
+async def serve(server, host, port):
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_host, bound_port = runner.addresses[0][:2]
+    # Первая строка stdout — адрес сервера; по ней benchmarks/pipeline_bench.py узнаёт порт
+    print(f"READY http://{bound_host}:{bound_port}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Локальный сервер-заменитель ExPASy, UniProt и Rhea для бенчмарков")
+    parser.add_argument('--host', default='127.0.0.1', help="Адрес для прослушивания")
+    parser.add_argument('--port', type=int, default=0, help="Порт (0 — любой свободный)")
+    parser.add_argument('--corpus', type=Path, help="Каталог записанных ответов")
+    parser.add_argument('--record', action='store_true', help="Запрашивать отсутствующие в корпусе ответы у настоящих сервисов и сохранять их")
+    parser.add_argument('--no-synthetic', action='store_true', help="Отвечать 404 на запросы, которых нет в корпусе")
+    parser.add_argument('--latency', type=float, default=0.0, help="Средняя задержка ответа, мс")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Стандартное отклонение задержки, мс")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Доля ответов с ошибкой")
+    parser.add_argument('--error-status', type=int, default=503, help="HTTP статус ответов с ошибкой")
+    parser.add_argument('--error-sources', default=','.join(DEFAULT_ERROR_SOURCES), help="Сервисы, в ответы которых добавляются ошибки")
+    parser.add_argument('--retry-after', type=int, help="Заголовок Retry-After (секунды) в ответах с ошибкой")
+    parser.add_argument('--seed', type=int, default=0, help="Начальное значение генератора задержек и ошибок")
+    args = parser.parse_args()
+
+    if args.record and args.corpus is None:
+        logging.error("Для режима --record необходимо указать --corpus.")
+        sys.exit(1)
+    server = ReplayServer(corpus=args.corpus, record=args.record, synthetic=not args.no_synthetic,
+                          latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          error_status=args.error_status, error_sources=args.error_sources.split(','),
+                          seed_value=args.seed, retry_after=args.retry_after)
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
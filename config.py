@@ -0,0 +1,61 @@
+import importlib
+import logging
+import os
+
+# Настройки запуска, общие для всех этапов. Модули этапов при импорте ничего не настраивают
+# и не загружают тяжёлые зависимости: журнал настраивает точка входа (setup_logging),
+# соединение с Redis создаётся при первом обращении к Config.redis(), а pandas, aiohttp,
+# requests и другие библиотеки загружаются при первом использовании (lazy_module).
+# Значения по умолчанию берутся из переменных окружения, поэтому их видят и этапы,
+# запущенные отдельными процессами
+
+DEFAULT_REDIS_URL = 'redis://localhost:6379/0'
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+class Config:
+    def __init__(self, redis_url=None, log_level=None):
+        self.redis_url = redis_url or os.environ.get('ENZYME_REDIS_URL', DEFAULT_REDIS_URL)
+        self.log_level = log_level or os.environ.get('ENZYME_LOG_LEVEL', 'INFO')
+        self.redis_client = None
+
+    def redis(self):
+        if self.redis_client is None:
+            import redis
+            self.redis_client = redis.Redis.from_url(self.redis_url)
+        return self.redis_client
+
+current = None
+
+def get_config():
+    global current
+    if current is None:
+        current = Config()
+    return current
+
+def configure(redis_url=None, log_level=None):
+    # Как и http_cache.configure, передаём настройки этапам в отдельных процессах через окружение
+    global current
+    if redis_url:
+        os.environ['ENZYME_REDIS_URL'] = redis_url
+    if log_level:
+        os.environ['ENZYME_LOG_LEVEL'] = log_level
+    current = Config(redis_url, log_level)
+    return current
+
+def setup_logging():
+    logging.basicConfig(level=get_config().log_level, format=LOG_FORMAT)
+
+class LazyModule:
+    # Модуль загружается при первом обращении к его атрибуту
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attribute):
+        module = self.__dict__['_module']
+        if module is None:
+            module = self.__dict__['_module'] = importlib.import_module(self.__dict__['_name'])
+        return getattr(module, attribute)
+
+def lazy_module(name):
+    return LazyModule(name)
\ No newline at end of file
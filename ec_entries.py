@@ -1,122 +1,328 @@
-import requests
-from lxml import html
-import logging
-import concurrent.futures
-import redis
-import json
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Подключение к Redis
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
-
-def extract_section_content(tree, section_name):
-    try:
-        section_content = ""
-        section_nodes = tree.xpath(f"//th[text()='{section_name}']/../following-sibling::tr")
-        for node in section_nodes:
-            if node.xpath(".//th"):
-                break
-            section_content += " ".join(node.xpath(".//text()")).strip() + "\n"
-        return section_content.strip()
-    except Exception as e:
-        logging.error(f"Error extracting {section_name}: {e}")
-        return ""
-
-def extract_uniprot_entries(tree, section_name):
-    try:
-        entries = []
-        section_node = tree.xpath(f"//td[text()='{section_name}']")
-        if section_node:
-            entry_nodes = section_node[0].xpath("./following-sibling::td[1]//a[contains(@href, 'uniprot')]")
-            for entry_node in entry_nodes:
-                entry_id = entry_node.get("href").split('/')[-1]
-                entries.append(entry_id)
-                logging.info(f"Found UniProt entry: {entry_id}")
-        return "\n".join(entries)
-    except Exception as e:
-        logging.error(f"Error extracting {section_name}: {e}")
-        return ""
-
-def fetch_enzyme_data(ec_number, not_found_ec):
-    try:
-        url = f"https://enzyme.expasy.org/EC/{ec_number}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            tree = html.fromstring(response.content)
-            
-            record = {}
-            record["EC number"] = ec_number
-            
-            accepted_name = extract_section_content(tree, "Accepted Name")
-            alt_names = extract_section_content(tree, "Alternative Name(s)")
-            entries = extract_uniprot_entries(tree, "UniProtKB/Swiss-Prot")
-
-            if accepted_name or alt_names or entries:
-                record["Accepted Name"] = accepted_name
-                record["Alternative Name(s)"] = alt_names
-                record["Entries"] = entries
-                
-                if accepted_name == "Deleted entry":
-                    logging.warning(f"EC number {ec_number} is a deleted entry.")
-                    not_found_ec.append(ec_number)
-                    return None
-                
-                logging.info(f"Data found for EC number {ec_number}")
-                return record
-
-            transferred_entry_xpath = '/html/body/main/div/h3/a'
-            transferred_entry_nodes = tree.xpath(transferred_entry_xpath)
-            if transferred_entry_nodes:
-                new_ec_number = transferred_entry_nodes[0].text.strip()
-                logging.info(f"EC number {ec_number} is a transferred entry to {new_ec_number}. Redirecting...")
-                return fetch_enzyme_data(new_ec_number, not_found_ec)
-
-            logging.warning(f"No data found for EC number {ec_number}")
-            not_found_ec.append(ec_number)
-            return None
-        
-        else:
-            logging.error(f"Error fetching data for EC number {ec_number}: {response.status_code}")
-            return None
-    
-    except Exception as e:
-        logging.error(f"Error fetching data for EC number {ec_number}: {e}")
-        return None
-
-def main():
-    logging.info("Starting script execution")
-
-    # Получаем EC номера из Redis
-    ec_numbers_json = redis_client.get('ec_spider_results')
-    if not ec_numbers_json:
-        logging.error("No EC numbers found in Redis")
-        return
-
-    ec_numbers = json.loads(ec_numbers_json)
-    ec_numbers = [entry['EC Number'] for entry in ec_numbers]
-
-    not_found_ec = []
-    results = []
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_ec = {executor.submit(fetch_enzyme_data, ec_number, not_found_ec): ec_number for ec_number in ec_numbers}
-        
-        for future in concurrent.futures.as_completed(future_to_ec):
-            ec_number = future_to_ec[future]
-            try:
-                data = future.result()
-                if data:
-                    results.append(data)
-            except Exception as e:
-                logging.error(f"Error processing data for EC number '{ec_number}': {e}")
-                not_found_ec.append(ec_number)
-
-    # Сохраняем результаты в Redis
-    redis_client.set('uniprot_entries', json.dumps(results))
-    redis_client.set('not_found_ec', json.dumps(not_found_ec))
-
-    logging.info("Script execution completed")
-
-if __name__ == "__main__":
+from lxml import etree
+import logging
+import asyncio
+import random
+import time
+import argparse
+import os
+from config import lazy_module, setup_logging
+from enzyme_index import open_index
+from http_cache import CacheMiss, get_default_cache
+from journal import ERROR, FOUND, NOT_FOUND
+import metrics
+from ratelimit import THROTTLE_STATUSES, get_limiter
+from storage import EC_ENTRIES, EC_NOT_FOUND, NAMES_EC, RunStore
+
+# Сетевая библиотека загружается при первом запросе
+aiohttp = lazy_module('aiohttp')
+
+EC_URL = f"{os.environ.get('ENZYME_EXPASY_URL', 'https://enzyme.expasy.org')}/EC"
+
+SECTIONS = {"Accepted Name": "accepted_name", "Alternative Name(s)": "alt_names"}
+UNIPROT_SECTION = "UniProtKB/Swiss-Prot"
+
+# Выражения компилируются один раз при импорте, а не на каждый вызов
+HTML_PARSER = etree.HTMLParser()
+ROW_TEXT_XPATH = etree.XPath(".//text()")
+UNIPROT_LINKS_XPATH = etree.XPath(".//a[contains(@href, 'uniprot')]")
+TRANSFERRED_ENTRY_XPATH = etree.XPath('/html/body/main/div/h3/a')
+
+def parse_ec_page(content):
+    # Разбор страницы EC за один проход по строкам таблиц.
+    # Принимает сырые байты ответа или уже разобранное дерево
+    tree = etree.fromstring(content, HTML_PARSER) if isinstance(content, (bytes, str)) else content
+    sections = {key: [] for key in SECTIONS.values()}
+    entries = None
+    current, current_parent = None, None
+
+    for row in tree.iter('tr'):
+        headers = list(row.iter('th'))
+        if headers:
+            current = next((SECTIONS[th.text] for th in headers if th.text in SECTIONS), None)
+            current_parent = row.getparent()
+        elif current and row.getparent() is current_parent:
+            sections[current].append(" ".join(ROW_TEXT_XPATH(row)).strip())
+
+        if entries is None:
+            for cell in row.iterchildren('td'):
+                if cell.text == UNIPROT_SECTION:
+                    links_cell = next(cell.itersiblings('td'), None)
+                    links = UNIPROT_LINKS_XPATH(links_cell) if links_cell is not None else []
+                    entries = [link.get("href").split('/')[-1] for link in links]
+                    break
+
+    result = {
+        "accepted_name": "\n".join(sections["accepted_name"]).strip(),
+        "alt_names": "\n".join(sections["alt_names"]).strip(),
+        "entries": entries or [],
+        "transferred_to": None,
+    }
+    transferred_entry_nodes = TRANSFERRED_ENTRY_XPATH(tree)
+    if transferred_entry_nodes and transferred_entry_nodes[0].text:
+        result["transferred_to"] = transferred_entry_nodes[0].text.strip()
+    logging.debug(f"Found {len(result['entries'])} UniProt entries")
+    return result
+
+def parse_enzyme_page(content, ec_number):
+    # Возвращает (запись, EC номер переноса). Обе части None, если на странице нет данных
+    page = parse_ec_page(content)
+
+    if page["accepted_name"] or page["alt_names"] or page["entries"]:
+        record = {
+            "EC number": ec_number,
+            "Accepted Name": page["accepted_name"],
+            "Alternative Name(s)": page["alt_names"],
+            "Entries": "\n".join(page["entries"]),
+        }
+        return record, None
+
+    return None, page["transferred_to"]
+
+class EnzymeFetcher:
+    # Асинхронная загрузка страниц EC через один пул keep-alive соединений.
+    # Каждый EC номер (в том числе цель переноса) запрашивается не более одного раза за запуск
+    def __init__(self, session, concurrency=16, max_tries=4, backoff=1.0):
+        self.session = session
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_tries = max_tries
+        self.backoff = backoff
+        self.memo = {}
+        self.requests = 0
+        self.retries = 0
+
+    async def fetch_page(self, ec_number):
+        url = f"{EC_URL}/{ec_number}"
+        cache = get_default_cache()
+        if cache is not None:
+            try:
+                cached = await cache.get_async(url, 'expasy_ec')
+            except CacheMiss:
+                logging.error(f"EC number {ec_number} is not in the HTTP cache")
+                return None
+            if cached is not None:
+                if cached.negative:
+                    logging.error(f"Error fetching data for EC number {ec_number}: {cached.status} (cached)")
+                    return None
+                return cached.body
+
+        limiter = get_limiter()
+        for attempt in range(self.max_tries):
+            throttled = False
+            async with self.semaphore:
+                await limiter.acquire_async(url)
+                self.requests += 1
+                start = time.perf_counter()
+                try:
+                    async with self.session.get(url) as response:
+                        metrics.observe_http(url, time.perf_counter() - start, response.status)
+                        await limiter.record_async(url, response.status, time.perf_counter() - start,
+                                                   response.headers.get('Retry-After'))
+                        if response.status == 200:
+                            content = await response.read()
+                            if cache is not None:
+                                await cache.put_async(url, 'expasy_ec', response.status, content)
+                            return content
+                        if response.status != 429 and response.status < 500:
+                            logging.error(f"Error fetching data for EC number {ec_number}: {response.status}")
+                            if cache is not None:
+                                await cache.put_async(url, 'expasy_ec', response.status, b'')
+                            return None
+                        error = f"HTTP {response.status}"
+                        throttled = response.status in THROTTLE_STATUSES
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    metrics.observe_http(url, time.perf_counter() - start, 'error')
+                    error = repr(e)
+
+            if attempt + 1 < self.max_tries:
+                # После 429/503 паузу (в том числе Retry-After) выдерживает общий планировщик хоста,
+                # для остальных ошибок — экспоненциальная задержка со случайным разбросом
+                delay = 0 if throttled else self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logging.warning(f"Retrying EC number {ec_number} in {delay:.1f}s ({error})")
+                self.retries += 1
+                metrics.inc(metrics.HTTP_RETRIES, host=metrics.host_of(url))
+                await asyncio.sleep(delay)
+
+        logging.error(f"Error fetching data for EC number {ec_number}: {error}")
+        return None
+
+    async def load(self, ec_number):
+        content = await self.fetch_page(ec_number)
+        if content is None:
+            return None
+        return parse_enzyme_page(content, ec_number)
+
+    async def resolve(self, ec_number):
+        # Возвращает (запись, статус): 'found', 'not_found' или 'error'
+        visited = set()
+        while ec_number not in visited:
+            visited.add(ec_number)
+            # Загрузка страницы мемоизируется, поэтому общие цели переноса запрашиваются один раз
+            if ec_number not in self.memo:
+                self.memo[ec_number] = asyncio.ensure_future(self.load(ec_number))
+            page = await self.memo[ec_number]
+            if page is None:
+                return None, "error"
+
+            record, new_ec_number = page
+            if record:
+                if record["Accepted Name"] == "Deleted entry":
+                    logging.warning(f"EC number {ec_number} is a deleted entry.")
+                    return None, "not_found"
+                logging.info(f"Data found for EC number {ec_number}")
+                return record, "found"
+
+            if not new_ec_number:
+                logging.warning(f"No data found for EC number {ec_number}")
+                return None, "not_found"
+
+            logging.info(f"EC number {ec_number} is a transferred entry to {new_ec_number}. Redirecting...")
+            ec_number = new_ec_number
+
+        logging.warning(f"Transfer cycle detected for EC number {ec_number}")
+        return None, "not_found"
+
+async def fetch_all_enzyme_data_async(ec_numbers, concurrency=16, timeout=30, outcomes=None, redirects=None,
+                                      checkpoint=None):
+    # redirects: EC номер -> номер, который нужно запросить вместо него (цель переноса из локального индекса).
+    # Итог и отсутствие записи учитываются под исходным EC номером.
+    # checkpoint(EC номер, запись или None, итог) вызывается сразу по завершении каждого EC номера
+    outcomes = {} if outcomes is None else outcomes
+    redirects = redirects or {}
+    not_found_ec = []
+    results = []
+    seen = set()
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=concurrency),
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as session:
+        fetcher = EnzymeFetcher(session, concurrency=concurrency)
+
+        async def resolve(ec_number):
+            record, status = await fetcher.resolve(redirects.get(ec_number, ec_number))
+            if checkpoint is not None:
+                checkpoint(ec_number, record, {"found": FOUND, "not_found": NOT_FOUND}.get(status, ERROR))
+            return record, status
+
+        resolved = await asyncio.gather(*(resolve(ec_number) for ec_number in ec_numbers), return_exceptions=True)
+
+    for ec_number, outcome in zip(ec_numbers, resolved):
+        if isinstance(outcome, BaseException):
+            logging.error(f"Error processing data for EC number '{ec_number}': {outcome}")
+            not_found_ec.append(ec_number)
+            outcomes[ec_number] = ERROR
+            if checkpoint is not None:
+                checkpoint(ec_number, None, ERROR)
+            continue
+        record, status = outcome
+        outcomes[ec_number] = {"found": FOUND, "not_found": NOT_FOUND}.get(status, ERROR)
+        if status == "not_found":
+            not_found_ec.append(ec_number)
+        elif record and record["EC number"] not in seen:
+            # Несколько EC номеров могут быть перенесены в одну и ту же запись
+            seen.add(record["EC number"])
+            results.append(record)
+
+    elapsed = time.perf_counter() - start
+    if elapsed > 0:
+        logging.info(f"{fetcher.requests} requests ({fetcher.retries} retries) in {elapsed:.2f}s, "
+                     f"{fetcher.requests / elapsed:.1f} requests/s")
+    return results, not_found_ec
+
+def lookup_in_index(index, ec_numbers, results, not_found_ec, outcomes=None, checkpoint=None):
+    # Отвечаем из локального индекса enzyme.dat, остаток возвращаем для запроса на сайт:
+    # исходный EC номер -> номер для запроса (цель переноса, которой нет в индексе, или он сам).
+    # Итог записывается под исходным EC номером, цель переноса остаётся в записи ("EC number")
+    outcomes = {} if outcomes is None else outcomes
+    remaining = {}
+    seen = {record["EC number"] for record in results}
+    for ec_number in ec_numbers:
+        record, status = index.lookup_ec(ec_number)
+        if status == "active":
+            # Несколько EC номеров могут быть перенесены в одну и ту же запись
+            if record["EC number"] not in seen:
+                seen.add(record["EC number"])
+                results.append(record)
+            outcomes[ec_number] = FOUND
+            if checkpoint is not None:
+                checkpoint(ec_number, record, FOUND)
+        elif status == "deleted":
+            logging.warning(f"EC number {ec_number} is a deleted entry.")
+            not_found_ec.append(ec_number)
+            outcomes[ec_number] = NOT_FOUND
+            if checkpoint is not None:
+                checkpoint(ec_number, None, NOT_FOUND)
+        else:
+            remaining[ec_number] = record
+    logging.info(f"{len(ec_numbers) - len(remaining)} of {len(ec_numbers)} EC numbers resolved from local index")
+    return remaining
+
+async def resolve_with_index(fetcher, ec_number, index=None):
+    # Один EC номер: локальный индекс, затем сайт. Возвращает (запись, статус), как EnzymeFetcher.resolve
+    if index is not None:
+        record, status = index.lookup_ec(ec_number)
+        if status == "active":
+            return record, "found"
+        if status == "deleted":
+            logging.warning(f"EC number {ec_number} is a deleted entry.")
+            return None, "not_found"
+        ec_number = record
+    return await fetcher.resolve(ec_number)
+
+def fetch_all_enzyme_data(ec_numbers, index=None, concurrency=16, timeout=30, outcomes=None, checkpoint=None):
+    # outcomes (если передан) заполняется итогом по каждому EC номеру для журнала запуска,
+    # checkpoint(EC номер, запись или None, итог) вызывается по мере получения каждого итога
+    not_found_ec = []
+    results = []
+    redirects = None
+
+    if index is not None:
+        redirects = lookup_in_index(index, ec_numbers, results, not_found_ec, outcomes, checkpoint)
+        ec_numbers = list(redirects)
+
+    if ec_numbers:
+        web_results, web_not_found = asyncio.run(fetch_all_enzyme_data_async(ec_numbers, concurrency, timeout,
+                                                                             outcomes, redirects, checkpoint))
+        seen = {record["EC number"] for record in results}
+        results.extend(record for record in web_results if record["EC number"] not in seen)
+        not_found_ec.extend(web_not_found)
+
+    return results, not_found_ec
+
+def save_results(store, results, not_found_ec):
+    store.write(EC_ENTRIES, results)
+    store.write(EC_NOT_FOUND, [{"EC number": ec_number} for ec_number in not_found_ec])
+
+def main():
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Получение информации о ферментах по EC номерам с ExPASy")
+    parser.add_argument('--run-id', type=str, required=True, help="Идентификатор запуска для ключей Redis")
+    parser.add_argument('--index', type=str, help="Путь к локальному индексу ENZYME (enzyme_index.py)")
+    parser.add_argument('--concurrency', type=int, default=16, help="Максимальное число одновременных запросов")
+    parser.add_argument('--timeout', type=float, default=30, help="Таймаут одного запроса, с")
+    args = parser.parse_args()
+
+    logging.info("Starting script execution")
+
+    # Получаем EC номера из Redis
+    store = RunStore(args.run_id)
+    ec_numbers = [entry['EC Number'] for entry in store.iter_records(NAMES_EC)]
+    if not ec_numbers:
+        logging.error("No EC numbers found in Redis")
+        return
+
+    with metrics.stage(EC_ENTRIES, items_in=len(ec_numbers)):
+        results, not_found_ec = fetch_all_enzyme_data(ec_numbers, index=open_index(args.index),
+                                                        concurrency=args.concurrency, timeout=args.timeout)
+    metrics.items_out(EC_ENTRIES, len(results))
+
+    # Сохраняем результаты в Redis
+    save_results(store, results, not_found_ec)
+    store.mark_done(EC_ENTRIES)
+    metrics.publish(store, EC_ENTRIES)
+
+    logging.info("Script execution completed")
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
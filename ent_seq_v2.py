@@ -1,228 +1,926 @@
-import sys
-import os
-import logging
-import redis
-import json
-import argparse
-import requests
-from multiprocessing import Pool, Manager
-import pandas as pd
-from io import StringIO
-from time import sleep
-from tqdm import tqdm
-import subprocess
-import shutil
-
-os.environ["PATH"] += os.pathsep + "/usr/bin"
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Подключение к Redis
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
-
-def string4mapping(columns=None):
-    columns_dict = {
-        'Entry': 'accession',
-        'Entry Name': 'id',
-        'Organism': 'organism_name',
-        'Organism ID': 'organism_id',
-        'Gene Names': 'gene_names',
-        'Protein names': 'protein_name',
-        'EC number': 'ec',
-        'Sequence': 'sequence',
-        'Length': 'length',
-        'RefSeq': 'xref_refseq',
-        'Status': 'reviewed',
-    }
-    return ','.join([columns_dict[column] for column in columns]) if columns else None
-
-def uniprot_request(ids, columns=None, output_format='tsv'):
-    fields = f'&fields={string4mapping(columns=columns)}' if columns else ''
-    url = f"https://rest.uniprot.org/uniprotkb/accessions?accessions={','.join(ids)}{fields}&format={output_format}"
-    response = requests.get(url)
-    response.raise_for_status()
-    return response.text
-
-def get_uniprot_information(ids, columns=None, step=1000, sleep_time=3, max_tries=3):
-    result = pd.DataFrame()
-    session = requests.Session()  # Используем сессию для ускорения запросов
-
-    for i in tqdm(range(0, len(ids), step), desc='Fetching UniProt data'):
-        tries = 0
-        done = False
-        j = min(i + step, len(ids))
-        while not done and tries < max_tries:
-            try:
-                data = uniprot_request(ids[i:j], columns=columns)
-                if data:
-                    uniprot_info = pd.read_csv(StringIO(data), sep='\t')
-                    result = pd.concat([result, uniprot_info])
-                done = True
-            except requests.RequestException as e:
-                logging.error(f'ID mapping failed. Attempt {tries+1} of {max_tries}. Error: {e}')
-                tries += 1
-                sleep(sleep_time)
-    return result
-
-def fetch_protein_data_by_ac(entry):
-    try:
-        logging.info(f"Fetching data for UniProtKB AC '{entry}'")
-        result = get_uniprot_information(
-            [entry],
-            columns=['Entry', 'Entry Name', 'Protein names', 'Gene Names', 'EC number', 'Organism', 
-                     'Organism ID', 'Sequence', 'Length', 'RefSeq', 'Status']
-        )
-        if not result.empty:
-            return result.to_dict('records')
-        else:
-            logging.info(f"No data found for UniProtKB AC '{entry}'")
-            return []
-    except Exception as e:
-        logging.error(f"Error fetching data for UniProtKB AC '{entry}': {e}")
-        return []
-
-def fetch_and_process_data(entry):
-    try:
-        data = fetch_protein_data_by_ac(entry)
-        if data:
-            logging.info(f"Found {len(data)} results for Entry '{entry}'")
-            return data
-        else:
-            logging.info(f"No data found for Entry '{entry}'")
-            return []
-    except Exception as e:
-        logging.error(f"Error fetching data for Entry '{entry}': {e}")
-        return []
-
-def parallel_fetch(entries, func, num_of_processes=8):
-    with Manager() as manager:
-        with Pool(processes=num_of_processes) as pool:
-            results = pool.map(func, entries)
-    return [item for sublist in results for item in sublist]
-
-def make_diamond_database(fasta_file, database_path):
-    command = [
-        'diamond', 'makedb',
-        '--in', fasta_file,
-        '--db', database_path
-    ]
-    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if process.returncode != 0:
-        logging.error(f"Error creating DIAMOND database: {process.stderr}")
-        sys.exit(1)
-    else:
-        logging.info("DIAMOND database created successfully.")
-
-def run_diamond(query, database, output, threads, mode):
-    # Проверяем, доступен ли DIAMOND в системе
-    diamond_path = shutil.which('diamond')
-    if not diamond_path:
-        logging.error("DIAMOND не найден в системе. Убедитесь, что DIAMOND установлен и доступен в PATH.")
-        sys.exit(1)
-
-    command = [
-        diamond_path,
-        'blastp',
-        '--query', query,
-        '--db', database,
-        '--out', output,
-        '--threads', str(threads),
-        '--outfmt', '6',
-        '--sensitive' if mode == 'sensitive' else '--fast'
-    ]
-    
-    logging.info(f"Запуск команды DIAMOND: {' '.join(command)}")
-    
-    try:
-        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-        logging.info("DIAMOND search completed successfully.")
-        logging.debug(f"DIAMOND output: {process.stdout}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error running DIAMOND search: {e.stderr}")
-        sys.exit(1)
-    except FileNotFoundError:
-        logging.error(f"DIAMOND executable not found at {diamond_path}. Please make sure DIAMOND is installed correctly.")
-        sys.exit(1)
-
-def run_diamond_processes(args):
-    # Функция для работы только с DIAMOND
-    fasta_file = "input_sequences.fasta"
-    diamond_db = f"{args.database}.dmnd"
-    aligned_output = "diamond_results.m8"
-    
-    # Создание базы данных DIAMOND
-    if not os.path.isfile(diamond_db):
-        make_diamond_database(fasta_file, diamond_db)
-    
-    # Запуск DIAMOND поиска
-    run_diamond(
-        query=fasta_file,
-        database=diamond_db,
-        output=aligned_output,
-        threads=args.threads,
-        mode=args.diamond_mode
-    )
-
-def save_to_fasta(data, output_file='output_sequences.fasta'):
-    with open(output_file, 'w') as fasta_file:
-        for entry in data:
-            entry_id = entry.get("Entry", "unknown")
-            protein_name = entry.get("Protein names", "unknown_protein")
-            sequence = entry.get("Sequence", "")
-
-            # Пропускаем, если последовательность пуста
-            if not sequence:
-                continue
-
-            # Записываем в формате FASTA
-            fasta_file.write(f">{entry_id} {protein_name}\n")
-            # Разбиваем последовательность на строки по 60 символов для читаемости
-            for i in range(0, len(sequence), 60):
-                fasta_file.write(sequence[i:i + 60] + '\n')
-
-    logging.info(f"FASTA файл успешно создан: {output_file}")
-
-def main():
-    parser = argparse.ArgumentParser(description="Скрипт для анализа данных с использованием DIAMOND")
-    parser.add_argument('--use-diamond', action='store_true', help="Включить функционал DIAMOND для анализа")
-    parser.add_argument('--query', help="Путь к файлу запроса для DIAMOND")
-    parser.add_argument('--db', help="Путь к базе данных DIAMOND")
-    parser.add_argument('--out', help="Путь к выходному файлу DIAMOND")
-    parser.add_argument('--threads', type=int, default=os.cpu_count(), help="Количество потоков для DIAMOND")
-    parser.add_argument('--diamond-mode', default='fast', choices=['fast', 'sensitive'], help="Режим работы DIAMOND")
-    args = parser.parse_args()
-
-    if args.use_diamond:
-        if not all([args.query, args.db, args.out]):
-            logging.error("Для использования DIAMOND необходимо указать --query, --db и --out.")
-            sys.exit(1)
-        
-        run_diamond(
-            query=args.query,
-            database=args.db,
-            output=args.out,
-            threads=args.threads,
-            mode=args.diamond_mode
-        )
-    else:
-        # Получаем UniProt записи из Redis
-        uniprot_entries_json = redis_client.get('uniprot_entries')
-        if not uniprot_entries_json:
-            logging.error("No UniProt entries found in Redis")
-            return
-
-        uniprot_entries = json.loads(uniprot_entries_json)
-        entries = [entry['Entries'] for entry in uniprot_entries if 'Entries' in entry]
-        entries = [item for sublist in entries for item in sublist.split('\n') if item]
-
-        results = parallel_fetch(entries, fetch_and_process_data, num_of_processes=os.cpu_count())
-        
-        # Сохраняем результаты в Redis
-        redis_client.set('ent_seq_results', json.dumps(results))
-    
-        save_to_fasta(results)
-    
-    logging.info("Script execution completed")
-
-if __name__ == "__main__":
+import sys
+import os
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from io import BufferedReader, StringIO
+from itertools import chain
+from time import perf_counter, sleep
+import subprocess
+import shutil
+import hashlib
+import tempfile
+import gzip
+import zlib
+from http_cache import CacheMiss, get_default_cache
+from journal import ERROR, FOUND, NOT_FOUND
+import metrics
+from config import lazy_module, setup_logging
+from ratelimit import THROTTLE_STATUSES, get_limiter
+from storage import EC_ENTRIES, SEQUENCES, RunStore
+
+# pandas и requests загружаются при первом использовании
+pd = lazy_module('pandas')
+requests = lazy_module('requests')
+
+def string4mapping(columns=None):
+    columns_dict = {
+        'Entry': 'accession',
+        'Entry Name': 'id',
+        'Organism': 'organism_name',
+        'Organism ID': 'organism_id',
+        'Gene Names': 'gene_names',
+        'Protein names': 'protein_name',
+        'EC number': 'ec',
+        'Sequence': 'sequence',
+        'Length': 'length',
+        'RefSeq': 'xref_refseq',
+        'Status': 'reviewed',
+    }
+    return ','.join([columns_dict[column] for column in columns]) if columns else None
+
+UNIPROT_ACCESSIONS_URL = f"{os.environ.get('ENZYME_UNIPROT_URL', 'https://rest.uniprot.org')}/uniprotkb/accessions"
+UNIPROT_MAX_ACCESSIONS = 1000  # Ограничение API на количество accession в одном запросе
+PROTEIN_COLUMNS = ['Entry', 'Entry Name', 'Protein names', 'Gene Names', 'EC number', 'Organism',
+                   'Organism ID', 'Sequence', 'Length', 'RefSeq', 'Status']
+
+def timed_get(url, session=None, timeout=60):
+    limiter = get_limiter()
+    limiter.acquire(url)
+    start = perf_counter()
+    try:
+        response = (session or requests).get(url, timeout=timeout)
+    except requests.RequestException:
+        metrics.observe_http(url, perf_counter() - start, 'error')
+        raise
+    metrics.observe_http(url, perf_counter() - start, response.status_code)
+    limiter.record(url, response.status_code, perf_counter() - start, response.headers.get('Retry-After'))
+    return response
+
+def uniprot_request(ids, columns=None, output_format='tsv', session=None, timeout=60):
+    fields = f'&fields={string4mapping(columns=columns)}' if columns else ''
+    cache = get_default_cache()
+    if cache is not None and output_format == 'tsv' and columns and columns[0] == 'Entry':
+        return cached_uniprot_request(cache, ids, columns, fields, session, timeout)
+
+    url = f"{UNIPROT_ACCESSIONS_URL}?accessions={','.join(ids)}{fields}&format={output_format}"
+    cached = cache.get(url, 'uniprot') if cache is not None else None
+    if cached is not None:
+        return cached.body.decode()
+    response = timed_get(url, session, timeout)
+    response.raise_for_status()
+    if cache is not None:
+        cache.put(url, 'uniprot', response.status_code, response.content)
+    return response.text
+
+def request_uniprot_rows(accessions, fields, session=None, timeout=60):
+    # Возвращает (заголовок TSV или None, строки записей)
+    url = f"{UNIPROT_ACCESSIONS_URL}?accessions={','.join(accessions)}{fields}&format=tsv"
+    response = timed_get(url, session, timeout)
+    response.raise_for_status()
+    lines = [line for line in response.text.splitlines() if line]
+    return (lines[0] if lines else None), lines[1:]
+
+def resolve_unmatched_accessions(accessions, fields, session=None, timeout=60, rows=None):
+    # Строки для accession, не совпавших ни с одним Entry ответа (вторичные или отсутствующие в UniProt).
+    # Пустой ответ на группу значит, что ни одного её accession нет в UniProt; иначе группа делится
+    # пополам, пока строки не будут отнесены к одному accession. Число запросов растёт с числом
+    # вторичных accession, а не с размером группы. rows — уже известный ответ на всю группу
+    header = None
+    if rows is None:
+        header, rows = request_uniprot_rows(accessions, fields, session, timeout)
+    if not rows:
+        return header, {accession: [] for accession in accessions}
+    if len(accessions) == 1:
+        return header, {accessions[0]: rows}
+    middle = len(accessions) // 2
+    resolved = {}
+    for group in (accessions[:middle], accessions[middle:]):
+        group_header, group_rows = resolve_unmatched_accessions(group, fields, session, timeout)
+        header = header or group_header
+        resolved.update(group_rows)
+    return header, resolved
+
+def cached_uniprot_request(cache, ids, columns, fields, session=None, timeout=60):
+    # Построчный кэш: строки TSV хранятся под каждым запрошенным accession, поэтому при частично
+    # совпадающих запусках запрашиваются только отсутствующие в кэше accession. Для вторичного
+    # accession UniProt возвращает строку основной записи, она кэшируется и под вторичным.
+    # Accession, которых нет в UniProt, запоминаются отметкой "не найдено" (только заголовок таблицы)
+    # со сроком кэша отрицательных ответов. В режиме "только кэш" промах по любому accession — CacheMiss:
+    # пачка считается ошибочной, а не ненайденной
+    def accession_key(accession):
+        return f"{UNIPROT_ACCESSIONS_URL}/{accession}?{fields}"
+
+    header = None
+    rows = []
+    missing = []
+    for accession in dict.fromkeys(ids):
+        cached = cache.get(accession_key(accession), 'uniprot')
+        if cached is None:
+            missing.append(accession)
+            continue
+        cached_header, _, cached_rows = cached.body.decode().partition('\n')
+        header = cached_header or header
+        if cached_rows:
+            rows.extend(cached_rows.split('\n'))
+
+    if missing:
+        fetched_header, fetched = request_uniprot_rows(missing, fields, session, timeout)
+        header = fetched_header or header
+        rows.extend(fetched)
+        by_accession = {}
+        for row in fetched:
+            by_accession.setdefault(row.split('\t', 1)[0], []).append(row)
+        unmatched = [accession for accession in missing if accession not in by_accession]
+        other = set(by_accession) - set(missing)
+        if unmatched and other:
+            # В ответе есть строки под другими (основными) accession: соответствие вторичных
+            # accession и этих строк устанавливается дополнительными запросами по несовпавшим accession
+            own_header, resolved = resolve_unmatched_accessions(
+                unmatched, fields, session, timeout, rows=[row for accession in other for row in by_accession[accession]])
+            header = header or own_header
+            by_accession.update(resolved)
+        for accession in missing:
+            found = by_accession.get(accession)
+            if found:
+                cache.put(accession_key(accession), 'uniprot', 200, '\n'.join([header] + found).encode())
+            else:
+                cache.put(accession_key(accession), 'uniprot', 404, (header or '').encode(), negative=True)
+
+    if header is None:
+        return ''
+    # Строка основной записи может прийти и под своим, и под вторичным accession
+    return '\n'.join([header] + list(dict.fromkeys(rows))) + '\n'
+
+# Компактные типы для столбцов TSV ответа UniProt: организмы и статус повторяются, длина помещается в int32.
+# Текстовые столбцы явно строковые, чтобы пустой в одной пачке столбец (например, RefSeq) не менял схему
+COMPACT_DTYPES = {
+    'Entry': 'string',
+    'Entry Name': 'string',
+    'Protein names': 'string',
+    'Gene Names': 'string',
+    'EC number': 'string',
+    'Sequence': 'string',
+    'RefSeq': 'string',
+    'Organism': 'category',
+    'Organism (ID)': 'int32',
+    'Length': 'int32',
+    'Reviewed': 'category',
+}
+
+def fetch_uniprot_chunk(ids, columns=None, session=None, sleep_time=3, max_tries=3, dtype=None):
+    tries = 0
+    while tries < max_tries:
+        try:
+            data = uniprot_request(ids, columns=columns, session=session)
+            return pd.read_csv(StringIO(data), sep='\t', dtype=dtype) if data else None
+        except CacheMiss:
+            logging.warning(f"UniProt response for {len(ids)} ACs is not in the HTTP cache")
+            return None
+        except requests.RequestException as e:
+            logging.error(f'ID mapping failed. Attempt {tries+1} of {max_tries}. Error: {e}')
+            tries += 1
+            if tries < max_tries:
+                metrics.inc(metrics.HTTP_RETRIES, host=metrics.host_of(UNIPROT_ACCESSIONS_URL))
+            # После 429/503 паузу выдерживает общий планировщик хоста (timed_get)
+            if getattr(e.response, 'status_code', None) not in THROTTLE_STATUSES:
+                sleep(sleep_time)
+    return None
+
+def get_uniprot_information(ids, columns=None, step=1000, sleep_time=3, max_tries=3):
+    chunks = []
+    from tqdm import tqdm
+    session = requests.Session()  # Используем сессию для ускорения запросов
+
+    for i in tqdm(range(0, len(ids), step), desc='Fetching UniProt data'):
+        j = min(i + step, len(ids))
+        uniprot_info = fetch_uniprot_chunk(ids[i:j], columns=columns, session=session,
+                                           sleep_time=sleep_time, max_tries=max_tries)
+        if uniprot_info is not None:
+            chunks.append(uniprot_info)
+    # Один pd.concat в конце вместо копирования накопленного результата на каждой итерации
+    return pd.concat(chunks) if chunks else pd.DataFrame()
+
+def fetch_protein_data_by_ac(entry):
+    try:
+        logging.info(f"Fetching data for UniProtKB AC '{entry}'")
+        result = get_uniprot_information([entry], columns=PROTEIN_COLUMNS)
+        if not result.empty:
+            return result.to_dict('records')
+        else:
+            logging.info(f"No data found for UniProtKB AC '{entry}'")
+            return []
+    except Exception as e:
+        logging.error(f"Error fetching data for UniProtKB AC '{entry}': {e}")
+        return []
+
+def fetch_and_process_data(entry):
+    try:
+        data = fetch_protein_data_by_ac(entry)
+        if data:
+            logging.info(f"Found {len(data)} results for Entry '{entry}'")
+            return data
+        else:
+            logging.info(f"No data found for Entry '{entry}'")
+            return []
+    except Exception as e:
+        logging.error(f"Error fetching data for Entry '{entry}': {e}")
+        return []
+
+def parallel_fetch(entries, func, num_of_processes=8):
+    from multiprocessing import Pool
+    with Pool(processes=num_of_processes) as pool:
+        results = pool.map(func, entries)
+    return [item for sublist in results for item in sublist]
+
+def pooled_session(concurrency):
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def iter_uniprot_chunks(entries, step=UNIPROT_MAX_ACCESSIONS, concurrency=4, dtype=None):
+    # Отдаёт (номер пачки, DataFrame) по мере завершения запросов. В работе одновременно
+    # не больше concurrency пачек, поэтому память ограничена несколькими пачками
+    entries = list(dict.fromkeys(entries))
+    chunks = [entries[i:i + step] for i in range(0, len(entries), step)]
+    logging.info(f"Fetching {len(entries)} unique UniProtKB ACs in {len(chunks)} requests")
+    from tqdm import tqdm
+
+    pending = {}
+    next_chunk = 0
+    with pooled_session(concurrency) as session, ThreadPoolExecutor(max_workers=concurrency) as executor, \
+            tqdm(total=len(chunks), desc='Fetching UniProt data') as progress:
+        while pending or next_chunk < len(chunks):
+            while next_chunk < len(chunks) and len(pending) < concurrency:
+                future = executor.submit(fetch_uniprot_chunk, chunks[next_chunk], PROTEIN_COLUMNS, session, dtype=dtype)
+                pending[future] = next_chunk
+                next_chunk += 1
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                progress.update(1)
+                try:
+                    chunk_info = future.result()
+                except Exception as e:
+                    logging.error(f"Error fetching UniProt batch {index + 1} of {len(chunks)}: {e}")
+                    continue
+                if chunk_info is not None:
+                    yield index, chunk_info
+
+def fetch_protein_data_batched(entries, step=UNIPROT_MAX_ACCESSIONS, concurrency=4, outcomes=None, checkpoint=None):
+    # Один запрос на пачку до step accession вместо запроса на каждый accession.
+    # checkpoint(записи, {accession: итог}) вызывается для каждой полученной пачки по мере завершения запросов
+    unique_entries = list(dict.fromkeys(entries))
+    results = {}
+    for index, chunk_info in iter_uniprot_chunks(entries, step=step, concurrency=concurrency):
+        results[index] = chunk_info.to_dict('records')
+        if checkpoint is not None:
+            found = {record.get('Entry') for record in results[index]}
+            checkpoint(results[index], {entry: FOUND if entry in found else NOT_FOUND
+                                        for entry in unique_entries[index * step:(index + 1) * step]})
+
+    # Сохраняем порядок пачек, чтобы результат не зависел от порядка завершения запросов
+    records = [record for index in sorted(results) for record in results[index]]
+    found = {record.get('Entry') for record in records}
+    missing = [entry for entry in dict.fromkeys(entries) if entry not in found]
+    if missing:
+        logging.info(f"No data found for {len(missing)} UniProtKB ACs")
+    if outcomes is not None:
+        # Нумерация пачек совпадает с iter_uniprot_chunks: пачки без ответа считаются ошибкой
+        for position, entry in enumerate(unique_entries):
+            outcomes[entry] = FOUND if entry in found else NOT_FOUND if position // step in results else ERROR
+    return records
+
+class ColumnarWriter:
+    # Дописывает пачки в Parquet файл по мере поступления (требуется pyarrow)
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.writer = None
+
+    def write(self, chunk):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Категории у разных пачек различаются, поэтому в файл пишем обычные строки:
+        # Parquet всё равно хранит их со словарным кодированием
+        categorical = [column for column in chunk.columns if isinstance(chunk[column].dtype, pd.CategoricalDtype)]
+        chunk = chunk.astype({column: object for column in categorical})
+        if self.writer is None:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            self.writer = pq.ParquetWriter(self.output_file, table.schema)
+        else:
+            table = pa.Table.from_pandas(chunk, schema=self.writer.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            logging.info(f"Parquet файл успешно создан: {self.output_file}")
+
+DIAMOND_CACHE_DIR = '.diamond_cache'
+DIAMOND_MIN_SHARD_BYTES = 1024 * 1024  # Меньшие запросы не делим: запуск DIAMOND дороже выигрыша
+DIAMOND_THREADS_PER_SHARD = 4  # Каждая часть загружает базу в память, поэтому частей меньше, чем потоков
+
+def file_digest(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def is_fasta(path):
+    with open_fasta(path) as f:
+        return f.read(1) == b'>'
+
+def diamond_executable():
+    # DIAMOND ищется в PATH, а затем в /usr/bin (раньше этот каталог дописывался в PATH при импорте)
+    return shutil.which('diamond') or shutil.which('diamond', path='/usr/bin')
+
+def make_diamond_database(fasta_file, database_path):
+    # Ошибки DIAMOND передаются вызывающему как RuntimeError: сборка может идти и в рабочем потоке
+    command = [
+        diamond_executable() or 'diamond', 'makedb',
+        '--in', fasta_file,
+        '--db', database_path
+    ]
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Error creating DIAMOND database: {process.stderr}")
+    logging.info("DIAMOND database created successfully.")
+
+def cached_diamond_database(fasta_file, cache_dir=None):
+    # База DIAMOND адресуется хэшем содержимого FASTA: изменённый FASTA получает новую базу,
+    # неизменённый переиспользует готовую независимо от имени и времени изменения файла
+    cache_dir = cache_dir or os.environ.get('ENZYME_DIAMOND_CACHE', DIAMOND_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(fasta_file))[0]
+    database_path = os.path.join(cache_dir, f"{stem}.{file_digest(fasta_file)[:16]}.dmnd")
+    if os.path.isfile(database_path):
+        logging.info(f"Используется готовая база DIAMOND: {database_path}")
+        return database_path
+
+    # Собираем во временный файл и переименовываем, чтобы прерванная сборка не попала в кэш
+    temporary_path = f"{database_path[:-len('.dmnd')]}.{os.getpid()}.tmp.dmnd"
+    try:
+        make_diamond_database(fasta_file, temporary_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    os.replace(temporary_path, database_path)
+    return database_path
+
+def split_fasta(fasta_file, shards, output_dir):
+    # Делит FASTA на последовательные по порядку записей части примерно равного размера,
+    # поэтому склеенные по порядку результаты частей идут в порядке исходного запроса
+    if fasta_compression(fasta_file) is None:
+        total_size = os.path.getsize(fasta_file)
+    else:
+        # Для сжатого файла части делятся по размеру распакованных данных
+        with open_fasta(fasta_file) as source:
+            total_size = sum(len(chunk) for chunk in iter(lambda: source.read(FASTA_BLOCK_SIZE), b''))
+    target_size = total_size / shards
+    paths = []
+    shard = None
+    written = 0
+    try:
+        with open_fasta(fasta_file) as source:
+            for line in source:
+                if line.startswith(b'>') and (shard is None or (written >= target_size and len(paths) < shards)):
+                    if shard is not None:
+                        shard.close()
+                    paths.append(os.path.join(output_dir, f"shard_{len(paths):04d}.fasta"))
+                    shard = open(paths[-1], 'wb')
+                    written = 0
+                if shard is not None:
+                    shard.write(line)
+                    written += len(line)
+    finally:
+        if shard is not None:
+            shard.close()
+    return paths
+
+def run_diamond(query, database, output, threads, mode):
+    # Ошибки передаются вызывающему как RuntimeError: части запроса run_diamond_sharded
+    # выполняются в пуле потоков, а завершать процесс решает main
+    diamond_path = diamond_executable()
+    if not diamond_path:
+        raise RuntimeError("DIAMOND не найден в системе. Убедитесь, что DIAMOND установлен и доступен в PATH.")
+
+    command = [
+        diamond_path,
+        'blastp',
+        '--query', query,
+        '--db', database,
+        '--out', output,
+        '--threads', str(threads),
+        '--outfmt', '6',
+        '--sensitive' if mode == 'sensitive' else '--fast'
+    ]
+    
+    logging.info(f"Запуск команды DIAMOND: {' '.join(command)}")
+    
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+        logging.info("DIAMOND search completed successfully.")
+        logging.debug(f"DIAMOND output: {process.stdout}")
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Error running DIAMOND search: {e.stderr}") from e
+    except FileNotFoundError as e:
+        raise RuntimeError(f"DIAMOND executable not found at {diamond_path}. "
+                           f"Please make sure DIAMOND is installed correctly.") from e
+
+def run_diamond_sharded(query, database, output, threads, mode, shards=None):
+    # Запрос делится на части, которые выполняются параллельно; потоки делятся между частями поровну.
+    # Результаты частей склеиваются в output в исходном порядке
+    threads = max(1, threads or 1)
+    shards = shards or threads // DIAMOND_THREADS_PER_SHARD
+    shards = max(1, min(shards, threads, -(-os.path.getsize(query) // DIAMOND_MIN_SHARD_BYTES)))
+    if shards == 1:
+        run_diamond(query, database, output, threads, mode)
+        return
+
+    output_dir = os.path.dirname(os.path.abspath(output))
+    with tempfile.TemporaryDirectory(prefix='diamond_shards_', dir=output_dir) as shard_dir:
+        shard_queries = split_fasta(query, shards, shard_dir)
+        shard_outputs = [f"{path[:-len('.fasta')]}.m8" for path in shard_queries]
+        threads_per_shard = max(1, threads // len(shard_queries))
+        logging.info(f"DIAMOND: {len(shard_queries)} частей по {threads_per_shard} потоков")
+
+        with ThreadPoolExecutor(max_workers=len(shard_queries)) as executor:
+            futures = [executor.submit(run_diamond, shard_query, database, shard_output, threads_per_shard, mode)
+                       for shard_query, shard_output in zip(shard_queries, shard_outputs)]
+            for future in futures:
+                future.result()
+
+        with open(output, 'wb') as merged:
+            for shard_output in shard_outputs:
+                if os.path.exists(shard_output):
+                    with open(shard_output, 'rb') as part:
+                        shutil.copyfileobj(part, merged, 1024 * 1024)
+    logging.info(f"Результаты DIAMOND объединены в {output}")
+
+def run_diamond_processes(args):
+    # Функция для работы только с DIAMOND: --db может быть готовой базой .dmnd или FASTA,
+    # из которого база собирается (или берётся из кэша по хэшу содержимого)
+    database = args.db
+    if database and os.path.isfile(database) and is_fasta(database):
+        database = cached_diamond_database(database)
+
+    if not args.ingest_only:
+        run_diamond_sharded(
+            query=args.query,
+            database=database,
+            output=args.out,
+            threads=args.threads,
+            mode=args.diamond_mode,
+            shards=args.shards
+        )
+
+    # Разбор результатов: лучшие попадания каждого запроса с аннотациями собранных белков
+    annotations = load_annotations(args.annotations, RunStore(args.run_id) if args.run_id else None)
+    ingest_m8(args.out, args.hits_out or f"{os.path.splitext(args.out)[0]}.best.tsv", top_k=args.top_k,
+              annotations=annotations)
+
+# Столбцы --outfmt 6 (m8) и компактные типы для них
+M8_COLUMNS = ['qseqid', 'sseqid', 'pident', 'length', 'mismatch', 'gapopen',
+              'qstart', 'qend', 'sstart', 'send', 'evalue', 'bitscore']
+M8_DTYPES = {
+    'qseqid': 'string',
+    'sseqid': 'string',
+    'pident': 'float32',
+    'length': 'int32',
+    'mismatch': 'int32',
+    'gapopen': 'int32',
+    'qstart': 'int32',
+    'qend': 'int32',
+    'sstart': 'int32',
+    'send': 'int32',
+    'evalue': 'float64',
+    'bitscore': 'float32',
+}
+M8_CHUNK_ROWS = 1_000_000
+ANNOTATION_COLUMNS = ['Entry', 'Entry Name', 'Protein names', 'Gene Names', 'EC number', 'Organism']
+
+def iter_m8_chunks(m8_file, chunksize=M8_CHUNK_ROWS):
+    return pd.read_csv(m8_file, sep='\t', header=None, names=M8_COLUMNS, dtype=M8_DTYPES, chunksize=chunksize)
+
+def top_hits(hits, top_k=1):
+    # Лучшие top_k попаданий для каждого запроса: больший bitscore, при равенстве меньший evalue.
+    # Запросы остаются в порядке файла
+    order = pd.Series(pd.factorize(hits['qseqid'])[0], index=hits.index)
+    hits = hits.assign(query_order=order).sort_values(['query_order', 'bitscore', 'evalue'],
+                                                      ascending=[True, False, True], kind='mergesort')
+    top = hits.groupby('qseqid', sort=False).head(top_k).drop(columns='query_order')
+    return top.assign(rank=top.groupby('qseqid', sort=False).cumcount().astype('int32') + 1)
+
+def iter_top_hits(m8_file, top_k=1, chunksize=M8_CHUNK_ROWS):
+    # DIAMOND пишет все попадания одного запроса подряд, поэтому после каждой пачки готовы все запросы,
+    # кроме последнего. Его попадания (не больше top_k) переносятся в следующую пачку,
+    # и в памяти одновременно находится не больше одной пачки
+    # Если попаданий нет, DIAMOND пишет пустой файл: пачек с попаданиями тогда нет вовсе
+    carry = None
+    for chunk in iter_m8_chunks(m8_file, chunksize):
+        if chunk.empty:
+            continue
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        is_last_query = chunk['qseqid'] == chunk['qseqid'].iat[-1]
+        carry = top_hits(chunk[is_last_query], top_k).drop(columns='rank')
+        complete = chunk[~is_last_query]
+        if len(complete):
+            yield top_hits(complete, top_k)
+    if carry is not None and len(carry):
+        yield top_hits(carry, top_k)
+
+def iter_top_hits_or_empty(m8_file, top_k=1, chunksize=M8_CHUNK_ROWS):
+    # Без попаданий выдаётся одна пустая пачка, чтобы файл результатов был создан с заголовком
+    empty = True
+    for top in iter_top_hits(m8_file, top_k=top_k, chunksize=chunksize):
+        empty = False
+        yield top
+    if empty:
+        yield top_hits(pd.DataFrame(columns=M8_COLUMNS).astype(M8_DTYPES), top_k)
+
+def subject_accession(sseqid):
+    # Заголовки FASTA этого проекта начинаются с accession, заголовки UniProt имеют вид sp|P12345|NAME
+    return sseqid.str.extract(r'^(?:[a-z]{2}\|)?([^|\s]+)', expand=False)
+
+def load_annotations(annotations_file=None, store=None):
+    # Аннотации найденных белков: Parquet/CSV из потокового режима или записи этапа ent_seq_v2 в Redis
+    if annotations_file:
+        if annotations_file.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            available = pq.read_schema(annotations_file).names
+            annotations = pd.read_parquet(annotations_file, columns=[c for c in ANNOTATION_COLUMNS if c in available])
+        else:
+            sep = '\t' if annotations_file.endswith(('.tsv', '.txt')) else ','
+            annotations = pd.read_csv(annotations_file, sep=sep, usecols=lambda column: column in ANNOTATION_COLUMNS,
+                                      dtype='string')
+    elif store is not None:
+        annotations = pd.DataFrame(
+            [{column: record.get(column) for column in ANNOTATION_COLUMNS} for record in store.iter_records(SEQUENCES)],
+            columns=ANNOTATION_COLUMNS)
+    else:
+        return None
+    annotations = annotations.drop_duplicates('Entry')
+    logging.info(f"Загружено {len(annotations)} аннотаций белков")
+    # Строковые типы, чтобы пустой в одной пачке столбец не менял схему Parquet
+    return annotations.astype('string')
+
+def ingest_m8(m8_file, output_file, top_k=1, annotations=None, chunksize=M8_CHUNK_ROWS):
+    # Потоковый разбор результатов DIAMOND: лучшие попадания каждого запроса с аннотациями
+    # записываются в output_file (TSV или Parquet) по мере обработки пачек
+    columnar = ColumnarWriter(output_file) if output_file.endswith('.parquet') else None
+    queries = 0
+    hits = 0
+    first = True
+    try:
+        for top in iter_top_hits_or_empty(m8_file, top_k=top_k, chunksize=chunksize):
+            top = top.assign(subject_accession=subject_accession(top['sseqid']))
+            if annotations is not None:
+                top = top.merge(annotations, how='left', left_on='subject_accession', right_on='Entry').drop(columns='Entry')
+            if columnar is not None:
+                columnar.write(top)
+            else:
+                top.to_csv(output_file, sep='\t', index=False, header=first, mode='w' if first else 'a')
+            first = False
+            queries += int((top['rank'] == 1).sum())
+            hits += len(top)
+    finally:
+        if columnar is not None:
+            columnar.close()
+    logging.info(f"Лучшие попадания DIAMOND для {queries} запросов ({hits} строк) сохранены в {output_file}")
+    return queries
+
+FASTA_LINE_WIDTH = 60
+FASTA_BLOCK_SIZE = 1024 * 1024  # Размер буфера записи и независимо сжатого блока
+
+def fasta_compression(path):
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return None
+
+def open_fasta(path):
+    # Чтение FASTA в любом из поддерживаемых форматов (обычный, gzip, zstd)
+    compression = fasta_compression(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'zstd':
+        import zstandard
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True, read_across_frames=True)
+        return BufferedReader(reader)
+    return open(path, 'rb')
+
+class FastaWriter:
+    # FASTA с дедупликацией последовательностей, сжатием и индексом <файл>.fai.
+    # Одинаковые последовательности (по хэшу) записываются один раз: в заголовке перечислены
+    # accession, известные на момент записи, а более поздние accession попадают в индекс
+    # с координатами уже записанной последовательности.
+    # Данные пишутся крупными блоками; при сжатии каждый блок — отдельный член gzip или кадр zstd,
+    # поэтому по индексу любую запись можно прочитать, распаковав один блок. Строки индекса
+    # дописываются вместе с блоком, так что после сбоя файл и индекс остаются согласованными.
+    # Индекс для несжатого файла совпадает с форматом samtools .fai (name, length, offset, line_bases,
+    # line_bytes); для сжатого добавлен столбец block_offset, а offset отсчитывается от начала блока
+    def __init__(self, output_file, compression=None, dedup=True, append=False, block_size=FASTA_BLOCK_SIZE):
+        self.output_file = output_file
+        self.index_file = f"{output_file}.fai"
+        self.compression = compression or fasta_compression(output_file)
+        self.dedup = dedup
+        self.block_size = block_size
+        self.compressor = None
+        if self.compression == 'zstd':
+            import zstandard
+            self.compressor = zstandard.ZstdCompressor(level=3)
+        elif self.compression not in (None, 'gzip'):
+            raise ValueError(f"Unsupported FASTA compression: {self.compression}")
+
+        # При append дописываем к файлу и индексу прерванного запуска
+        mode = 'ab' if append else 'wb'
+        self.file = open(self.output_file, mode)
+        self.index_out = open(self.index_file, mode)
+        self.index = []
+        self.block_offset = self.file.tell()
+        self.buffer = []
+        self.buffered = 0
+        self.sequences = {}
+        self.records = 0
+        self.duplicates = 0
+        if append and dedup and os.path.exists(self.index_file) and os.path.getsize(self.index_file):
+            self.load_sequences()
+
+    def load_sequences(self):
+        # Хэши последовательностей прерванного запуска восстанавливаются одним проходом по файлу,
+        # иначе повторная последовательность была бы записана ещё раз. Координаты берутся из индекса:
+        # записи последнего блока, не попавшие в индекс до сбоя, пропускаются
+        index = load_fasta_index(self.output_file)
+        accession = None
+        lines = []
+        with open_fasta(self.output_file) as f:
+            for line in chain(f, [b'>']):
+                if not line.startswith(b'>'):
+                    lines.append(line.rstrip(b'\r\n'))
+                    continue
+                row = index.get(accession)
+                if row is not None:
+                    digest = hashlib.blake2b(b''.join(lines), digest_size=16).digest()
+                    self.sequences.setdefault(digest, row[1:])
+                fields = line[1:].split(None, 1)
+                accession = fields[0].decode() if fields else None
+                lines = []
+
+    def add(self, accessions, description, sequence):
+        digest = hashlib.blake2b(sequence.encode(), digest_size=16).digest() if self.dedup else None
+        if digest is not None and digest in self.sequences:
+            location = self.sequences[digest]
+            self.index.extend([accession, *location] for accession in accessions)
+            self.duplicates += len(accessions)
+            return
+
+        header = f">{accessions[0]} {description}"
+        if len(accessions) > 1:
+            header += f" [{','.join(accessions[1:])}]"
+        lines = [sequence[i:i + FASTA_LINE_WIDTH] for i in range(0, len(sequence), FASTA_LINE_WIDTH)]
+        # Смещения считаются в байтах: в названиях белков встречаются не-ASCII символы
+        header = f"{header}\n".encode()
+        record = header + ('\n'.join(lines) + '\n').encode()
+
+        if self.compression is None:
+            offset = self.block_offset + self.buffered + len(header)
+            location = [str(len(sequence)), str(offset), str(FASTA_LINE_WIDTH), str(FASTA_LINE_WIDTH + 1)]
+        else:
+            offset = self.buffered + len(header)
+            location = [str(len(sequence)), str(offset), str(FASTA_LINE_WIDTH), str(FASTA_LINE_WIDTH + 1),
+                        str(self.block_offset)]
+        self.index.extend([accession, *location] for accession in accessions)
+        if digest is not None:
+            self.sequences[digest] = location
+
+        self.buffer.append(record)
+        self.buffered += len(record)
+        self.records += 1
+        if self.buffered >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data = b''.join(self.buffer)
+        if self.compression == 'gzip':
+            data = gzip.compress(data, compresslevel=6)
+        elif self.compression == 'zstd':
+            data = self.compressor.compress(data)
+        self.file.write(data)
+        self.file.flush()
+        self.block_offset += len(data)
+        self.buffer = []
+        self.buffered = 0
+        self.flush_index()
+
+    def flush_index(self):
+        if self.index:
+            self.index_out.write(''.join('\t'.join(row) + '\n' for row in self.index).encode())
+            self.index_out.flush()
+            self.index = []
+
+    def close(self):
+        self.flush()
+        self.flush_index()
+        self.file.close()
+        self.index_out.close()
+        if self.duplicates:
+            logging.info(f"FASTA: {self.records} последовательностей, {self.duplicates} дубликатов объединены")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Загруженные индексы .fai: путь -> (mtime, размер, {accession: строка индекса})
+FASTA_INDEXES = {}
+
+def load_fasta_index(fasta_file):
+    # Индекс читается один раз и перечитывается, только если файл .fai изменился (например, дописан)
+    index_file = f"{fasta_file}.fai"
+    stat = os.stat(index_file)
+    cached = FASTA_INDEXES.get(index_file)
+    if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+        # Первая строка accession выигрывает, как и при прежнем последовательном просмотре
+        index = {}
+        with open(index_file, encoding='utf-8') as f:
+            for line in f:
+                row = line.rstrip('\n').split('\t')
+                index.setdefault(row[0], row)
+        cached = FASTA_INDEXES[index_file] = (stat.st_mtime_ns, stat.st_size, index)
+    return cached[2]
+
+def read_fasta_sequence(fasta_file, accession):
+    # Чтение одной последовательности по индексу .fai без просмотра всего файла
+    row = load_fasta_index(fasta_file).get(accession)
+    if row is None:
+        return None
+    length, offset, line_bases, line_bytes = (int(value) for value in row[1:5])
+    size = length + (length - 1) // line_bases + 1 if length else 0
+
+    compression = fasta_compression(fasta_file)
+    with open(fasta_file, 'rb') as f:
+        if compression is None:
+            f.seek(offset)
+            data = f.read(size)
+        else:
+            f.seek(int(row[5]))
+            if compression == 'gzip':
+                decompressor = zlib.decompressobj(wbits=31)
+            else:
+                import zstandard
+                decompressor = zstandard.ZstdDecompressor().decompressobj()
+            block = b''
+            while len(block) < offset + size:
+                chunk = f.read(FASTA_BLOCK_SIZE)
+                if not chunk:
+                    break
+                block += decompressor.decompress(chunk)
+                if decompressor.eof:
+                    break
+            data = block[offset:offset + size]
+    return data.decode().replace('\n', '')
+
+def write_fasta_records(writer, data):
+    for entry in data:
+        entry_id = entry.get("Entry", "unknown")
+        protein_name = entry.get("Protein names", "unknown_protein")
+        sequence = entry.get("Sequence", "")
+
+        # Пропускаем, если последовательность пуста
+        if not isinstance(sequence, str) or not sequence:
+            continue
+
+        writer.add([entry_id], protein_name, sequence)
+
+def save_to_fasta(data, output_file='output_sequences.fasta'):
+    # Все записи уже в памяти, поэтому одинаковые последовательности группируются заранее
+    # и в заголовке перечисляются все их accession
+    groups = {}
+    for entry in data:
+        sequence = entry.get("Sequence", "")
+        if not isinstance(sequence, str) or not sequence:
+            continue
+        group = groups.setdefault(sequence, [[], entry.get("Protein names", "unknown_protein")])
+        group[0].append(entry.get("Entry", "unknown"))
+
+    with FastaWriter(output_file) as writer:
+        for sequence, (accessions, protein_name) in groups.items():
+            writer.add(accessions, protein_name, sequence)
+
+    logging.info(f"FASTA файл успешно создан: {output_file}")
+
+def fetch_sequences(uniprot_entries, batched=True, concurrency=4, num_of_processes=None, exclude=None, outcomes=None,
+                    checkpoint=None):
+    entries = [entry['Entries'] for entry in uniprot_entries if 'Entries' in entry]
+    entries = [item for sublist in entries for item in sublist.split('\n') if item]
+    if exclude:
+        # Accession, уже обработанные в прерванном запуске
+        entries = [entry for entry in entries if entry not in exclude]
+    if batched:
+        return fetch_protein_data_batched(entries, concurrency=concurrency, outcomes=outcomes, checkpoint=checkpoint)
+    return parallel_fetch(entries, fetch_and_process_data, num_of_processes=num_of_processes or os.cpu_count())
+
+def chunk_records(chunk):
+    # Пропуски (NaN, pd.NA) заменяются на None, чтобы записи сериализовались в JSON
+    return chunk.astype(object).where(chunk.notna(), None).to_dict('records')
+
+def stream_sequences(uniprot_entries, fasta_file='output_sequences.fasta', columnar_file='output_sequences.parquet',
+                     concurrency=4, store=None):
+    # Потоковый режим: каждая пачка TSV сразу дописывается в FASTA и Parquet и освобождается,
+    # весь набор последовательностей в памяти не собирается
+    entries = [entry['Entries'] for entry in uniprot_entries if 'Entries' in entry]
+    entries = [item for sublist in entries for item in sublist.split('\n') if item]
+
+    total = 0
+    columnar = ColumnarWriter(columnar_file)
+    try:
+        with FastaWriter(fasta_file) as fasta:
+            for _, chunk in iter_uniprot_chunks(entries, concurrency=concurrency, dtype=COMPACT_DTYPES):
+                records = chunk_records(chunk)
+                write_fasta_records(fasta, records)
+                columnar.write(chunk)
+                if store is not None:
+                    store.write(SEQUENCES, records)
+                total += len(chunk)
+    finally:
+        columnar.close()
+
+    logging.info(f"FASTA файл успешно создан: {fasta_file} ({total} записей)")
+    return total
+
+def save_results(store, results, fasta_file='output_sequences.fasta'):
+    # Сохраняем результаты в Redis
+    store.write(SEQUENCES, results)
+    save_to_fasta(results, fasta_file)
+
+def main():
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Скрипт для анализа данных с использованием DIAMOND")
+    parser.add_argument('--use-diamond', action='store_true', help="Включить функционал DIAMOND для анализа")
+    parser.add_argument('--query', help="Путь к файлу запроса для DIAMOND")
+    parser.add_argument('--db', help="Путь к базе данных DIAMOND")
+    parser.add_argument('--out', help="Путь к выходному файлу DIAMOND")
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help="Количество потоков для DIAMOND")
+    parser.add_argument('--per-accession', action='store_true', help="Запрашивать UniProt отдельно для каждого accession в пуле процессов (прежний режим)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Количество одновременных пакетных запросов к UniProt")
+    parser.add_argument('--run-id', type=str, help="Идентификатор запуска для ключей Redis")
+    parser.add_argument('--stream', action='store_true', help="Потоковый режим: пачки UniProt сразу записываются в FASTA, Parquet и Redis")
+    parser.add_argument('--fasta-out', default='output_sequences.fasta', help="Путь к FASTA файлу (.gz или .zst — со сжатием)")
+    parser.add_argument('--columnar-out', default='output_sequences.parquet', help="Путь к Parquet файлу для потокового режима")
+    parser.add_argument('--shards', type=int, help="Количество частей запроса для параллельного запуска DIAMOND (по умолчанию одна часть на 4 потока)")
+    parser.add_argument('--top-k', type=int, default=1, help="Количество лучших попаданий DIAMOND на запрос")
+    parser.add_argument('--hits-out', help="Файл лучших попаданий DIAMOND с аннотациями (.tsv или .parquet, по умолчанию <out>.best.tsv)")
+    parser.add_argument('--annotations', help="Parquet/CSV с записями UniProt для аннотации попаданий (по умолчанию записи запуска --run-id)")
+    parser.add_argument('--ingest-only', action='store_true', help="Не запускать DIAMOND, только разобрать готовый файл --out")
+    parser.add_argument('--diamond-mode', default='fast', choices=['fast', 'sensitive'], help="Режим работы DIAMOND")
+    args = parser.parse_args()
+
+    if args.use_diamond:
+        if not args.out or not args.ingest_only and not all([args.query, args.db]):
+            logging.error("Для использования DIAMOND необходимо указать --query, --db и --out.")
+            sys.exit(1)
+
+        try:
+            run_diamond_processes(args)
+        except RuntimeError as e:
+            logging.error(e)
+            sys.exit(1)
+    else:
+        if not args.run_id:
+            logging.error("Необходимо указать --run-id.")
+            sys.exit(1)
+
+        # Получаем UniProt записи из Redis
+        store = RunStore(args.run_id)
+        uniprot_entries = store.read(EC_ENTRIES)
+        if not uniprot_entries:
+            logging.error("No UniProt entries found in Redis")
+            return
+
+        with metrics.stage(SEQUENCES, items_in=len(uniprot_entries)):
+            if args.stream:
+                total = stream_sequences(uniprot_entries, fasta_file=args.fasta_out, columnar_file=args.columnar_out, concurrency=args.concurrency, store=store)
+            else:
+                results = fetch_sequences(uniprot_entries, batched=not args.per_accession, concurrency=args.concurrency)
+                save_results(store, results, args.fasta_out)
+                total = len(results)
+        metrics.items_out(SEQUENCES, total)
+        store.mark_done(SEQUENCES)
+        metrics.publish(store, SEQUENCES)
+    
+    logging.info("Script execution completed")
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,261 @@
+import argparse
+import hashlib
+import logging
+import re
+import sqlite3
+import sys
+
+ENZYME_DAT_URL = "https://ftp.expasy.org/databases/enzyme/enzyme.dat"
+# Версия схемы индекса: индекс старой версии перестраивается при следующем обновлении
+SCHEMA_VERSION = '2'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS enzymes (
+    ec TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    accepted_name TEXT,
+    alt_names TEXT,
+    entries TEXT,
+    transferred_to TEXT,
+    checksum TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS enzyme_names (
+    ec TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS enzyme_names_ec ON enzyme_names (ec);
+"""
+
+EC_RE = re.compile(r"\d+\.\d+\.\d+\.n?\d+")
+RELEASE_RE = re.compile(r"Release of (\S+)")
+
+def parse_enzyme_dat(lines):
+    # Разбор flat-файла ENZYME: по одной записи на блок, заканчивающийся строкой '//'
+    release = None
+    entry = None
+    raw = []
+    for line in lines:
+        line = line.rstrip('\n')
+        code, value = line[:2], line[5:].strip()
+        if entry is None:
+            if code == 'CC' and release is None:
+                match = RELEASE_RE.search(value)
+                if match:
+                    release = match.group(1)
+            if code != 'ID':
+                continue
+            entry = {"ec": value, "de": [], "an": [], "entries": []}
+            raw = []
+        raw.append(line)
+
+        if code == 'DE':
+            entry["de"].append(value)
+        elif code == 'AN':
+            # Альтернативное название может занимать несколько строк и заканчивается точкой
+            if entry["an"] and not entry["an"][-1].endswith('.'):
+                entry["an"][-1] += ' ' + value
+            else:
+                entry["an"].append(value)
+        elif code == 'DR':
+            for reference in value.split(';'):
+                accession = reference.split(',')[0].strip()
+                if accession:
+                    entry["entries"].append(accession)
+        elif code == '//':
+            yield release, build_record(entry, raw)
+            entry = None
+
+def build_record(entry, raw):
+    description = ' '.join(entry["de"]).rstrip('.')
+    record = {
+        "ec": entry["ec"],
+        "status": "active",
+        "accepted_name": description,
+        "alt_names": [name.rstrip('.') for name in entry["an"]],
+        "entries": entry["entries"],
+        "transferred_to": [],
+        "checksum": hashlib.sha1('\n'.join(raw).encode()).hexdigest(),
+    }
+    if description.startswith('Deleted entry'):
+        record["status"] = "deleted"
+    elif description.startswith('Transferred entry'):
+        record["status"] = "transferred"
+        record["transferred_to"] = EC_RE.findall(description)
+    return record
+
+class EnzymeIndex:
+    # Локальный индекс ENZYME на SQLite. Файл открывается в режиме WAL, поэтому
+    # один процесс может обновлять индекс, а любое количество воркеров читать его одновременно
+    def __init__(self, path, readonly=True):
+        self.path = str(path)
+        if readonly:
+            self.connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self.connection.execute("PRAGMA mmap_size = 268435456")
+        else:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def meta(self, key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def release(self):
+        return self.meta('release')
+
+    def refresh(self, lines):
+        # Инкрементальное обновление: перезаписываются только изменившиеся записи,
+        # записи, исчезнувшие из нового релиза, удаляются
+        known = dict(self.connection.execute("SELECT ec, checksum FROM enzymes"))
+        upgrade = self.meta('schema') != SCHEMA_VERSION
+        if upgrade:
+            # Индекс старой версии: названия всех записей записываются заново
+            known = {}
+        seen = set()
+        release = None
+        changed = 0
+        with self.connection:
+            if upgrade:
+                # Таблица токенов названий версии 1 заменена таблицей enzyme_names
+                self.connection.execute("DROP TABLE IF EXISTS name_tokens")
+            for release, record in parse_enzyme_dat(lines):
+                ec = record["ec"]
+                seen.add(ec)
+                if known.get(ec) == record["checksum"]:
+                    continue
+                self.connection.execute("DELETE FROM enzyme_names WHERE ec = ?", (ec,))
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO enzymes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (ec, record["status"], record["accepted_name"], '\n'.join(record["alt_names"]),
+                     '\n'.join(record["entries"]), '\n'.join(record["transferred_to"]), record["checksum"])
+                )
+                if record["status"] == "active":
+                    names = dict.fromkeys(name for name in [record["accepted_name"]] + record["alt_names"] if name)
+                    self.connection.executemany("INSERT INTO enzyme_names VALUES (?, ?, ?)",
+                                                [(ec, name, name.lower()) for name in names])
+                changed += 1
+
+            removed = [ec for ec in known if ec not in seen]
+            for ec in removed:
+                self.connection.execute("DELETE FROM enzyme_names WHERE ec = ?", (ec,))
+                self.connection.execute("DELETE FROM enzymes WHERE ec = ?", (ec,))
+            if release:
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('release', ?)", (release,))
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (SCHEMA_VERSION,))
+
+        logging.info(f"Индекс ENZYME обновлён (релиз {release}): изменено {changed}, удалено {len(removed)}, всего {len(seen)}")
+        return changed, len(removed)
+
+    def search_names(self, query):
+        # Аналог поиска ExPASy "name containing": вхождение строки запроса без учёта регистра
+        # в основное или альтернативное название, в том числе внутри слова ("hydrogenase"
+        # находит "alcohol dehydrogenase"). Таблица названий невелика (десятки тысяч строк),
+        # поэтому она просматривается целиком
+        needle = query.strip().lower()
+        if not needle:
+            return []
+        rows = {}
+        for ec, name in self.connection.execute(
+            "SELECT ec, name FROM enzyme_names WHERE instr(name_lower, ?) > 0 ORDER BY ec, rowid", (needle,)
+        ):
+            rows.setdefault(ec, []).append(name)
+        return list(rows.items())
+
+    def get(self, ec):
+        row = self.connection.execute(
+            "SELECT status, accepted_name, alt_names, entries, transferred_to FROM enzymes WHERE ec = ?", (ec,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, accepted_name, alt_names, entries, transferred_to = row
+        return {
+            "status": status,
+            "accepted_name": accepted_name,
+            "alt_names": alt_names,
+            "entries": entries,
+            "transferred_to": [target for target in transferred_to.split('\n') if target],
+        }
+
+    def lookup_ec(self, ec_number):
+        # Возвращает (запись в формате ec_entries.parse_enzyme_page, статус).
+        # Для статуса 'missing' вместо записи возвращается EC номер (возможно, цель переноса),
+        # которого нет в индексе и который нужно запросить на сайте
+        visited = set()
+        while ec_number not in visited:
+            visited.add(ec_number)
+            entry = self.get(ec_number)
+            if entry is None:
+                return ec_number, "missing"
+            if entry["status"] == "deleted":
+                return None, "deleted"
+            if entry["status"] == "transferred":
+                if not entry["transferred_to"]:
+                    return None, "deleted"
+                # Как и на сайте, переходим к первой записи, в которую перенесён EC номер
+                logging.info(f"EC number {ec_number} is a transferred entry to {entry['transferred_to'][0]}.")
+                ec_number = entry["transferred_to"][0]
+                continue
+            record = {
+                "EC number": ec_number,
+                "Accepted Name": entry["accepted_name"],
+                "Alternative Name(s)": entry["alt_names"],
+                "Entries": entry["entries"],
+            }
+            return record, "active"
+        return None, "deleted"
+
+def open_index(path):
+    if not path:
+        return None
+    try:
+        index = EnzymeIndex(path)
+        schema = index.meta('schema')
+    except sqlite3.Error as e:
+        logging.error(f"Не удалось открыть индекс ENZYME '{path}': {e}")
+        return None
+    if schema != SCHEMA_VERSION:
+        logging.error(f"Индекс ENZYME '{path}' создан старой версией, обновите его: python enzyme_index.py enzyme.dat --db {path}")
+        index.close()
+        return None
+    return index
+
+def download_enzyme_dat(path, url=ENZYME_DAT_URL):
+    import requests
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(path, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                file.write(chunk)
+    logging.info(f"Файл {url} сохранён в {path}")
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Локальный индекс базы ENZYME (enzyme.dat)")
+    parser.add_argument('dat_file', help="Путь к файлу enzyme.dat")
+    parser.add_argument('--db', default='enzyme_index.sqlite', help="Путь к файлу индекса")
+    parser.add_argument('--download', action='store_true', help="Предварительно скачать свежий enzyme.dat с ExPASy")
+    args = parser.parse_args()
+
+    if args.download:
+        download_enzyme_dat(args.dat_file)
+
+    index = EnzymeIndex(args.db, readonly=False)
+    try:
+        with open(args.dat_file, encoding='utf-8', errors='replace') as file:
+            index.refresh(file)
+    except OSError as e:
+        logging.error(f"Ошибка чтения файла '{args.dat_file}': {e}")
+        sys.exit(1)
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
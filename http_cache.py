@@ -0,0 +1,247 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+
+import metrics
+
+# Общий для всех этапов локальный кэш HTTP ответов: индекс в SQLite, тела ответов
+# хранятся сжатыми и адресуются по хэшу содержимого, поэтому одинаковые ответы хранятся один раз
+
+DAY = 24 * 60 * 60
+
+SOURCE_TTLS = {
+    'expasy_byname': 7 * DAY,
+    'expasy_ec': 30 * DAY,
+    'uniprot': 7 * DAY,
+    'rhea': 30 * DAY,
+}
+DEFAULT_TTL = 7 * DAY
+NEGATIVE_TTL = 1 * DAY
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    headers TEXT,
+    negative INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+class CacheMiss(Exception):
+    # Ответа нет в кэше, а кэш работает в режиме "только кэш"
+    pass
+
+class CachedResponse:
+    def __init__(self, status, body, headers=None, negative=False):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+        self.negative = negative
+
+class HttpCache:
+    def __init__(self, path, ttls=None, negative_ttl=NEGATIVE_TTL, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.ttls = dict(SOURCE_TTLS, **(ttls or {}))
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = Counter()
+        self.misses = Counter()
+        self.lock = threading.Lock()
+        self.puts_since_eviction = 0
+
+        self.connection = sqlite3.connect(str(self.path / 'cache.sqlite'), timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    @staticmethod
+    def make_key(url, source):
+        return f"{source}:{url}"
+
+    def get(self, url, source):
+        key = self.make_key(url, source)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT e.status, e.headers, e.negative, e.fetched_at, b.data FROM entries e "
+                "JOIN blobs b ON b.digest = e.digest WHERE e.key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                status, headers, negative, fetched_at, data = row
+                ttl = self.negative_ttl if negative else self.ttls.get(source, DEFAULT_TTL)
+                # В режиме "только кэш" устаревшие записи тоже отдаются: другого источника нет
+                if self.offline or now - fetched_at <= ttl:
+                    with self.connection:
+                        self.connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+                    self.hits[source] += 1
+                    metrics.inc(metrics.CACHE_REQUESTS, source=source, result='hit')
+                    return CachedResponse(status, zlib.decompress(data), json.loads(headers or '{}'), bool(negative))
+            self.misses[source] += 1
+            metrics.inc(metrics.CACHE_REQUESTS, source=source, result='miss')
+
+        if self.offline:
+            raise CacheMiss(url)
+        return None
+
+    def put(self, url, source, status, body, headers=None, negative=False):
+        # Кэшируем только успешные ответы и "не найдено"; 5xx и 429 не кэшируются
+        if not (status == 200 or negative or status == 404):
+            return
+        negative = negative or status == 404
+        digest = hashlib.sha256(body).hexdigest()
+        now = time.time()
+        with self.lock, self.connection:
+            if self.connection.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone() is None:
+                data = zlib.compress(body, 6)
+                self.connection.execute("INSERT INTO blobs VALUES (?, ?, ?)", (digest, data, len(data)))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.make_key(url, source), source, status, digest, json.dumps(headers or {}), int(negative), now, now)
+            )
+            self.puts_since_eviction += 1
+            if self.puts_since_eviction >= 100:
+                self.puts_since_eviction = 0
+                self.evict()
+
+    # Для асинхронных этапов: запросы к SQLite (и вытеснение при записи) выполняются в пуле потоков,
+    # чтобы не останавливать цикл событий, как и RateLimiter.acquire_async
+    async def get_async(self, url, source):
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, url, source)
+
+    async def put_async(self, url, source, status, body, headers=None, negative=False):
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(None, self.put, url, source, status, body, headers, negative)
+
+    def evict(self):
+        # Вытеснение самых давно использованных записей при превышении размера кэша (LRU).
+        # Вызывается под self.lock внутри транзакции
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        evicted = 0
+        while total > target:
+            # Удаляем долю записей, пропорциональную превышению размера
+            count = self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            batch = max(1, int(count * (total - target) / total))
+            keys = [key for key, in self.connection.execute(
+                "SELECT key FROM entries ORDER BY accessed_at LIMIT ?", (batch,))]
+            if not keys:
+                break
+            self.connection.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys])
+            self.connection.execute("DELETE FROM blobs WHERE digest NOT IN (SELECT digest FROM entries)")
+            total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            evicted += len(keys)
+        logging.info(f"Из HTTP кэша вытеснено {evicted} записей, размер {total / 1024 ** 2:.1f} МБ")
+
+    def stats(self):
+        return {
+            source: {"hits": self.hits[source], "misses": self.misses[source]}
+            for source in sorted(set(self.hits) | set(self.misses))
+        }
+
+    def log_stats(self):
+        for source, counts in self.stats().items():
+            total = counts["hits"] + counts["misses"]
+            logging.info(f"HTTP кэш [{source}]: попаданий {counts['hits']} из {total}")
+
+    def close(self):
+        self.connection.close()
+
+default_cache = None
+default_cache_lock = threading.Lock()
+
+def configure(path, offline=False, max_bytes=None):
+    # Настройка передаётся через переменные окружения, чтобы её видели и этапы,
+    # запущенные отдельными процессами
+    global default_cache
+    os.environ['ENZYME_CACHE_DIR'] = str(path)
+    os.environ['ENZYME_CACHE_OFFLINE'] = '1' if offline else '0'
+    if max_bytes:
+        os.environ['ENZYME_CACHE_MAX_BYTES'] = str(max_bytes)
+    default_cache = None
+
+def get_default_cache():
+    global default_cache
+    if default_cache is None and os.environ.get('ENZYME_CACHE_DIR'):
+        with default_cache_lock:
+            if default_cache is None:
+                default_cache = HttpCache(
+                    os.environ['ENZYME_CACHE_DIR'],
+                    max_bytes=int(os.environ.get('ENZYME_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+                    offline=os.environ.get('ENZYME_CACHE_OFFLINE') == '1',
+                )
+                atexit.register(default_cache.log_stats)
+    return default_cache
+
+def scrapy_cache_settings():
+    # Настройки scrapy для работы паука через общий кэш; пусто, если кэш не настроен
+    if not os.environ.get('ENZYME_CACHE_DIR'):
+        return {}
+    return {
+        'HTTPCACHE_ENABLED': True,
+        'HTTPCACHE_STORAGE': 'http_cache.ScrapyCacheStorage',
+        'HTTPCACHE_EXPIRATION_SECS': 0,  # Срок жизни определяет сам кэш по источнику
+        'HTTPCACHE_IGNORE_HTTP_CODES': [429, 500, 502, 503, 504],
+        'HTTPCACHE_IGNORE_MISSING': os.environ.get('ENZYME_CACHE_OFFLINE') == '1',
+    }
+
+class ScrapyCacheStorage:
+    # Хранилище для scrapy HttpCacheMiddleware (HTTPCACHE_STORAGE = 'http_cache.ScrapyCacheStorage')
+    def __init__(self, settings):
+        self.source = settings.get('HTTPCACHE_SOURCE', 'rhea')
+        self.cache = None
+
+    def open_spider(self, spider):
+        self.cache = get_default_cache()
+
+    def close_spider(self, spider):
+        if self.cache is not None:
+            self.cache.log_stats()
+
+    def retrieve_response(self, spider, request):
+        from scrapy.http import Headers
+        from scrapy.responsetypes import responsetypes
+
+        if self.cache is None:
+            return None
+        try:
+            cached = self.cache.get(request.url, self.source)
+        except CacheMiss:
+            # В режиме "только кэш" пропуски отбрасывает HTTPCACHE_IGNORE_MISSING
+            return None
+        if cached is None:
+            return None
+        headers = Headers(cached.headers)
+        response_class = responsetypes.from_args(headers=headers, url=request.url, body=cached.body)
+        return response_class(url=request.url, headers=headers, status=cached.status, body=cached.body)
+
+    def store_response(self, spider, request, response):
+        if self.cache is None:
+            return
+        headers = {}
+        for key, values in response.headers.items():
+            headers[key.decode()] = b', '.join(values).decode('latin-1')
+        self.cache.put(request.url, self.source, response.status, response.body, headers=headers)
\ No newline at end of file
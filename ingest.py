@@ -0,0 +1,164 @@
+import csv
+import glob
+import logging
+import os
+import sys
+import unicodedata
+
+from journal import DONE_STATUSES, Journal, journal_dir
+from storage import NAMES_EC
+
+# Чтение входного списка ферментов (orchestrator --file). Строки читаются потоково: xlsx
+# в режиме read-only, CSV/TSV, Parquet пачками, текстовый файл или stdin (по названию в строке).
+# Названия нормализуются (Unicode NFKC, лишние пробелы) и дедуплицируются без учёта регистра
+# до любых запросов; для каждого канонического названия запоминаются номера исходных строк,
+# по которым после запуска строится таблица соответствия входу (<output>.input.csv).
+# Номер строки — порядковый номер строки данных после заголовка, начиная с 1
+
+DEFAULT_COLUMN = 'Protein'
+PARQUET_BATCH_ROWS = 10000
+INPUT_MAP_COLUMNS = ['row', 'input', 'name', 'status', 'run_id']
+BLANK = 'blank'
+
+def normalize_name(value):
+    # Возвращает (ключ, название) или None для пустых значений
+    if value is None or isinstance(value, float) and value != value:
+        return None
+    name = ' '.join(unicodedata.normalize('NFKC', str(value)).split())
+    if not name:
+        return None
+    return name.casefold(), name
+
+def iter_lines(f, column):
+    for number, line in enumerate(f):
+        value = line.rstrip('\r\n')
+        if number == 0 and value.strip() == column:
+            continue
+        yield value
+
+def iter_xlsx(path, column):
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, ())
+        if column not in header:
+            raise ValueError(f"В файле '{path}' нет колонки '{column}'")
+        position = header.index(column)
+        for row in rows:
+            yield row[position] if position < len(row) else None
+    finally:
+        workbook.close()
+
+def iter_csv(path, column, delimiter):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, [])
+        if column not in header:
+            raise ValueError(f"В файле '{path}' нет колонки '{column}'")
+        position = header.index(column)
+        for row in reader:
+            yield row[position] if position < len(row) else None
+
+def iter_parquet(path, column):
+    import pyarrow.parquet as pq
+    parquet = pq.ParquetFile(path)
+    if column not in parquet.schema_arrow.names:
+        raise ValueError(f"В файле '{path}' нет колонки '{column}'")
+    for batch in parquet.iter_batches(batch_size=PARQUET_BATCH_ROWS, columns=[column]):
+        yield from batch.column(0).to_pylist()
+
+def iter_values(path, column=DEFAULT_COLUMN):
+    # Значения колонки по порядку строк; формат определяется по расширению
+    path = str(path)
+    if path == '-':
+        yield from iter_lines(sys.stdin, column)
+        return
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix in ('.xlsx', '.xlsm'):
+        yield from iter_xlsx(path, column)
+    elif suffix in ('.csv', '.tsv'):
+        yield from iter_csv(path, column, '\t' if suffix == '.tsv' else ',')
+    elif suffix == '.parquet':
+        yield from iter_parquet(path, column)
+    else:
+        with open(path, encoding='utf-8-sig') as f:
+            yield from iter_lines(f, column)
+
+class InputNames:
+    def __init__(self):
+        self.names = {}  # ключ -> каноническое название (в порядке первого появления)
+        self.rows = {}  # ключ -> номера исходных строк
+        self.inputs = {}  # номер строки -> исходное значение, если оно отличается от канонического
+        self.blank_rows = []
+        self.skipped = {}  # ключ -> (статус, run_id) для названий, обработанных в прошлых запусках
+        self.total = 0
+
+    def add(self, row, value):
+        self.total += 1
+        normalized = normalize_name(value)
+        if normalized is None:
+            self.blank_rows.append(row)
+            return
+        key, name = normalized
+        if key not in self.names:
+            self.names[key] = name
+            self.rows[key] = []
+        self.rows[key].append(row)
+        if value != self.names[key]:
+            self.inputs[row] = value
+
+    def pending(self):
+        # Названия для обработки в этом запуске
+        return [name for key, name in self.names.items() if key not in self.skipped]
+
+    def log_stats(self, source):
+        duplicates = self.total - len(self.blank_rows) - len(self.names)
+        logging.info(f"Файл '{source}': {self.total} строк, уникальных названий {len(self.names)}, "
+                     f"повторов {duplicates}, пустых {len(self.blank_rows)}")
+
+def read_names(path, column=DEFAULT_COLUMN):
+    names = InputNames()
+    for row, value in enumerate(iter_values(path, column), start=1):
+        names.add(row, value)
+    names.log_stats(path)
+    return names
+
+def resolved_names(exclude_run_ids=()):
+    # Названия, обработанные (найдены или не найдены) в прошлых запусках, по журналам этапа names_ec:
+    # ключ -> (статус, run_id). Более поздний журнал имеет приоритет
+    resolved = {}
+    paths = glob.glob(os.path.join(journal_dir(), '*', f"{NAMES_EC}.jsonl"))
+    for path in sorted(paths, key=os.path.getmtime):
+        run_id = os.path.basename(os.path.dirname(path))
+        # Подзапуски режима --subprocess называются <run_id>.<номер>
+        if run_id.split('.')[0] in exclude_run_ids:
+            continue
+        for item, status in Journal(run_id, NAMES_EC).load().items():
+            normalized = normalize_name(item)
+            if normalized is not None and status in DONE_STATUSES:
+                resolved[normalized[0]] = (status, run_id)
+    return resolved
+
+def skip_resolved(names, exclude_run_ids=()):
+    previous = resolved_names(exclude_run_ids)
+    names.skipped = {key: previous[key] for key in names.names if key in previous}
+    if names.skipped:
+        logging.info(f"Пропущено {len(names.skipped)} названий, обработанных в прошлых запусках")
+
+def input_map_path(output_file):
+    return f"{os.path.splitext(output_file)[0]}.input.csv"
+
+def write_input_map(path, names, outcomes):
+    # Таблица соответствия входу: строка файла -> каноническое название, статус поиска EC номеров
+    # и запуск, в котором название обработано. outcomes: каноническое название -> (статус, run_id)
+    entries = [(row, '', '', BLANK, '') for row in names.blank_rows]
+    for key, rows in names.rows.items():
+        name = names.names[key]
+        status, run_id = names.skipped.get(key) or outcomes.get(name, ('', ''))
+        entries.extend((row, names.inputs.get(row, name), name, status, run_id) for row in rows)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(INPUT_MAP_COLUMNS)
+        writer.writerows(sorted(entries))
+    logging.info(f"Соответствие строк входа и результатов сохранено в {path}")
\ No newline at end of file
@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import time
+
+# Журнал хода запуска: для каждого этапа отдельный файл <каталог>/<run_id>/<этап>.jsonl,
+# в который только дописываются строки {"item": ..., "status": ...}. Последняя строка
+# для элемента определяет его состояние, поэтому повторная обработка просто дописывает новую строку.
+# Запись буферизуется и сбрасывается на диск пачками, что позволяет писать тысячи строк в секунду
+
+FOUND = 'found'
+NOT_FOUND = 'not_found'
+ERROR = 'error'
+DONE_STATUSES = (FOUND, NOT_FOUND)  # Элементы с ошибкой при возобновлении обрабатываются заново
+
+DEFAULT_JOURNAL_DIR = '.journal'
+
+def journal_dir():
+    return os.environ.get('ENZYME_JOURNAL_DIR', DEFAULT_JOURNAL_DIR)
+
+class Journal:
+    def __init__(self, run_id, stage, flush_every=1000, flush_interval=5.0):
+        self.path = os.path.join(journal_dir(), run_id, f"{stage}.jsonl")
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.file = None
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+
+    def record(self, item, status, **extra):
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, 'a', encoding='utf-8', buffering=1024 * 1024)
+        self.file.write(json.dumps({"item": item, "status": status, **extra}, ensure_ascii=False) + '\n')
+        self.unflushed += 1
+        if self.unflushed >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def record_all(self, outcomes):
+        for item, status in outcomes.items():
+            self.record(item, status)
+        self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if self.file is None or not self.unflushed:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unflushed = 0
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def load(self):
+        states = {}
+        if not os.path.exists(self.path):
+            return states
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Последняя строка могла быть записана не полностью при аварийной остановке
+                    continue
+                states[entry["item"]] = entry["status"]
+        return states
+
+    def done(self):
+        done = {item for item, status in self.load().items() if status in DONE_STATUSES}
+        logging.info(f"Журнал {self.path}: {len(done)} элементов уже обработаны")
+        return done
\ No newline at end of file
@@ -0,0 +1,289 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# Общие метрики этапов: счётчики и гистограммы с метками, как в Prometheus.
+# Каждый процесс копит метрики в памяти (registry) и в конце сохраняет снимок в Redis
+# через RunStore.save_metrics; orchestrator объединяет снимки всех процессов запуска
+# в отчёт JSON и файл в текстовом формате Prometheus.
+# Профилирование этапа включается переменной ENZYME_PROFILE=cprofile|py-spy,
+# профили пишутся в ENZYME_PROFILE_DIR (по умолчанию .profiles)
+
+PREFIX = 'enzyme'
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Названия метрик
+STAGE_SECONDS = 'stage_seconds_total'
+STAGE_ITEMS_IN = 'stage_items_in_total'
+STAGE_ITEMS_OUT = 'stage_items_out_total'
+HTTP_SECONDS = 'http_request_seconds'
+HTTP_REQUESTS = 'http_requests_total'
+HTTP_RETRIES = 'http_retries_total'
+HTTP_THROTTLED = 'http_throttled_total'
+RATE_LIMIT_WAIT_SECONDS = 'rate_limit_wait_seconds'
+CACHE_REQUESTS = 'cache_requests_total'
+BROWSER_PAGE_SECONDS = 'browser_page_seconds'
+REDIS_PAYLOAD_BYTES = 'redis_payload_bytes'
+
+DEFAULT_METRICS_DIR = '.metrics'
+DEFAULT_PROFILE_DIR = '.profiles'
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Оценка сверху: граница корзины, в которую попадает квантиль (None — больше последней границы)
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in self.counters.items()],
+                "histograms": [{"name": name, "labels": dict(labels), "buckets": list(histogram.buckets),
+                                "counts": list(histogram.counts), "sum": histogram.sum, "count": histogram.count}
+                               for (name, labels), histogram in self.histograms.items()],
+            }
+
+    def merge(self, snapshot):
+        with self.lock:
+            for counter in snapshot["counters"]:
+                key = (counter["name"], tuple(sorted(counter["labels"].items())))
+                self.counters[key] = self.counters.get(key, 0) + counter["value"]
+            for entry in snapshot["histograms"]:
+                key = (entry["name"], tuple(sorted(entry["labels"].items())))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(tuple(entry["buckets"]))
+                histogram.counts = [a + b for a, b in zip(histogram.counts, entry["counts"])]
+                histogram.sum += entry["sum"]
+                histogram.count += entry["count"]
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+registry = Registry()
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+def observe(name, value, buckets=SECONDS_BUCKETS, **labels):
+    registry.observe(name, value, buckets, **labels)
+
+def host_of(url):
+    return urlsplit(url).netloc or 'unknown'
+
+def observe_http(url, seconds, status):
+    host = host_of(url)
+    registry.observe(HTTP_SECONDS, seconds, host=host)
+    registry.inc(HTTP_REQUESTS, host=host, status=str(status))
+
+def observe_payload(stream, operation, size):
+    registry.observe(REDIS_PAYLOAD_BYTES, size, BYTES_BUCKETS, stream=stream, operation=operation)
+
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start, **labels)
+
+# Профилирование этапа
+
+def profile_dir():
+    return os.environ.get('ENZYME_PROFILE_DIR', DEFAULT_PROFILE_DIR)
+
+def start_profiler(stage_name):
+    mode = os.environ.get('ENZYME_PROFILE')
+    if not mode:
+        return None
+    os.makedirs(profile_dir(), exist_ok=True)
+    path = os.path.join(profile_dir(), f"{stage_name}-{os.getpid()}")
+    if mode == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return mode, profiler, f"{path}.prof"
+    if mode == 'py-spy':
+        # py-spy снимает стеки снаружи процесса и не замедляет сам этап
+        import shutil
+        import subprocess
+        py_spy = shutil.which('py-spy')
+        if py_spy is None:
+            logging.warning("py-spy не найден в PATH, профилирование этапа отключено")
+            return None
+        process = subprocess.Popen([py_spy, 'record', '--pid', str(os.getpid()), '--output', f"{path}.svg",
+                                    '--nonblocking'], stdout=subprocess.DEVNULL)
+        return mode, process, f"{path}.svg"
+    logging.warning(f"Неизвестный режим профилирования ENZYME_PROFILE={mode}")
+    return None
+
+def stop_profiler(profiling):
+    if profiling is None:
+        return
+    mode, profiler, path = profiling
+    if mode == 'cprofile':
+        profiler.disable()
+        profiler.dump_stats(path)
+    else:
+        import signal
+        # py-spy записывает результат, получив SIGINT
+        profiler.send_signal(signal.SIGINT)
+        profiler.wait()
+    logging.info(f"Профиль этапа сохранён: {path}")
+
+@contextmanager
+def stage(stage_name, items_in=None, profile=True):
+    # Время этапа и число входных элементов; выходные элементы отмечаются через items_out.
+    # Этапы, работающие одновременно в одном процессе (потоковый режим), профилируются вместе: profile=False
+    if items_in is not None:
+        registry.inc(STAGE_ITEMS_IN, items_in, stage=stage_name)
+    profiling = start_profiler(stage_name) if profile else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.inc(STAGE_SECONDS, time.perf_counter() - start, stage=stage_name)
+        stop_profiler(profiling)
+
+def items_out(stage_name, count):
+    registry.inc(STAGE_ITEMS_OUT, count, stage=stage_name)
+
+# Сохранение и отчёты
+
+def publish(store, name):
+    # Снимок метрик процесса сохраняется в Redis под именем этапа и PID процесса
+    snapshot = registry.snapshot()
+    if snapshot["counters"] or snapshot["histograms"]:
+        store.save_metrics(f"{name}:{os.getpid()}", snapshot)
+
+def run_registry(stores):
+    merged = Registry()
+    for store in stores:
+        for snapshot in store.load_metrics().values():
+            merged.merge(snapshot)
+    return merged
+
+def label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+def prometheus_text(source):
+    lines = []
+    with source.lock:
+        for name in sorted({name for name, _ in source.counters}):
+            lines.append(f"# TYPE {PREFIX}_{name} counter")
+            for (metric, labels), value in sorted(source.counters.items()):
+                if metric == name:
+                    lines.append(f"{PREFIX}_{name}{label_text(labels)} {value}")
+        for name in sorted({name for name, _ in source.histograms}):
+            lines.append(f"# TYPE {PREFIX}_{name} histogram")
+            for (metric, labels), histogram in sorted(source.histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{PREFIX}_{name}_bucket{label_text(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{PREFIX}_{name}_sum{label_text(labels)} {histogram.sum}")
+                lines.append(f"{PREFIX}_{name}_count{label_text(labels)} {histogram.count}")
+    return '\n'.join(lines) + '\n'
+
+def summary(source):
+    # Сводка для поиска узкого места: время и элементы по этапам, задержки по хостам
+    stages = {}
+    hosts = {}
+    with source.lock:
+        for (name, labels), value in source.counters.items():
+            labels = dict(labels)
+            if name in (STAGE_SECONDS, STAGE_ITEMS_IN, STAGE_ITEMS_OUT):
+                field = {STAGE_SECONDS: 'seconds', STAGE_ITEMS_IN: 'items_in', STAGE_ITEMS_OUT: 'items_out'}[name]
+                stages.setdefault(labels['stage'], {})[field] = value
+            elif name in (HTTP_RETRIES, HTTP_THROTTLED, HTTP_REQUESTS):
+                host = hosts.setdefault(labels['host'], {})
+                field = {HTTP_RETRIES: 'retries', HTTP_THROTTLED: 'throttled'}.get(name)
+                if name == HTTP_REQUESTS and not labels['status'].startswith('2'):
+                    field = 'errors'
+                if field:
+                    host[field] = host.get(field, 0) + value
+        for (name, labels), histogram in source.histograms.items():
+            if name == HTTP_SECONDS:
+                p95 = histogram.quantile(0.95)
+                hosts.setdefault(dict(labels)['host'], {}).update(
+                    requests=histogram.count, mean_ms=round(histogram.sum / histogram.count * 1000, 1),
+                    p95_ms_le=p95 * 1000 if p95 is not None else None)
+            elif name == RATE_LIMIT_WAIT_SECONDS:
+                host = hosts.setdefault(dict(labels)['host'], {})
+                host['rate_limit_wait_s'] = round(host.get('rate_limit_wait_s', 0) + histogram.sum, 2)
+    for values in stages.values():
+        if values.get('seconds') and values.get('items_in'):
+            values['items_per_second'] = round(values['items_in'] / values['seconds'], 2)
+    return {"stages": stages, "hosts": hosts}
+
+def metrics_dir():
+    return os.environ.get('ENZYME_METRICS_DIR', DEFAULT_METRICS_DIR)
+
+def write_run_report(run_id, stores, output_dir=None):
+    # Отчёт по запуску: <каталог>/<run_id>.json и <run_id>.prom. В режиме --subprocess
+    # у каждого фермента свой подзапуск, поэтому объединяются метрики всех переданных хранилищ
+    source = run_registry(stores)
+    output_dir = output_dir or metrics_dir()
+    os.makedirs(output_dir, exist_ok=True)
+    base = os.path.join(output_dir, run_id)
+    report = {"run_id": run_id, "created": time.time(), **summary(source), "metrics": source.snapshot()}
+    with open(f"{base}.json", 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(f"{base}.prom", 'w', encoding='utf-8') as f:
+        f.write(prometheus_text(source))
+    for stage_name, values in sorted(report["stages"].items(), key=lambda item: -item[1].get('seconds', 0)):
+        logging.info(f"Метрики {stage_name}: {values.get('seconds', 0):.2f} с, "
+                     f"вход {values.get('items_in', 0)}, выход {values.get('items_out', 0)}")
+    logging.info(f"Отчёт метрик сохранён: {base}.json, {base}.prom")
+    return report
\ No newline at end of file
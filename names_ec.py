@@ -1,121 +1,354 @@
-import pandas as pd
-import logging
-import asyncio
-from playwright.async_api import async_playwright, TimeoutError
-import sys
-import argparse
-import redis
-import json
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Подключение к Redis
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
-
-async def fetch_ec_numbers_by_name(playwright, ferment_name, existing_ec_numbers, wait_time=5000):
-    try:
-        # Запускаем браузер и открываем новую страницу
-        browser = await playwright.chromium.launch(headless=True)
-        page = await browser.new_page()
-
-        # Устанавливаем стандартное время ожидания
-        page.set_default_timeout(wait_time)
-
-        # Переходим на страницу поиска по названию фермента
-        await page.goto("https://enzyme.expasy.org/enzyme-byname.html")
-
-        # Ждём загрузки поля ввода
-        await page.wait_for_selector('xpath=/html/body/main/div/center/form/input[1]')
-
-        # Вводим название фермента и нажимаем на кнопку поиска
-        await page.fill('xpath=/html/body/main/div/center/form/input[1]', ferment_name)
-        await page.click('xpath=/html/body/main/div/center/form/input[2]')
-
-        # Попытка ожидания загрузки таблицы результатов или проверки на наличие сообщения об ошибке
-        try:
-            await page.wait_for_selector("//table[@class='type-1']//tr", timeout=wait_time)
-
-            # Проверка на наличие сообщения об отсутствии результатов
-            if await page.is_visible("text=No ENZYME entry was found with name containing"):
-                logging.warning(f"Результаты для '{ferment_name}' не найдены.")
-                await page.close()
-                await browser.close()
-                return []
-
-            # Если таблица найдена, извлекаем данные
-            rows = await page.query_selector_all("//table[@class='type-1']//tr")
-            ec_results = {}
-
-            for row in rows:
-                ec_number_element = await row.query_selector("td:nth-child(1) > a")
-                ec_number = (await ec_number_element.text_content()).strip() if ec_number_element else None
-
-                # Проверяем, не является ли EC номер дубликатом
-                if ec_number in existing_ec_numbers:
-                    logging.info(f"Дубликат EC номера '{ec_number}' обнаружен, он будет пропущен.")
-                    continue
-
-                descriptions_element = await row.query_selector("td:nth-child(2)")
-                descriptions = (await descriptions_element.text_content()).strip().split('\n') if descriptions_element else []
-
-                # Удаляем первые три символа у каждого названия фермента
-                descriptions = [desc[3:].strip() for desc in descriptions if len(desc) > 3]
-
-                # Объединяем названия ферментов для одного EC номера в одну строку
-                ec_results[ec_number] = descriptions
-                existing_ec_numbers.add(ec_number)
-
-            formatted_results = [{"EC Number": ec_number, "Protein": "\n".join(descriptions)}
-                                 for ec_number, descriptions in ec_results.items()]
-
-            await page.close()
-            await browser.close()
-            return formatted_results
-
-        except TimeoutError:
-            logging.warning(f"Результаты для '{ferment_name}' не найдены.")
-            await page.close()
-            await browser.close()
-            return []
-
-    except Exception as e:
-        logging.error(f"Ошибка при поиске EC номеров для '{ferment_name}': {e}")
-        return []
-
-async def process_input(ferment_names):
-    results = []
-    not_found = []
-    existing_ec_numbers = set()
-
-    async with async_playwright() as playwright:
-        for index, name in enumerate(ferment_names):
-            ec_numbers = await fetch_ec_numbers_by_name(playwright, name, existing_ec_numbers)
-            if ec_numbers:
-                results.extend(ec_numbers)
-            else:
-                not_found.append({"Protein": name})
-
-    return results, not_found
-
-def save_results_to_redis(results, not_found):
-    if results:
-        redis_client.set('names_ec_results', json.dumps(results))
-        logging.info("Результаты сохранены в Redis под ключом 'names_ec_results'.")
-    if not_found:
-        redis_client.set('not_found_results', json.dumps(not_found))
-        logging.info("Ферменты без EC номеров сохранены в Redis под ключом 'not_found_results'.")
-
-def parse_arguments():
-    parser = argparse.ArgumentParser(description="Парсер ферментов с сайта ExPASy")
-    parser.add_argument('ferment', type=str, help="Название фермента для поиска")
-    return parser.parse_args()
-
-async def main():
-    args = parse_arguments()
-    ferment_names = [args.ferment]
-    results, not_found = await process_input(ferment_names)
-    save_results_to_redis(results, not_found)
-
-if __name__ == "__main__":
+import logging
+import asyncio
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+from config import lazy_module, setup_logging
+from enzyme_index import open_index
+from http_cache import CacheMiss, get_default_cache
+from ingest import normalize_name
+from journal import ERROR, FOUND, NOT_FOUND, Journal
+import metrics
+from ratelimit import get_limiter
+from storage import NAMES_EC, NAMES_NOT_FOUND, RunStore, name_memo, new_run_id
+import argparse
+import os
+import time
+
+# aiohttp и lxml загружаются при первом запросе, Playwright — только при запуске браузера
+aiohttp = lazy_module('aiohttp')
+html = lazy_module('lxml.html')
+
+# Адрес ExPASy можно переопределить (например, локальным сервером benchmarks/replay_server.py)
+EXPASY_URL = os.environ.get('ENZYME_EXPASY_URL', "https://enzyme.expasy.org")
+BYNAME_PAGE_URL = f"{EXPASY_URL}/enzyme-byname.html"
+BYNAME_SEARCH_URL = f"{EXPASY_URL}/cgi-bin/enzyme/enzyme-search-de"
+NOT_FOUND_TEXT = "No ENZYME entry was found with name containing"
+# Строки таблицы результатов или сообщение об их отсутствии
+RESULTS_XPATH = f"//table[@class='type-1']//tr | //*[contains(text(), '{NOT_FOUND_TEXT}')]"
+
+class BrowserPool:
+    # Один браузер на весь запуск и ограниченный пул переиспользуемых контекстов/страниц.
+    # Playwright и Chromium запускаются только при первом обращении к странице
+    def __init__(self, size=4, wait_time=5000):
+        self.playwright = None
+        self.wait_time = wait_time
+        self.browser = None
+        self.idle_pages = []
+        self.slots = asyncio.Semaphore(size)
+        self.lock = asyncio.Lock()
+
+    async def new_page(self):
+        async with self.lock:
+            if self.playwright is None:
+                from playwright.async_api import async_playwright
+                self.playwright = await async_playwright().start()
+            if self.browser is None:
+                self.browser = await self.playwright.chromium.launch(headless=True)
+        context = await self.browser.new_context()
+        page = await context.new_page()
+        page.set_default_timeout(self.wait_time)
+        return page
+
+    async def acquire(self):
+        await self.slots.acquire()
+        try:
+            if self.idle_pages:
+                return self.idle_pages.pop()
+            return await self.new_page()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    async def release(self, page, broken=False):
+        try:
+            if broken or page.is_closed():
+                # Страница в неизвестном состоянии — закрываем контекст, при необходимости будет создана новая
+                try:
+                    await page.context.close()
+                except Exception:
+                    pass
+            else:
+                self.idle_pages.append(page)
+        finally:
+            self.slots.release()
+
+    @asynccontextmanager
+    async def page(self):
+        page = await self.acquire()
+        try:
+            yield page
+        except BaseException:
+            await self.release(page, broken=True)
+            raise
+        else:
+            await self.release(page)
+
+    async def close(self):
+        if self.browser is not None:
+            await self.browser.close()
+            self.browser = None
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
+
+def clean_descriptions(descriptions):
+    # Удаляем первые три символа у каждого названия фермента
+    return [desc[3:].strip() for desc in descriptions if len(desc) > 3]
+
+def filter_duplicate_ec_numbers(rows, existing_ec_numbers):
+    # Выполняется без await, поэтому проверка и добавление в existing_ec_numbers атомарны
+    # относительно других одновременно выполняющихся поисков
+    ec_results = {}
+    for ec_number, descriptions in rows:
+        # Строки без EC номера (например, заголовок таблицы) пропускаем
+        if not ec_number:
+            continue
+
+        # Проверяем, не является ли EC номер дубликатом
+        if ec_number in existing_ec_numbers:
+            logging.info(f"Дубликат EC номера '{ec_number}' обнаружен, он будет пропущен.")
+            continue
+
+        # Объединяем названия ферментов для одного EC номера в одну строку
+        ec_results[ec_number] = descriptions
+        existing_ec_numbers.add(ec_number)
+
+    return [{"EC Number": ec_number, "Protein": "\n".join(descriptions)}
+            for ec_number, descriptions in ec_results.items()]
+
+def parse_byname_page(content):
+    # Разбор страницы результатов за один проход lxml.
+    # Возвращает [] если ферментов не найдено и None если страница не похожа на ожидаемую
+    if NOT_FOUND_TEXT.encode() in content:
+        return []
+    tree = html.fromstring(content)
+    rows = tree.xpath("//table[@class='type-1']//tr")
+    if not rows:
+        return None
+
+    parsed_rows = []
+    for row in rows:
+        ec_number_elements = row.xpath("./td[1]/a")
+        ec_number = ec_number_elements[0].text_content().strip() if ec_number_elements else None
+
+        descriptions_elements = row.xpath("./td[2]")
+        descriptions = descriptions_elements[0].text_content().strip().split('\n') if descriptions_elements else []
+        parsed_rows.append((ec_number, clean_descriptions(descriptions)))
+    return parsed_rows
+
+async def fetch_ec_rows_http(session, ferment_name):
+    url = f"{BYNAME_SEARCH_URL}?{quote(ferment_name)}"
+    cache = get_default_cache()
+    cached = await cache.get_async(url, 'expasy_byname') if cache is not None else None
+    if cached is not None:
+        return parse_byname_page(cached.body)
+
+    limiter = get_limiter()
+    await limiter.acquire_async(url)
+    start = time.perf_counter()
+    async with session.get(url) as response:
+        metrics.observe_http(url, time.perf_counter() - start, response.status)
+        await limiter.record_async(url, response.status, time.perf_counter() - start,
+                                   response.headers.get('Retry-After'))
+        if response.status != 200:
+            logging.debug(f"Быстрый поиск для '{ferment_name}' вернул статус {response.status}")
+            return None
+        content = await response.read()
+
+    rows = parse_byname_page(content)
+    # Неразобранные страницы не кэшируем, чтобы в следующий раз снова попробовать браузер
+    if rows is not None and cache is not None:
+        await cache.put_async(url, 'expasy_byname', response.status, content, negative=not rows)
+    return rows
+
+async def fetch_ec_rows_browser(pool, ferment_name):
+    # Как и fetch_ec_rows_http: [] только для страницы «не найдено», None если результатов дождаться не удалось
+    from playwright.async_api import TimeoutError
+    async with pool.page() as page, metrics.timer(metrics.BROWSER_PAGE_SECONDS, host=metrics.host_of(BYNAME_PAGE_URL)):
+        # Переходим на страницу поиска по названию фермента; загрузка страницы и отправка формы
+        # идут через общий планировщик запросов к хосту
+        limiter = get_limiter()
+        await limiter.acquire_async(BYNAME_PAGE_URL)
+        start = time.perf_counter()
+        response = await page.goto(BYNAME_PAGE_URL)
+        if response is not None:
+            await limiter.record_async(BYNAME_PAGE_URL, response.status, time.perf_counter() - start,
+                                       await response.header_value('retry-after'))
+
+        # Ждём загрузки поля ввода
+        await page.wait_for_selector('xpath=/html/body/main/div/center/form/input[1]')
+
+        # Вводим название фермента и нажимаем на кнопку поиска
+        await page.fill('xpath=/html/body/main/div/center/form/input[1]', ferment_name)
+        await limiter.acquire_async(BYNAME_SEARCH_URL)
+        await page.click('xpath=/html/body/main/div/center/form/input[2]')
+
+        # Ждём таблицу результатов или сообщение об их отсутствии. Таймаут означает сбой поиска,
+        # а не отсутствие фермента, поэтому такой результат не запоминается
+        try:
+            await page.wait_for_selector(f"xpath={RESULTS_XPATH}", timeout=pool.wait_time)
+        except TimeoutError:
+            logging.warning(f"Страница результатов для '{ferment_name}' не загрузилась за {pool.wait_time} мс.")
+            return None
+
+        # Проверка на наличие сообщения об отсутствии результатов
+        if await page.is_visible(f"text={NOT_FOUND_TEXT}"):
+            return []
+
+        # Если таблица найдена, извлекаем все строки за один вызов в браузере
+        rows = await page.eval_on_selector_all(
+            "table.type-1 tr",
+            """rows => rows.map(row => {
+                const ec = row.querySelector('td:nth-child(1) > a');
+                const descriptions = row.querySelector('td:nth-child(2)');
+                return [
+                    ec ? ec.textContent.trim() : null,
+                    descriptions ? descriptions.textContent.trim().split('\\n') : [],
+                ];
+            })"""
+        )
+    return [(ec_number, clean_descriptions(descriptions)) for ec_number, descriptions in rows]
+
+def memo_key(ferment_name):
+    normalized = normalize_name(ferment_name)
+    return normalized[0] if normalized else None
+
+def prefetch_memo(memo, ferment_names):
+    if memo is not None:
+        memo.prefetch(key for key in map(memo_key, ferment_names) if key)
+
+async def fetch_ec_numbers_by_name(pool, ferment_name, existing_ec_numbers, session=None, index=None, memo=None):
+    # Возвращает [] если ферментов не найдено и None если поиск не удался (ошибка или нет в кэше)
+    try:
+        rows = None
+        if index is not None:
+            # Локальный индекс enzyme.dat отвечает без обращения к сети
+            rows = index.search_names(ferment_name) or None
+
+        key = memo_key(ferment_name) if memo is not None and rows is None else None
+        if key is not None:
+            # Результат прошлого запуска: найденные EC номера или известное отсутствие фермента
+            remembered = memo.get(key)
+            if remembered is not None:
+                if not remembered:
+                    logging.info(f"Результаты для '{ferment_name}' не найдены (по данным прошлых запусков).")
+                    return []
+                return filter_duplicate_ec_numbers(remembered, existing_ec_numbers)
+
+        if rows is None and session is not None:
+            # Быстрый режим: обычный GET запрос без браузера
+            try:
+                rows = await fetch_ec_rows_http(session, ferment_name)
+            except CacheMiss:
+                logging.warning(f"Результаты для '{ferment_name}' отсутствуют в кэше.")
+                return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                metrics.inc(metrics.HTTP_REQUESTS, host=metrics.host_of(BYNAME_SEARCH_URL), status='error')
+                logging.debug(f"Ошибка быстрого поиска для '{ferment_name}': {e}")
+            if rows is None:
+                logging.info(f"Не удалось разобрать ответ для '{ferment_name}' без браузера, используется Playwright.")
+
+        if rows is None:
+            cache = get_default_cache()
+            if cache is not None and cache.offline:
+                logging.warning(f"Результаты для '{ferment_name}' отсутствуют в кэше.")
+                return None
+            rows = await fetch_ec_rows_browser(pool, ferment_name)
+            if rows is None:
+                return None
+
+        # Сюда доходят только разобранные страницы: строки результатов или страница «не найдено»
+        if key is not None:
+            memo.put(key, rows)
+
+        if not rows:
+            logging.warning(f"Результаты для '{ferment_name}' не найдены.")
+            return []
+
+        return filter_duplicate_ec_numbers(rows, existing_ec_numbers)
+
+    except Exception as e:
+        logging.error(f"Ошибка при поиске EC номеров для '{ferment_name}': {e}")
+        return None
+
+async def process_input(ferment_names, concurrency=4, use_http=True, index=None, existing_ec_numbers=None, outcomes=None,
+                        memo=None, checkpoint=None):
+    # checkpoint(название, EC номера или None) вызывается сразу по завершении поиска каждого названия
+    results = []
+    not_found = []
+    existing_ec_numbers = set() if existing_ec_numbers is None else existing_ec_numbers
+    prefetch_memo(memo, ferment_names)
+
+    pool = BrowserPool(size=concurrency)
+    session = None
+    if use_http:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=concurrency),
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+    async def lookup(name):
+        ec_numbers = await fetch_ec_numbers_by_name(pool, name, existing_ec_numbers, session=session, index=index,
+                                                    memo=memo)
+        if checkpoint is not None:
+            checkpoint(name, ec_numbers)
+        return ec_numbers
+
+    try:
+        lookups = await asyncio.gather(*(lookup(name) for name in ferment_names))
+    finally:
+        if session is not None:
+            await session.close()
+        await pool.close()
+
+    for name, ec_numbers in zip(ferment_names, lookups):
+        if ec_numbers:
+            results.extend(ec_numbers)
+        else:
+            not_found.append({"Protein": name})
+        if outcomes is not None:
+            outcomes[name] = ERROR if ec_numbers is None else FOUND if ec_numbers else NOT_FOUND
+
+    return results, not_found
+
+def save_results(store, results, not_found):
+    store.write(NAMES_EC, results)
+    store.write(NAMES_NOT_FOUND, not_found)
+    logging.info(f"Результаты сохранены в Redis: {len(results)} EC номеров, {len(not_found)} ферментов без EC номеров (запуск {store.run_id}).")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Парсер ферментов с сайта ExPASy")
+    parser.add_argument('ferment', type=str, help="Название фермента для поиска")
+    parser.add_argument('--concurrency', type=int, default=4, help="Количество одновременных поисков")
+    parser.add_argument('--index', type=str, help="Путь к локальному индексу ENZYME (enzyme_index.py)")
+    parser.add_argument('--run-id', type=str, help="Идентификатор запуска для ключей Redis (по умолчанию создаётся новый)")
+    parser.add_argument('--browser-only', action='store_true', help="Не использовать быстрый HTTP режим, искать только через Playwright")
+    parser.add_argument('--no-memo', action='store_true', help="Не использовать результаты поиска прошлых запусков")
+    return parser.parse_args()
+
+async def main():
+    setup_logging()
+    args = parse_arguments()
+    ferment_names = [args.ferment]
+    index = open_index(args.index)
+    store = RunStore(args.run_id or new_run_id())
+    # Журнал этапа читают оркестратор (таблица соответствия входу) и --skip-resolved последующих запусков
+    journal = Journal(store.run_id, NAMES_EC)
+
+    def checkpoint(name, records):
+        journal.record(name, ERROR if records is None else FOUND if records else NOT_FOUND)
+
+    try:
+        with metrics.stage(NAMES_EC, items_in=len(ferment_names)):
+            results, not_found = await process_input(ferment_names, concurrency=args.concurrency,
+                                                     use_http=not args.browser_only, index=index,
+                                                     memo=None if args.no_memo else name_memo(),
+                                                     checkpoint=checkpoint)
+    finally:
+        journal.close()
+    metrics.items_out(NAMES_EC, len(results))
+    save_results(store, results, not_found)
+    store.mark_done(NAMES_EC)
+    metrics.publish(store, NAMES_EC)
+
+if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
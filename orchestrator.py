@@ -1,91 +1,192 @@
-import subprocess
-import sys
-import logging
-import argparse
-import pandas as pd
-from pathlib import Path
-import os
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-def run_script(script_path, args=None):
-    command = [sys.executable, str(script_path)]
-    if args:
-        command.extend(args)
-    
-    logging.info(f"Запуск скрипта: {script_path}")
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    
-    stdout, stderr = process.communicate()
-    
-    if process.returncode != 0:
-        logging.error(f"Ошибка при выполнении {script_path}:")
-        logging.error(stderr)
-        sys.exit(1)
-    else:
-        logging.info(f"Скрипт {script_path} успешно выполнен")
-        logging.debug(stdout)
-
-def main():
-    parser = argparse.ArgumentParser(description="Система обработки данных о ферментах")
-    parser.add_argument('--enzyme', type=str, help="Название фермента для поиска")
-    parser.add_argument('--file', type=Path, help="Путь к файлу с названиями ферментов (колонка 'Protein')")
-    parser.add_argument('--names_ec_path', type=Path, default=Path('names_ec.py'), help="Путь к names_ec.py")
-    parser.add_argument('--ec_entries_path', type=Path, default=Path('ec_entries.py'), help="Путь к ec_entries.py")
-    parser.add_argument('--entries_sequence_path', type=Path, default=Path('ent_seq_v2.py'), help="Путь к entries_sequence.py")
-    parser.add_argument('--smile_spider_path', type=Path, default=Path('C:/Users/vasae/parsing/smiles/smiles/spiders/smile_spider.py'), help="Путь к smile_spider.py")
-    parser.add_argument('--use-diamond', action='store_true', help="Включить функционал DIAMOND для анализа")
-    
-    # Аргументы для DIAMOND
-    parser.add_argument('--query', type=str, help="Путь к входному файлу FASTA для DIAMOND")
-    parser.add_argument('--db', type=str, help="Путь к базе данных DIAMOND")
-    parser.add_argument('--out', type=str, help="Путь к выходному файлу результатов DIAMOND")
-    parser.add_argument('--threads', type=int, default=4, help="Количество потоков для DIAMOND")
-    parser.add_argument('--sensitive', action='store_true', help="Использовать чувствительный режим DIAMOND")
-    
-    args = parser.parse_args()
-
-    if args.use_diamond:
-        # Запуск только DIAMOND анализа
-        diamond_args = [
-            '--use-diamond',
-            '--query', args.query,
-            '--db', args.db,
-            '--out', args.out,
-            '--threads', str(args.threads)
-        ]
-        if args.sensitive:
-            diamond_args.extend(['--diamond-mode', 'sensitive'])
-        
-        run_script(args.entries_sequence_path, diamond_args)
-    else:
-        # Стандартный поток выполнения для анализа ферментов
-        enzymes = []
-        
-        if args.file:
-            # Чтение значений из файла
-            try:
-                df = pd.read_excel(args.file)
-                enzymes = df['Protein'].tolist()
-                logging.info(f"Файл '{args.file}' успешно прочитан. Найдено {len(enzymes)} записей.")
-            except Exception as e:
-                logging.error(f"Ошибка чтения файла '{args.file}': {e}")
-                sys.exit(1)
-        elif args.enzyme:
-            enzymes.append(args.enzyme)
-        else:
-            logging.error("Необходимо указать либо название фермента, либо путь к файлу.")
-            sys.exit(1)
-
-        # Запуск скриптов по очереди для каждого фермента
-        for enzyme in enzymes:
-            run_script(args.names_ec_path, [enzyme])
-            run_script(args.ec_entries_path)
-            run_script(args.entries_sequence_path)
-            run_script(args.smile_spider_path)
-
-        logging.info("Все скрипты успешно выполнены. Результаты сохранены в файл Final_results.xlsx")
-
-if __name__ == "__main__":
+import subprocess
+import sys
+import logging
+import argparse
+from pathlib import Path
+import os
+from config import configure, setup_logging
+from http_cache import configure as configure_cache
+from ingest import DEFAULT_COLUMN, input_map_path, normalize_name, read_names, skip_resolved, write_input_map
+from journal import Journal
+from metrics import write_run_report
+from ratelimit import BULK, INTERACTIVE, configure as configure_rate_limit
+from storage import EC_ENTRIES, NAMES_EC, REACTIONS, SEQUENCES, RunStore, new_run_id
+
+def run_script(script_path, args=None):
+    command = [sys.executable, str(script_path)]
+    if args:
+        command.extend(args)
+    
+    logging.info(f"Запуск скрипта: {script_path}")
+    # Вывод скрипта (журнал и прогресс) идёт прямо в консоль, а не копится до завершения
+    process = subprocess.run(command)
+    
+    if process.returncode != 0:
+        logging.error(f"Ошибка при выполнении {script_path} (код {process.returncode})")
+        return False
+    logging.info(f"Скрипт {script_path} успешно выполнен")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Система обработки данных о ферментах")
+    parser.add_argument('--enzyme', type=str, help="Название фермента для поиска")
+    parser.add_argument('--file', type=Path, help="Файл с названиями ферментов: xlsx, CSV, TSV, Parquet (колонка 'Protein'), "
+                        "текстовый файл или '-' для stdin (по названию в строке)")
+    parser.add_argument('--column', type=str, default=DEFAULT_COLUMN, help="Колонка с названиями ферментов в --file")
+    parser.add_argument('--skip-resolved', action='store_true', help="Не искать названия, уже обработанные в прошлых запусках "
+                        "(по журналам); в таблице соответствия указывается запуск с их результатами")
+    parser.add_argument('--names_ec_path', type=Path, default=Path('names_ec.py'), help="Путь к names_ec.py")
+    parser.add_argument('--ec_entries_path', type=Path, default=Path('ec_entries.py'), help="Путь к ec_entries.py")
+    parser.add_argument('--entries_sequence_path', type=Path, default=Path('ent_seq_v2.py'), help="Путь к entries_sequence.py")
+    parser.add_argument('--smile_spider_path', type=Path, default=Path('C:/Users/vasae/parsing/smiles/smiles/spiders/smile_spider.py'), help="Путь к smile_spider.py")
+    parser.add_argument('--use-diamond', action='store_true', help="Включить функционал DIAMOND для анализа")
+    parser.add_argument('--subprocess', action='store_true', help="Запускать этапы отдельными процессами для каждого фермента (резервный режим)")
+    parser.add_argument('--streaming', action='store_true', help="Потоковый режим: этапы работают одновременно и передают записи по мере получения")
+    parser.add_argument('--distributed', action='store_true', help="Распределённый режим: элементы этапов обрабатываются рабочими "
+                        "процессами (worker.py) на любых машинах через общие очереди Redis")
+    parser.add_argument('--workers', type=int, default=1, help="Количество локальных рабочих процессов в режиме --distributed "
+                        "(0 — только рабочие на других машинах)")
+    parser.add_argument('--output', type=str, help="Путь к итоговому CSV или Excel (.xlsx) файлу")
+    parser.add_argument('--rhea-batched', action='store_true', help="Получать реакции Rhea пакетными табличными запросами без браузера")
+    parser.add_argument('--index', type=str, help="Путь к локальному индексу ENZYME (enzyme_index.py)")
+    parser.add_argument('--run-id', type=str, help="Идентификатор запуска для ключей Redis (по умолчанию создаётся новый)")
+    parser.add_argument('--resume', type=str, metavar='RUN_ID', help="Продолжить прерванный запуск: обработать только недостающие и завершившиеся ошибкой элементы")
+    parser.add_argument('--cache-dir', type=str, help="Каталог общего HTTP кэша для всех этапов")
+    parser.add_argument('--cache-only', action='store_true', help="Работать только с HTTP кэшем, без обращений к сети")
+    parser.add_argument('--concurrency', type=int, default=4, help="Количество одновременных запросов при поиске EC номеров")
+    parser.add_argument('--metrics-dir', type=str, help="Каталог отчёта метрик запуска (JSON и Prometheus, по умолчанию .metrics)")
+    parser.add_argument('--redis-url', type=str, help="Адрес Redis для всех этапов (по умолчанию ENZYME_REDIS_URL или redis://localhost:6379/0)")
+    parser.add_argument('--log-level', type=str, help="Уровень журнала (по умолчанию ENZYME_LOG_LEVEL или INFO)")
+    parser.add_argument('--priority', choices=[INTERACTIVE, BULK], help="Приоритет запросов в общем планировщике хостов "
+                        "(по умолчанию interactive для --enzyme и bulk для --file)")
+    parser.add_argument('--no-memo', action='store_true', help="Не использовать результаты поиска по названиям из прошлых запусков "
+                        "(память хранит найденные EC номера 30 дней, отсутствие фермента — 1 день)")
+    parser.add_argument('--rate-db', type=str, help="Файл SQLite общего планировщика запросов (по умолчанию во временном каталоге)")
+    
+    # Аргументы для DIAMOND
+    parser.add_argument('--query', type=str, help="Путь к входному файлу FASTA для DIAMOND")
+    parser.add_argument('--db', type=str, help="Путь к базе данных DIAMOND")
+    parser.add_argument('--out', type=str, help="Путь к выходному файлу результатов DIAMOND")
+    parser.add_argument('--threads', type=int, default=4, help="Количество потоков для DIAMOND")
+    parser.add_argument('--sensitive', action='store_true', help="Использовать чувствительный режим DIAMOND")
+    parser.add_argument('--shards', type=int, help="Количество частей запроса для параллельного запуска DIAMOND")
+    
+    args = parser.parse_args()
+    configure(redis_url=args.redis_url, log_level=args.log_level)
+    setup_logging()
+
+    if args.cache_dir:
+        configure_cache(args.cache_dir, offline=args.cache_only)
+    elif args.cache_only:
+        logging.error("Для режима --cache-only необходимо указать --cache-dir.")
+        sys.exit(1)
+    # Запрос одного фермента обслуживается раньше пакетных заданий, идущих к тем же хостам
+    configure_rate_limit(args.rate_db, args.priority or (BULK if args.file else INTERACTIVE))
+    if args.no_memo:
+        # Через окружение настройку видят и этапы в отдельных процессах
+        os.environ['ENZYME_NAME_MEMO'] = '0'
+
+    if args.use_diamond:
+        # Запуск только DIAMOND анализа
+        diamond_args = [
+            '--use-diamond',
+            '--query', args.query,
+            '--db', args.db,
+            '--out', args.out,
+            '--threads', str(args.threads)
+        ]
+        if args.sensitive:
+            diamond_args.extend(['--diamond-mode', 'sensitive'])
+        if args.shards:
+            diamond_args.extend(['--shards', str(args.shards)])
+        
+        if not run_script(args.entries_sequence_path, diamond_args):
+            sys.exit(1)
+    else:
+        # Стандартный поток выполнения для анализа ферментов
+        enzymes = []
+        names = None
+        resume = args.resume is not None
+        run_id = args.resume or args.run_id or new_run_id()
+
+        if args.file:
+            # Потоковое чтение файла: пустые строки и повторы названий отбрасываются до поиска
+            try:
+                names = read_names(args.file, args.column)
+            except (OSError, ValueError, ImportError) as e:
+                logging.error(f"Ошибка чтения файла '{args.file}': {e}")
+                sys.exit(1)
+            if args.skip_resolved:
+                skip_resolved(names, exclude_run_ids={run_id})
+            enzymes = names.pending()
+        elif args.enzyme and normalize_name(args.enzyme):
+            enzymes.append(normalize_name(args.enzyme)[1])
+        else:
+            logging.error("Необходимо указать либо название фермента, либо путь к файлу.")
+            sys.exit(1)
+
+        output_file = args.output or 'Final_data.csv'
+        if not enzymes:
+            logging.info("Новых названий для поиска нет.")
+            write_input_map(input_map_path(output_file), names, {})
+            return
+        if args.subprocess:
+            # Запуск скриптов по очереди для каждого фермента, у каждого фермента свой подзапуск в Redis.
+            # Ошибка одного фермента не останавливает остальные; при --resume завершённые этапы пропускаются
+            failed = []
+            stores = []
+            for number, enzyme in enumerate(enzymes, start=1):
+                sub_run_id = f"{run_id}.{number}"
+                store = RunStore(sub_run_id)
+                stores.append(store)
+                run_args = ['--run-id', sub_run_id]
+                index_args = ['--index', args.index] if args.index else []
+                spider_args = run_args + (['--output', args.output] if args.output else [])
+                spider_args += (['--batched'] if args.rhea_batched else []) + (['--resume'] if resume else [])
+                stages = [
+                    (NAMES_EC, args.names_ec_path, [enzyme] + run_args + index_args),
+                    (EC_ENTRIES, args.ec_entries_path, run_args + index_args),
+                    (SEQUENCES, args.entries_sequence_path, run_args),
+                    (REACTIONS, args.smile_spider_path, spider_args),
+                ]
+                for stage, script_path, script_args in stages:
+                    if resume and store.is_done(stage):
+                        continue
+                    if not run_script(script_path, script_args):
+                        failed.append(enzyme)
+                        break
+            write_run_report(run_id, stores, args.metrics_dir)
+            if names is not None:
+                outcomes = {enzyme: (Journal(store.run_id, NAMES_EC).load().get(enzyme, ''), store.run_id)
+                            for enzyme, store in zip(enzymes, stores)}
+                write_input_map(input_map_path(output_file), names, outcomes)
+            if failed:
+                logging.error(f"Не удалось обработать {len(failed)} ферментов. Для повтора: --resume {run_id}")
+                sys.exit(1)
+        elif args.distributed:
+            from worker import run_distributed
+            completed = run_distributed(enzymes, output_file=args.output, run_id=run_id, workers=args.workers,
+                                        concurrency=args.concurrency, index_path=args.index, resume=resume)
+            write_run_report(run_id, [RunStore(run_id)], args.metrics_dir)
+            if not completed:
+                logging.error(f"Запуск не завершён. Для продолжения: --distributed --resume {run_id}")
+                sys.exit(1)
+        elif args.streaming:
+            from pipeline import run_streaming_pipeline
+            run_streaming_pipeline(enzymes, output_file=args.output, concurrency=args.concurrency,
+                                   index_path=args.index, run_id=run_id, rhea_batched=args.rhea_batched,
+                                   resume=resume)
+            write_run_report(run_id, [RunStore(run_id)], args.metrics_dir)
+        else:
+            from pipeline import run_pipeline
+            run_pipeline(enzymes, output_file=args.output, concurrency=args.concurrency, index_path=args.index,
+                         run_id=run_id, rhea_batched=args.rhea_batched, resume=resume)
+            write_run_report(run_id, [RunStore(run_id)], args.metrics_dir)
+        if names is not None and not args.subprocess:
+            outcomes = {enzyme: (status, run_id) for enzyme, status in Journal(run_id, NAMES_EC).load().items()}
+            write_input_map(input_map_path(output_file), names, outcomes)
+
+        logging.info(f"Все скрипты успешно выполнены. Результаты сохранены в файл {output_file}")
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
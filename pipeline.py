@@ -0,0 +1,449 @@
+import asyncio
+import logging
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+
+import names_ec
+import ec_entries
+import ent_seq_v2
+import metrics
+from config import lazy_module
+from enzyme_index import open_index
+from journal import ERROR, FOUND, NOT_FOUND, Journal
+from storage import EC_ENTRIES, EC_NOT_FOUND, NAMES_EC, NAMES_NOT_FOUND, SEQUENCES, RunStore, name_memo, new_run_id
+
+aiohttp = lazy_module('aiohttp')
+
+# Встроенный (in-process) режим: каждый этап запускается один раз для всей партии ферментов
+
+@contextmanager
+def stage_timer(stage_name, timings):
+    logging.info(f"Этап '{stage_name}' запущен")
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage_name] = time.perf_counter() - start
+        logging.info(f"Этап '{stage_name}' завершён за {timings[stage_name]:.2f} с")
+
+def run_names_stage(store, enzymes, concurrency=4, index=None, resume=False):
+    journal = Journal(store.run_id, NAMES_EC)
+    previous = []
+    if resume:
+        # Названия, обработанные до остановки, пропускаем; их EC номера уже записаны в Redis
+        done = journal.done()
+        enzymes = [name for name in enzymes if name not in done]
+        previous = store.read(NAMES_EC)
+
+    def checkpoint(name, records):
+        # Как и в потоковом режиме, результат названия записывается в Redis, а затем в журнал сразу
+        # по завершении поиска, поэтому после остановки посреди этапа --resume повторит только остальные
+        if records:
+            store.write(NAMES_EC, records)
+        else:
+            store.write(NAMES_NOT_FOUND, [{"Protein": name}])
+        journal.record(name, ERROR if records is None else FOUND if records else NOT_FOUND)
+
+    try:
+        with metrics.stage(NAMES_EC, items_in=len(enzymes)):
+            results, not_found = asyncio.run(names_ec.process_input(
+                enzymes, concurrency=concurrency, index=index,
+                existing_ec_numbers={entry['EC Number'] for entry in previous}, memo=name_memo(),
+                checkpoint=checkpoint))
+    finally:
+        journal.close()
+    metrics.items_out(NAMES_EC, len(results))
+    logging.info(f"Результаты сохранены в Redis: {len(results)} EC номеров, {len(not_found)} ферментов без EC номеров (запуск {store.run_id}).")
+    store.mark_done(NAMES_EC)
+    return previous + results
+
+def run_ec_entries_stage(store, names_results, index=None, resume=False):
+    journal = Journal(store.run_id, EC_ENTRIES)
+    ec_numbers = [entry['EC Number'] for entry in names_results]
+    previous = []
+    if resume:
+        done = journal.done()
+        ec_numbers = [ec_number for ec_number in ec_numbers if ec_number not in done]
+        previous = store.read(EC_ENTRIES)
+    seen = {record['EC number'] for record in previous}
+    written = set(seen)
+
+    def checkpoint(ec_number, record, status):
+        if status == NOT_FOUND:
+            store.write(EC_NOT_FOUND, [{"EC number": ec_number}])
+        elif record and record['EC number'] not in written:
+            # Несколько EC номеров могут быть перенесены в одну и ту же запись
+            written.add(record['EC number'])
+            store.write(EC_ENTRIES, [record])
+        journal.record(ec_number, status)
+
+    try:
+        with metrics.stage(EC_ENTRIES, items_in=len(ec_numbers)):
+            results, not_found_ec = ec_entries.fetch_all_enzyme_data(ec_numbers, index=index, checkpoint=checkpoint)
+    finally:
+        journal.close()
+    metrics.items_out(EC_ENTRIES, len(results))
+    store.mark_done(EC_ENTRIES)
+    return previous + [record for record in results if record['EC number'] not in seen]
+
+def run_sequence_stage(store, uniprot_entries, resume=False):
+    journal = Journal(store.run_id, SEQUENCES)
+    done = set()
+    previous = []
+    if resume:
+        done = journal.done()
+        previous = store.read(SEQUENCES)
+
+    def checkpoint(records, statuses):
+        # Пачка записывается в Redis до отметок в журнале; FASTA строится из Redis в конце этапа
+        store.write(SEQUENCES, records)
+        journal.record_all(statuses)
+
+    outcomes = {}
+    try:
+        with metrics.stage(SEQUENCES, items_in=len(uniprot_entries)):
+            results = ent_seq_v2.fetch_sequences(uniprot_entries, exclude=done, outcomes=outcomes,
+                                                 checkpoint=checkpoint)
+        # Пачки без ответа: при возобновлении они будут запрошены снова
+        journal.record_all({entry: status for entry, status in outcomes.items() if status == ERROR})
+    finally:
+        journal.close()
+    metrics.items_out(SEQUENCES, len(results))
+    ent_seq_v2.save_to_fasta(previous + results)
+    store.mark_done(SEQUENCES)
+    return previous + results
+
+def run_rhea_stage(store, sequence_results, output_file=None, batched=False, resume=False):
+    # Scrapy тянет за собой twisted, поэтому импортируем паука только при необходимости
+    import smile_spider
+    smile_spider.run_spider(data=sequence_results, run_id=store.run_id, output_file=output_file, batched=batched,
+                            resume=resume)
+
+def run_pipeline(enzymes, output_file=None, concurrency=4, index_path=None, run_id=None, rhea_batched=False,
+                 resume=False):
+    timings = {}
+    index = open_index(index_path)
+    store = RunStore(run_id or new_run_id())
+    logging.info(f"Идентификатор запуска: {store.run_id}" + (" (возобновление)" if resume else ""))
+
+    with stage_timer('names_ec', timings):
+        names_results = run_names_stage(store, enzymes, concurrency=concurrency, index=index, resume=resume)
+    if not names_results:
+        logging.warning("EC номера не найдены ни для одного фермента, дальнейшие этапы пропущены.")
+        metrics.publish(store, 'pipeline')
+        return timings
+
+    with stage_timer('ec_entries', timings):
+        uniprot_entries = run_ec_entries_stage(store, names_results, index=index, resume=resume)
+
+    with stage_timer('ent_seq_v2', timings):
+        sequence_results = run_sequence_stage(store, uniprot_entries, resume=resume)
+
+    with stage_timer('smile_spider', timings):
+        run_rhea_stage(store, sequence_results, output_file, batched=rhea_batched, resume=resume)
+
+    metrics.publish(store, 'pipeline')
+    total = sum(timings.values())
+    for stage_name, elapsed in timings.items():
+        logging.info(f"{stage_name}: {elapsed:.2f} с ({elapsed / total:.0%})" if total else f"{stage_name}: {elapsed:.2f} с")
+    return timings
+
+# Потоковый режим: этапы работают одновременно и передают записи через очереди asyncio.
+# Ограниченный размер очередей даёт обратное давление: быстрый этап ждёт медленный,
+# а не накапливает в памяти весь промежуточный результат
+STREAM_QUEUE_SIZE = 1000
+
+class FirstResults:
+    # Время от начала запуска до первой записи каждого этапа
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = {}
+
+    def record(self, stage_name):
+        if stage_name not in self.seconds:
+            self.seconds[stage_name] = time.perf_counter() - self.start
+            logging.info(f"Первый результат этапа '{stage_name}' через {self.seconds[stage_name]:.2f} с")
+
+async def stream_names(store, enzymes, ec_queue, first_results, concurrency=4, index=None, resume=False):
+    journal = Journal(store.run_id, NAMES_EC)
+    previous = []
+    if resume:
+        done = journal.done()
+        enzymes = [name for name in enzymes if name not in done]
+        previous = store.read(NAMES_EC)
+    name_queue = asyncio.Queue()
+    for name in enzymes:
+        name_queue.put_nowait(name)
+    existing_ec_numbers = {entry['EC Number'] for entry in previous}
+    found = 0
+    metrics.inc(metrics.STAGE_ITEMS_IN, len(enzymes), stage=NAMES_EC)
+    memo = name_memo()
+    names_ec.prefetch_memo(memo, enzymes)
+
+    pool = names_ec.BrowserPool(size=concurrency)
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=concurrency),
+        timeout=aiohttp.ClientTimeout(total=30),
+    )
+
+    async def worker():
+        nonlocal found
+        while not name_queue.empty():
+            name = name_queue.get_nowait()
+            records = await names_ec.fetch_ec_numbers_by_name(pool, name, existing_ec_numbers,
+                                                              session=session, index=index, memo=memo)
+            if not records:
+                store.write(NAMES_NOT_FOUND, [{"Protein": name}])
+                journal.record(name, NOT_FOUND if records is not None else ERROR)
+                continue
+            store.write(NAMES_EC, records)
+            journal.record(name, FOUND)
+            first_results.record('names_ec')
+            metrics.items_out(NAMES_EC, len(records))
+            found += len(records)
+            for record in records:
+                await ec_queue.put(record['EC Number'])
+
+    try:
+        # EC номера, найденные до остановки: этап ec_entries сам пропустит уже обработанные
+        for entry in previous:
+            await ec_queue.put(entry['EC Number'])
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        await ec_queue.put(None)
+        await session.close()
+        await pool.close()
+        journal.close()
+    store.mark_done(NAMES_EC)
+    logging.info(f"Поиск по названиям завершён: {found} EC номеров")
+
+async def stream_ec_entries(store, ec_queue, accession_queue, first_results, concurrency=16, index=None, timeout=30,
+                            resume=False):
+    journal = Journal(store.run_id, EC_ENTRIES)
+    done = set()
+    previous = []
+    if resume:
+        done = journal.done()
+        previous = store.read(EC_ENTRIES)
+    seen = {record["EC number"] for record in previous}
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def emit(record, write=True):
+        # Несколько EC номеров могут быть перенесены в одну и ту же запись
+        if write:
+            if record["EC number"] in seen:
+                return
+            seen.add(record["EC number"])
+            store.write(EC_ENTRIES, [record])
+            first_results.record('ec_entries')
+            metrics.items_out(EC_ENTRIES, 1)
+        for accession in record.get('Entries', '').split('\n'):
+            if accession:
+                await accession_queue.put(accession)
+
+    async def handle(fetcher, ec_number):
+        try:
+            record, status = await ec_entries.resolve_with_index(fetcher, ec_number, index)
+            if status == "not_found":
+                store.write(EC_NOT_FOUND, [{"EC number": ec_number}])
+            elif record:
+                await emit(record)
+            journal.record(ec_number, {"found": FOUND, "not_found": NOT_FOUND}.get(status, ERROR))
+        except Exception as e:
+            logging.error(f"Error processing data for EC number '{ec_number}': {e}")
+            store.write(EC_NOT_FOUND, [{"EC number": ec_number}])
+            journal.record(ec_number, ERROR)
+        finally:
+            slots.release()
+
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=concurrency),
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as session:
+        fetcher = ec_entries.EnzymeFetcher(session, concurrency=concurrency)
+        try:
+            # Accession записей, полученных до остановки: этап ent_seq_v2 сам пропустит уже обработанные
+            for record in previous:
+                await emit(record, write=False)
+            while True:
+                ec_number = await ec_queue.get()
+                if ec_number is None:
+                    break
+                if ec_number in done:
+                    continue
+                metrics.inc(metrics.STAGE_ITEMS_IN, stage=EC_ENTRIES)
+                # Не берём из очереди больше, чем можем обработать одновременно
+                await slots.acquire()
+                task = asyncio.ensure_future(handle(fetcher, ec_number))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            await accession_queue.put(None)
+            journal.close()
+    store.mark_done(EC_ENTRIES)
+    logging.info(f"Получено {len(seen)} записей EC")
+
+async def stream_sequences(store, accession_queue, first_results, fasta_file='output_sequences.fasta',
+                           batch_size=ent_seq_v2.UNIPROT_MAX_ACCESSIONS, flush_interval=2.0, concurrency=4,
+                           resume=False):
+    # Accession копятся в пачку и отправляются в UniProt, когда пачка заполнена
+    # или первый accession в пачке ждёт дольше flush_interval секунд
+    loop = asyncio.get_running_loop()
+    session = ent_seq_v2.pooled_session(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    journal = Journal(store.run_id, SEQUENCES)
+    # При возобновлении уже обработанные accession не запрашиваются, а FASTA дописывается
+    seen = journal.done() if resume else set()
+    batch = []
+    batch_deadline = None
+    total = 0
+
+    async def fetch_batch(fasta, ids):
+        nonlocal total
+        try:
+            chunk = await loop.run_in_executor(executor, partial(
+                ent_seq_v2.fetch_uniprot_chunk, ids, ent_seq_v2.PROTEIN_COLUMNS, session=session,
+                dtype=ent_seq_v2.COMPACT_DTYPES))
+            if chunk is None:
+                for accession in ids:
+                    journal.record(accession, ERROR)
+                return
+            if chunk.empty:
+                # Ответ без записей (только заголовок): ни одного accession пачки нет в UniProt
+                logging.info(f"No data found for {len(ids)} UniProtKB ACs")
+                for accession in ids:
+                    journal.record(accession, NOT_FOUND)
+                return
+            records = ent_seq_v2.chunk_records(chunk)
+            ent_seq_v2.write_fasta_records(fasta, records)
+            # Пачка сбрасывается на диск до записи в журнал, чтобы после сбоя не потерять её в FASTA
+            fasta.flush()
+            store.write(SEQUENCES, records)
+            first_results.record('ent_seq_v2')
+            metrics.items_out(SEQUENCES, len(records))
+            total += len(records)
+            found = {record['Entry'] for record in records}
+            for accession in ids:
+                journal.record(accession, FOUND if accession in found else NOT_FOUND)
+        except Exception as e:
+            logging.error(f"Ошибка при запросе {len(ids)} accession в UniProt: {e}")
+            for accession in ids:
+                journal.record(accession, ERROR)
+        finally:
+            slots.release()
+
+    async def flush(fasta):
+        nonlocal batch
+        if not batch:
+            return
+        await slots.acquire()
+        task = asyncio.ensure_future(fetch_batch(fasta, batch))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        batch = []
+
+    try:
+        with ent_seq_v2.FastaWriter(fasta_file, append=resume) as fasta:
+            while True:
+                timeout = max(0, batch_deadline - time.perf_counter()) if batch else None
+                try:
+                    accession = await asyncio.wait_for(accession_queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    await flush(fasta)
+                    continue
+                if accession is None:
+                    break
+                if accession in seen:
+                    continue
+                seen.add(accession)
+                metrics.inc(metrics.STAGE_ITEMS_IN, stage=SEQUENCES)
+                if not batch:
+                    batch_deadline = time.perf_counter() + flush_interval
+                batch.append(accession)
+                if len(batch) >= batch_size:
+                    await flush(fasta)
+            await flush(fasta)
+            if tasks:
+                await asyncio.gather(*tasks)
+    finally:
+        executor.shutdown(wait=False)
+        session.close()
+        journal.close()
+    store.mark_done(SEQUENCES)
+    logging.info(f"FASTA файл успешно создан: {fasta_file} ({total} записей)")
+
+async def timed_stage(stage_name, stage):
+    # Этапы выполняются одновременно в одном процессе, поэтому профилируется весь потоковый запуск целиком
+    with metrics.stage(stage_name, profile=False):
+        await stage
+
+async def run_streaming_stages(store, enzymes, concurrency=4, index=None, resume=False):
+    first_results = FirstResults()
+    ec_queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    accession_queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    await asyncio.gather(
+        timed_stage(NAMES_EC, stream_names(store, enzymes, ec_queue, first_results, concurrency=concurrency,
+                                           index=index, resume=resume)),
+        timed_stage(EC_ENTRIES, stream_ec_entries(store, ec_queue, accession_queue, first_results, index=index,
+                                                  resume=resume)),
+        timed_stage(SEQUENCES, stream_sequences(store, accession_queue, first_results, concurrency=concurrency,
+                                                resume=resume)),
+    )
+    return first_results.seconds
+
+def start_rhea_follower(store, output_file=None, spider_script=None, batched=False, resume=False):
+    # Паук работает в отдельном процессе (у Scrapy свой цикл событий twisted) и читает
+    # поток SEQUENCES по мере появления записей, пока этап ent_seq_v2 не отметит завершение
+    command = [sys.executable, str(spider_script or Path(__file__).with_name('smile_spider.py')),
+               '--run-id', store.run_id, '--follow']
+    if output_file:
+        command.extend(['--output', output_file])
+    if batched:
+        command.append('--batched')
+    if resume:
+        command.append('--resume')
+    logging.info("Запуск паука Rhea в режиме чтения потока")
+    return subprocess.Popen(command)
+
+def run_streaming_pipeline(enzymes, output_file=None, concurrency=4, index_path=None, run_id=None, spider_script=None,
+                           rhea_batched=False, resume=False):
+    index = open_index(index_path)
+    store = RunStore(run_id or new_run_id())
+    logging.info(f"Идентификатор запуска: {store.run_id} (потоковый режим)" + (" (возобновление)" if resume else ""))
+    if resume:
+        # Отметки о завершении от прерванной попытки остановили бы паука раньше времени
+        for stage in (NAMES_EC, EC_ENTRIES, SEQUENCES):
+            store.clear_done(stage)
+
+    start = time.perf_counter()
+    spider = start_rhea_follower(store, output_file, spider_script, batched=rhea_batched, resume=resume)
+    profiling = metrics.start_profiler('streaming')
+    try:
+        first_results = asyncio.run(run_streaming_stages(store, enzymes, concurrency=concurrency, index=index,
+                                                         resume=resume))
+    except BaseException:
+        # Без отметки о завершении паук ждал бы новые записи бесконечно
+        spider.terminate()
+        raise
+    finally:
+        metrics.stop_profiler(profiling)
+    metrics.publish(store, 'pipeline')
+    returncode = spider.wait()
+    elapsed = time.perf_counter() - start
+
+    if returncode != 0:
+        logging.error(f"Паук Rhea завершился с кодом {returncode}")
+    logging.info(f"Потоковый запуск завершён за {elapsed:.2f} с")
+    for stage_name, seconds in first_results.items():
+        logging.info(f"{stage_name}: первый результат через {seconds:.2f} с")
+    return first_results
\ No newline at end of file
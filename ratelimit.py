@@ -0,0 +1,278 @@
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import metrics
+
+# Общий для всех этапов и процессов планировщик запросов по хостам. Для каждого хоста
+# хранится корзина токенов (token bucket) в SQLite, поэтому её делят все процессы на машине:
+# этапы в отдельных процессах, пул multiprocessing и паук Scrapy вместе не превышают скорость хоста.
+# Скорость подстраивается по ответам. Пока хост не ограничивал запросы, она растёт
+# примерно вдвое в секунду (как slow start в TCP), после первого ограничения — на 1 запрос/с
+# в секунду. Ответ 429 или ответ с Retry-After уменьшает скорость вдвое, а Retry-After ещё и
+# останавливает запросы к хосту во всех процессах до указанного времени. Ответ 503 без Retry-After
+# (перегрузка или случайный сбой) и задержка ответа больше LATENCY_FACTOR от обычной снижают
+# скорость немного. Ответы на запросы, отправленные до снижения, приходят
+# пачкой, поэтому скорость снижается не чаще раза в DECREASE_INTERVAL. Подобранная скорость
+# переходит в следующие запуски, если к хосту обращались не раньше STATE_TTL назад.
+# Приоритеты: interactive (запрос одного фермента) и bulk (пакетные задания). Пакетным запросам
+# не отдаются последние INTERACTIVE_RESERVE токенов корзины, а внутри процесса они пропускают
+# вперёд ожидающие интерактивные запросы к тому же хосту
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Начальная и наибольшая скорость (запросов в секунду) по хостам
+HOST_RATES = {
+    'enzyme.expasy.org': (5.0, 20.0),
+    'rest.uniprot.org': (10.0, 50.0),
+    'www.rhea-db.org': (5.0, 20.0),
+}
+DEFAULT_RATE = (10.0, 100.0)
+MIN_RATE = 0.2
+THROTTLE_STATUSES = (429, 503)
+DECREASE = 0.5
+SOFT_DECREASE = 0.9
+DECREASE_INTERVAL = 1.0
+LATENCY_FACTOR = 3.0
+LATENCY_ALPHA = 0.2
+INTERACTIVE_RESERVE = 1.0
+BURST_SECONDS = 1.0
+MAX_SLEEP = 1.0
+STATE_TTL = 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    rate REAL NOT NULL,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    blocked_until REAL NOT NULL,
+    latency REAL,
+    throttled INTEGER NOT NULL,
+    decreased_at REAL NOT NULL
+);
+"""
+
+def retry_after_seconds(value):
+    # Retry-After: число секунд или HTTP дата
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def host_rates(host):
+    # Наибольшую скорость можно переопределить: ENZYME_RATE_LIMITS="rest.uniprot.org=20,www.rhea-db.org=5"
+    initial, maximum = HOST_RATES.get(host, DEFAULT_RATE)
+    for item in os.environ.get('ENZYME_RATE_LIMITS', '').split(','):
+        name, _, value = item.partition('=')
+        if name.strip() == host and value:
+            maximum = float(value)
+            initial = min(initial, maximum)
+    return initial, maximum
+
+def capacity(rate):
+    return max(1.0 + INTERACTIVE_RESERVE, rate * BURST_SECONDS)
+
+class RateLimiter:
+    def __init__(self, path, priority=BULK):
+        self.path = str(path)
+        self.priority = priority
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        # Счётчик ожидающих под отдельной блокировкой: self.lock держится на время транзакции SQLite
+        self.waiting_lock = threading.Lock()
+        self.waiting = Counter()
+        # Транзакции открываются явно (BEGIN IMMEDIATE), чтобы чтение и обновление корзины
+        # были атомарны для всех процессов
+        self.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def load(self, host, now):
+        row = self.connection.execute(
+            "SELECT rate, tokens, updated_at, blocked_until, latency, throttled, decreased_at FROM hosts WHERE host = ?",
+            (host,)
+        ).fetchone()
+        if row is None or now - row[2] > STATE_TTL:
+            rate = host_rates(host)[0]
+            return {"rate": rate, "tokens": capacity(rate), "updated_at": now, "blocked_until": 0.0,
+                    "latency": None, "throttled": 0, "decreased_at": 0.0}
+        state = dict(zip(("rate", "tokens", "updated_at", "blocked_until", "latency", "throttled", "decreased_at"), row))
+        # Пополнение корзины за прошедшее время
+        state["tokens"] = min(capacity(state["rate"]), state["tokens"] + (now - state["updated_at"]) * state["rate"])
+        state["updated_at"] = now
+        return state
+
+    def save(self, host, state):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO hosts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (host, state["rate"], state["tokens"], state["updated_at"], state["blocked_until"], state["latency"],
+             state["throttled"], state["decreased_at"])
+        )
+
+    def reserve(self, host, priority):
+        # Берёт токен и возвращает 0 или время до следующей попытки, с
+        if priority == BULK and self.waiting[(host, INTERACTIVE)]:
+            return 0.05
+        reserve = INTERACTIVE_RESERVE if priority == BULK else 0.0
+        now = time.time()
+        with self.transaction():
+            state = self.load(host, now)
+            if now < state["blocked_until"]:
+                wait = state["blocked_until"] - now
+            elif state["tokens"] >= 1.0 + reserve:
+                state["tokens"] -= 1.0
+                wait = 0.0
+            else:
+                wait = (1.0 + reserve - state["tokens"]) / state["rate"]
+            self.save(host, state)
+        return wait
+
+    @contextmanager
+    def waiter(self, host, priority):
+        with self.waiting_lock:
+            self.waiting[(host, priority)] += 1
+        try:
+            yield
+        finally:
+            with self.waiting_lock:
+                self.waiting[(host, priority)] -= 1
+
+    def acquire(self, url, priority=None):
+        priority = priority or self.priority
+        host = metrics.host_of(url)
+        start = time.perf_counter()
+        with self.waiter(host, priority):
+            while True:
+                wait = self.reserve(host, priority)
+                if not wait:
+                    break
+                time.sleep(min(wait, MAX_SLEEP) * random.uniform(1.0, 1.2))
+        metrics.observe(metrics.RATE_LIMIT_WAIT_SECONDS, time.perf_counter() - start, host=host, priority=priority)
+
+    async def acquire_async(self, url, priority=None):
+        # Транзакция SQLite может ждать другие процессы до timeout соединения,
+        # поэтому reserve выполняется в пуле потоков, а не в цикле событий
+        import asyncio
+        loop = asyncio.get_running_loop()
+        priority = priority or self.priority
+        host = metrics.host_of(url)
+        start = time.perf_counter()
+        with self.waiter(host, priority):
+            while True:
+                wait = await loop.run_in_executor(None, self.reserve, host, priority)
+                if not wait:
+                    break
+                await asyncio.sleep(min(wait, MAX_SLEEP) * random.uniform(1.0, 1.2))
+        metrics.observe(metrics.RATE_LIMIT_WAIT_SECONDS, time.perf_counter() - start, host=host, priority=priority)
+
+    def record(self, url, status, seconds=None, retry_after=None):
+        # Подстройка скорости хоста по ответу; ошибки соединения скорость не меняют
+        if not isinstance(status, int):
+            return
+        host = metrics.host_of(url)
+        maximum = host_rates(host)[1]
+        now = time.time()
+        with self.transaction():
+            state = self.load(host, now)
+            rate = state["rate"]
+            recently_decreased = now - state["decreased_at"] < DECREASE_INTERVAL
+            delay = retry_after_seconds(retry_after)
+            latency = state["latency"]
+            slow = seconds is not None and latency and seconds > LATENCY_FACTOR * latency
+            if status == 429 or (status in THROTTLE_STATUSES and delay is not None):
+                if not recently_decreased:
+                    state["rate"] = max(MIN_RATE, rate * DECREASE)
+                    state["decreased_at"] = now
+                state["throttled"] = 1
+                # Токены, накопленные до ограничения, больше не действуют
+                state["tokens"] = min(state["tokens"], 0.0)
+                if delay:
+                    state["blocked_until"] = max(state["blocked_until"], now + delay)
+            elif status == 503 or (status < 500 and slow):
+                if not recently_decreased:
+                    state["rate"] = max(MIN_RATE, rate * SOFT_DECREASE)
+                    state["decreased_at"] = now
+            elif status < 500:
+                state["rate"] = min(maximum, rate + (1.0 / rate if state["throttled"] else 1.0))
+            if status < 500 and seconds is not None:
+                state["latency"] = seconds if not latency else latency + LATENCY_ALPHA * (seconds - latency)
+            self.save(host, state)
+        if status in THROTTLE_STATUSES:
+            metrics.inc(metrics.HTTP_THROTTLED, host=host)
+            logging.warning(f"Хост {host} ограничивает запросы ({status}): скорость {rate:.2f} -> "
+                            f"{state['rate']:.2f} запросов/с" + (f", пауза {retry_after} с" if retry_after else ""))
+
+    async def record_async(self, url, status, seconds=None, retry_after=None):
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(None, self.record, url, status, seconds, retry_after)
+
+    def close(self):
+        self.connection.close()
+
+default_limiter = None
+default_limiter_lock = threading.Lock()
+
+def configure(path=None, priority=None):
+    # Как и http_cache.configure, настройка передаётся этапам в отдельных процессах через окружение
+    global default_limiter
+    if path:
+        os.environ['ENZYME_RATE_DB'] = str(path)
+    if priority:
+        os.environ['ENZYME_PRIORITY'] = priority
+    default_limiter = None
+
+def get_limiter():
+    # После fork (пул multiprocessing) процесс открывает собственное соединение с SQLite
+    global default_limiter
+    if default_limiter is None or default_limiter.pid != os.getpid():
+        with default_limiter_lock:
+            if default_limiter is None or default_limiter.pid != os.getpid():
+                default_limiter = RateLimiter(
+                    os.environ.get('ENZYME_RATE_DB', os.path.join(tempfile.gettempdir(), 'enzyme_ratelimit.sqlite')),
+                    priority=os.environ.get('ENZYME_PRIORITY', BULK),
+                )
+    return default_limiter
+
+class ScrapyRateLimitMiddleware:
+    # Downloader middleware паука: запросы к сети идут через общий планировщик.
+    # Стоит после HttpCacheMiddleware, поэтому ответы из кэша токенов не расходуют
+    async def process_request(self, request):
+        await get_limiter().acquire_async(request.url)
+        return None
+
+    async def process_response(self, request, response):
+        # process_response вызывается и для ответов из кэша, которые HttpCacheMiddleware вернул
+        # без запроса к сети: по ним скорость хоста не подстраивается
+        latency = request.meta.get('download_latency')
+        if 'cached' in response.flags or latency is None:
+            return response
+        retry_after = response.headers.get('Retry-After')
+        await get_limiter().record_async(request.url, response.status, latency,
+                                         retry_after.decode('latin-1') if retry_after else None)
+        return response
\ No newline at end of file
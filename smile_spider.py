@@ -1,124 +1,487 @@
-import pandas as pd
-from scrapy import Spider, Request
-from scrapy_playwright.page import PageMethod
-from parsel import Selector
-import asyncio
-import sys
-import redis
-import json
-
-# Устанавливаем правильный событийный цикл для Windows
-if sys.platform == 'win32':
-    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-
-# Подключение к Redis
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
-
-class RheaSpider(Spider):
-    name = "rhea_spider"
-
-    custom_settings = {
-        "PLAYWRIGHT_DEFAULT_NAVIGATION_TIMEOUT": 10000,
-        "CONCURRENT_REQUESTS": 32,
-    }
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # Получаем данные из Redis
-        uniseq_results_json = redis_client.get('uniseq_results')
-        if uniseq_results_json:
-            self.data = pd.DataFrame(json.loads(uniseq_results_json))
-        else:
-            self.data = pd.DataFrame()
-        self.data['Text_reaction'] = ""
-        self.data['SMILES_reaction'] = ""
-
-    def start_requests(self):
-        for index, row in self.data.iterrows():
-            entry = row['Entry']
-            search_url = f'https://www.rhea-db.org/rhea?query=uniprot%3A{entry}'
-            yield Request(
-                url=search_url,
-                callback=self.parse_search_results,
-                meta={
-                    "index": index,
-                    "row": row,
-                    "playwright": True,
-                    "playwright_page_methods": [PageMethod("wait_for_selector", 'a[href*="/rhea/"]')],
-                },
-                errback=self.errback
-            )
-
-    async def parse_search_results(self, response):
-        index = response.meta["index"]
-        row = response.meta["row"]
-        links = response.css('a[href*="/rhea/"]::attr(href)').getall()
-        reactions = []
-        smiles_reactions = []
-
-        for link in links:
-            reaction_url = response.urljoin(link)
-            request = Request(
-                url=reaction_url,
-                callback=self.parse_reaction_page,
-                meta={
-                    "index": index,
-                    "playwright": True,
-                    "playwright_page_methods": [PageMethod("wait_for_selector", "#equationtext")],
-                    "reactions": reactions,
-                    "smiles_reactions": smiles_reactions,
-                },
-                errback=self.errback
-            )
-            yield request
-
-    async def parse_reaction_page(self, response):
-        index = response.meta["index"]
-        reactions = response.meta["reactions"]
-        smiles_reactions = response.meta["smiles_reactions"]
-
-        selector = Selector(text=response.text)
-        text_reaction = selector.css('#equationtext::text').get()
-
-        if text_reaction:
-            reactions.append(text_reaction)
-            smiles_list = []
-            participant_elements = selector.css('.reaction-participants > ul > li.participant')
-            for element in participant_elements:
-                smiles = element.css("span.cell:contains('SMILES') + span.cell::text").get() or "$"
-                smiles_list.append(smiles)
-
-            reactants, _, products = text_reaction.partition('=')
-            reactants = reactants.strip().split(' + ')
-            products = products.strip().split(' + ')
-
-            if len(reactants) + len(products) == len(smiles_list):
-                smiles_reaction = '.'.join(smiles_list[:len(reactants)]) + '>>' + '.'.join(smiles_list[len(reactants):])
-                smiles_reactions.append(smiles_reaction)
-            else:
-                smiles_reactions.append(None)
-
-        # Save results after processing all links
-        self.data.at[index, 'Text_reaction'] = "; ".join(reactions)
-        self.data.at[index, 'SMILES_reaction'] = "; ".join([smiles for smiles in smiles_reactions if smiles])
-
-    def errback(self, failure):
-        self.logger.error(f"Error encountered: {failure}")
-        request = failure.request
-        index = request.meta.get("index")
-        if index is not None:
-            self.data.at[index, 'Text_reaction'] = None
-            self.data.at[index, 'SMILES_reaction'] = None
-
-    def closed(self, reason):
-        # Save data after the spider finishes
-        self.data.to_excel('C:/Users/vasae/parsing/Uniprot_seq/Final_data.xlsx', index=False)
-
-# Запуск паука
-if __name__ == '__main__':
-    from scrapy.crawler import CrawlerProcess
-    from scrapy.utils.project import get_project_settings
-
-    process = CrawlerProcess(get_project_settings())
-    process.crawl(RheaSpider)
-    process.start()
\ No newline at end of file
+from scrapy import Spider, Request, signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.spidermiddlewares.httperror import HttpError
+from parsel import Selector
+import asyncio
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import time
+from itertools import islice
+from urllib.parse import urlencode
+from http_cache import scrapy_cache_settings
+from journal import ERROR, FOUND, Journal
+import metrics
+from config import lazy_module
+from storage import REACTIONS, SEQUENCES, RunStore
+
+pd = lazy_module('pandas')
+
+# Адреса сервисов можно переопределить (например, локальным сервером benchmarks/replay_server.py)
+RHEA_URL = os.environ.get('ENZYME_RHEA_URL', "https://www.rhea-db.org")
+RHEA_SEARCH_URL = f"{RHEA_URL}/rhea/"
+RHEA_COLUMNS = "rhea-id,equation,chebi-id,smiles"
+UNIPROT_ACCESSIONS_URL = f"{os.environ.get('ENZYME_UNIPROT_URL', 'https://rest.uniprot.org')}/uniprotkb/accessions"
+RHEA_BATCH_SIZE = 100  # Количество accession в одном запросе пакетного режима
+RHEA_LINK_RE = re.compile(r'/rhea/(\d+)')
+
+def master_rhea_id(rhea_id):
+    # Идентификаторы Rhea выдаются блоками по 4: основная реакция и три направленные (LR, RL, BI).
+    # UniProt может ссылаться на направленную реакцию, а поиск Rhea возвращает основную
+    number = int(str(rhea_id).strip().upper().replace('RHEA:', ''))
+    return number - number % 4
+
+def uniprot_rhea_url(accessions):
+    # Соответствие accession -> реакции Rhea берём из UniProt одним запросом на пачку
+    return f"{UNIPROT_ACCESSIONS_URL}?{urlencode({'accessions': ','.join(accessions), 'fields': 'accession,rhea', 'format': 'tsv'})}"
+
+def rhea_query_url(accessions):
+    # Один табличный запрос Rhea на пачку accession: uniprot:A OR uniprot:B ...
+    query = ' OR '.join(f"uniprot:{accession}" for accession in accessions)
+    return f"{RHEA_SEARCH_URL}?{urlencode({'query': query, 'columns': RHEA_COLUMNS, 'format': 'tsv', 'limit': 10000})}"
+
+def parse_uniprot_rhea_tsv(text):
+    # {accession: [основные ID Rhea в порядке UniProt]}
+    mapping = {}
+    for line in text.splitlines()[1:]:
+        if not line:
+            continue
+        accession, _, rhea_ids = line.partition('\t')
+        ids = []
+        for rhea_id in rhea_ids.split():
+            master_id = master_rhea_id(rhea_id)
+            if master_id not in ids:
+                ids.append(master_id)
+        mapping[accession] = ids
+    return mapping
+
+def parse_rhea_tsv(text):
+    # {основной ID Rhea: (уравнение, реакция SMILES или None)}
+    lines = text.splitlines()
+    if not lines:
+        return {}
+    header = [column.lower() for column in lines[0].split('\t')]
+    equation_column = next((i for i, column in enumerate(header) if 'equation' in column), 1)
+    smiles_column = next((i for i, column in enumerate(header) if 'smiles' in column), None)
+
+    reactions = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        values = line.split('\t')
+        smiles = values[smiles_column] if smiles_column is not None and smiles_column < len(values) else None
+        reactions[master_rhea_id(values[0])] = (values[equation_column], smiles or None)
+    return reactions
+
+def rhea_id_from_link(link):
+    match = RHEA_LINK_RE.search(link)
+    return master_rhea_id(match.group(1)) if match else None
+
+def reaction_columns(rhea_ids, reactions):
+    # Значения Text_reaction и SMILES_reaction в том же формате, что и у parse_reaction_page
+    found = [reactions[rhea_id] for rhea_id in rhea_ids if reactions.get(rhea_id)]
+    return "; ".join(equation for equation, _ in found), "; ".join(smiles for _, smiles in found if smiles)
+
+DEFAULT_OUTPUT_FILE = 'Final_data.csv'
+
+class ResultSink:
+    # Готовые строки дописываются в CSV пачками. После каждой пачки файл сбрасывается на диск
+    # и обновляется контрольная точка, поэтому при остановке паука теряется не больше одной пачки.
+    # Если итоговый файл .xlsx, он строится из CSV при закрытии. При возобновлении (append)
+    # строки дописываются к существующему CSV, а в журнал запуска попадают только сохранённые строки
+    def __init__(self, output_file, store=None, journal=None, append=False, batch_size=500, checkpoint_interval=60):
+        self.output_file = str(output_file)
+        root, extension = os.path.splitext(self.output_file)
+        self.csv_file = self.output_file if extension.lower() == '.csv' else f"{root}.csv"
+        self.checkpoint_file = f"{self.csv_file}.checkpoint.json"
+        self.store = store
+        self.journal = journal
+        self.append = append
+        self.batch_size = batch_size
+        self.checkpoint_interval = checkpoint_interval
+        self.file = None
+        self.writer = None
+        self.buffer = []
+        self.written = 0
+        self.last_flush = time.monotonic()
+
+    def add(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.checkpoint_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        if self.writer is None:
+            self.open()
+        self.writer.writerows(self.buffer)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        metrics.items_out(REACTIONS, len(self.buffer))
+        if self.store is not None:
+            self.store.write(REACTIONS, self.buffer)
+        if self.journal is not None:
+            for record in self.buffer:
+                self.journal.record(record['Entry'], ERROR if record['Text_reaction'] is None else FOUND)
+            self.journal.flush()
+        self.written += len(self.buffer)
+        self.buffer = []
+        self.write_checkpoint()
+
+    def open(self):
+        fieldnames = list(self.buffer[0])
+        if self.append and os.path.exists(self.csv_file) and os.path.getsize(self.csv_file):
+            # Порядок столбцов берём из заголовка существующего файла
+            with open(self.csv_file, newline='', encoding='utf-8') as existing:
+                fieldnames = next(csv.reader(existing))
+            self.file = open(self.csv_file, 'a', newline='', encoding='utf-8')
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames, extrasaction='ignore')
+            return
+        self.file = open(self.csv_file, 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write_checkpoint(self):
+        checkpoint_tmp = f"{self.checkpoint_file}.tmp"
+        with open(checkpoint_tmp, 'w') as f:
+            json.dump({"output": self.csv_file, "rows": self.written, "time": time.time()}, f)
+        os.replace(checkpoint_tmp, self.checkpoint_file)
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.journal is not None:
+            self.journal.close()
+        if self.csv_file != self.output_file and self.output_file.lower().endswith('.xlsx') and self.written:
+            pd.read_csv(self.csv_file).to_excel(self.output_file, index=False)
+
+class RheaSpider(Spider):
+    name = "rhea_spider"
+
+    custom_settings = {
+        "PLAYWRIGHT_DEFAULT_NAVIGATION_TIMEOUT": 10000,
+        "CONCURRENT_REQUESTS": 32,
+        # Общий планировщик запросов по хостам (ratelimit.py), после HttpCacheMiddleware (900)
+        "DOWNLOADER_MIDDLEWARES": {"ratelimit.ScrapyRateLimitMiddleware": 950},
+    }
+
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        # Общий HTTP кэш (http_cache.py), если он включён через ENZYME_CACHE_DIR
+        settings.setdict(scrapy_cache_settings(), priority='spider')
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(spider.response_received, signal=signals.response_received)
+        return spider
+
+    def response_received(self, response, request, spider):
+        # download_latency включает время страницы в браузере для запросов через Playwright
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            metrics.observe_http(response.url, latency, response.status)
+            if request.meta.get('playwright'):
+                metrics.observe(metrics.BROWSER_PAGE_SECONDS, latency, host=metrics.host_of(response.url))
+        if request.meta.get('retry_times'):
+            metrics.inc(metrics.HTTP_RETRIES, request.meta['retry_times'], host=metrics.host_of(request.url))
+
+    def __init__(self, *args, data=None, run_id=None, output_file=None, follow=False, batched=False,
+                 batch_size=RHEA_BATCH_SIZE, resume=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        # batched: табличные запросы к UniProt и Rhea на пачку записей без браузера (-a batched=1)
+        self.batched = str(batched).lower() in ('1', 'true', 'yes')
+        self.batch_size = int(batch_size)
+        self.output_file = output_file or DEFAULT_OUTPUT_FILE
+        self.store = RunStore(run_id) if run_id else None
+        # follow: читать поток SEQUENCES по мере записи, пока ent_seq_v2 не завершится (-a follow=1)
+        self.follow = str(follow).lower() in ('1', 'true', 'yes') and self.store is not None
+        self.last_id = '0-0'
+        if self.follow:
+            self.records = iter(())
+        elif data is not None:
+            # Данные переданы напрямую (встроенный режим orchestrator)
+            self.records = iter(data)
+        elif self.store is not None:
+            # Читаем записи из Redis порциями по мере того, как Scrapy забирает начальные запросы
+            self.records = self.store.iter_records(SEQUENCES)
+        else:
+            self.logger.error("No input data: pass run_id (-a run_id=...) to read sequences from Redis")
+            self.records = iter(())
+        # В памяти хранятся только записи, для которых ещё ждём ответ; в запросах передаётся лишь ключ записи
+        self.pending = {}
+        self.next_key = 0
+        # resume: пропустить записи, уже обработанные по журналу запуска, и дописать результаты к CSV (-a resume=1)
+        resume = str(resume).lower() in ('1', 'true', 'yes')
+        journal = Journal(run_id, REACTIONS) if run_id else None
+        self.done_entries = journal.done() if resume and journal is not None else set()
+        self.sink = ResultSink(self.output_file, store=self.store, journal=journal, append=resume)
+        # Память реакций на весь запуск: ID Rhea -> (уравнение, SMILES) или None, если уравнение не получено.
+        # Популярные реакции загружаются один раз, строки, ожидающие загружаемую реакцию, ждут её в in_flight
+        self.reactions = {}
+        self.in_flight = {}
+        self.failed_reactions = set()
+        self.waiting_rows = {}
+        self.reaction_refs = 0
+
+    async def start(self):
+        # Scrapy >= 2.13 получает начальные запросы из start(), более ранние версии — из start_requests()
+        for request in self.start_requests():
+            yield request
+
+    def start_requests(self):
+        if self.follow:
+            yield from self.poll_sequences()
+        else:
+            yield from self.search_requests(self.records)
+
+    def poll_sequences(self):
+        # Возвращает запросы для записей, появившихся в потоке с прошлого чтения
+        records, self.last_id = self.store.read_new(SEQUENCES, self.last_id)
+        return list(self.search_requests(records))
+
+    def spider_idle(self):
+        # Пока паук простаивает, готовые строки не должны ждать заполнения пачки
+        self.sink.flush()
+        if not self.follow:
+            return
+        # Отметку о завершении проверяем до чтения, чтобы не потерять записи, добавленные между ними
+        upstream_done = self.store.is_done(SEQUENCES)
+        requests = self.poll_sequences()
+        for request in requests:
+            self.crawler.engine.crawl(request)
+        if requests or not upstream_done:
+            raise DontCloseSpider
+
+    def keyed_records(self, records):
+        for record in records:
+            if record['Entry'] in self.done_entries:
+                continue
+            metrics.inc(metrics.STAGE_ITEMS_IN, stage=REACTIONS)
+            key = self.next_key
+            self.next_key += 1
+            self.pending[key] = record
+            yield key, record
+
+    def search_requests(self, records):
+        keyed = self.keyed_records(records)
+        if self.batched:
+            yield from self.batch_requests(keyed)
+            return
+        from scrapy_playwright.page import PageMethod
+        for key, record in keyed:
+            entry = record['Entry']
+            search_url = f'{RHEA_URL}/rhea?query=uniprot%3A{entry}'
+            yield Request(
+                url=search_url,
+                callback=self.parse_search_results,
+                meta={
+                    "key": key,
+                    "playwright": True,
+                    "playwright_page_methods": [PageMethod("wait_for_selector", 'a[href*="/rhea/"]')],
+                },
+                errback=self.errback
+            )
+
+    def batch_requests(self, keyed):
+        while True:
+            batch = list(islice(keyed, self.batch_size))
+            if not batch:
+                return
+            yield Request(
+                url=uniprot_rhea_url([record['Entry'] for _, record in batch]),
+                callback=self.parse_rhea_mapping,
+                meta={"keys": [key for key, _ in batch]},
+                errback=self.errback
+            )
+
+    def parse_rhea_mapping(self, response):
+        mapping = parse_uniprot_rhea_tsv(response.text)
+        keys = []
+        for key in response.meta["keys"]:
+            ids = mapping.get(self.pending[key]['Entry'])
+            if not ids:
+                self.complete(key, "", "")
+                continue
+            self.waiting_rows[key] = [ids, 0]
+            if all(rhea_id in self.reactions for rhea_id in ids):
+                # Все реакции записи уже получены с прошлыми пачками, повторно их не запрашиваем
+                self.reaction_refs += len(ids)
+                self.fill_row(key)
+            else:
+                keys.append(key)
+        if not keys:
+            return
+        yield Request(
+            url=rhea_query_url([self.pending[key]['Entry'] for key in keys]),
+            callback=self.parse_rhea_table,
+            meta={"keys": keys},
+            errback=self.errback
+        )
+
+    def parse_rhea_table(self, response):
+        self.reactions.update(parse_rhea_tsv(response.text))
+        for key in response.meta["keys"]:
+            self.reaction_refs += len(self.waiting_rows[key][0])
+            self.fill_row(key)
+
+    async def parse_search_results(self, response):
+        key = response.meta["key"]
+        links = response.css('a[href*="/rhea/"]::attr(href)').getall()
+        rhea_links = {}
+        for link in links:
+            rhea_id = rhea_id_from_link(link)
+            if rhea_id is not None and rhea_id not in rhea_links:
+                rhea_links[rhea_id] = response.urljoin(link)
+        if not rhea_links:
+            self.complete(key, "", "")
+            return
+
+        from scrapy_playwright.page import PageMethod
+        self.reaction_refs += len(rhea_links)
+        pending = 0
+        requests = []
+        for rhea_id, reaction_url in rhea_links.items():
+            if rhea_id in self.reactions:
+                continue
+            pending += 1
+            if rhea_id in self.in_flight:
+                self.in_flight[rhea_id].append(key)
+                continue
+            self.in_flight[rhea_id] = [key]
+            requests.append(Request(
+                url=reaction_url,
+                callback=self.parse_reaction_page,
+                meta={
+                    "rhea_id": rhea_id,
+                    "playwright": True,
+                    "playwright_page_methods": [PageMethod("wait_for_selector", "#equationtext")],
+                },
+                errback=self.errback
+            ))
+
+        # Строка регистрируется до первого yield: пока генератор приостановлен, Scrapy может
+        # завершить уже загружаемую реакцию, которую ждёт и эта строка (finish_reaction)
+        self.waiting_rows[key] = [list(rhea_links), pending]
+        if not pending:
+            self.fill_row(key)
+        for request in requests:
+            yield request
+
+    def finish_reaction(self, rhea_id, reaction):
+        self.reactions[rhea_id] = reaction
+        for key in self.in_flight.pop(rhea_id, []):
+            state = self.waiting_rows[key]
+            state[1] -= 1
+            if not state[1]:
+                self.fill_row(key)
+
+    def fill_row(self, key):
+        rhea_ids, _ = self.waiting_rows.pop(key)
+        text_reaction, smiles_reaction = reaction_columns(rhea_ids, self.reactions)
+        if not text_reaction and any(rhea_id in self.failed_reactions for rhea_id in rhea_ids):
+            text_reaction = smiles_reaction = None
+        self.complete(key, text_reaction, smiles_reaction)
+
+    def complete(self, key, text_reaction, smiles_reaction):
+        record = {column: None if not isinstance(value, str) and pd.isna(value) else value
+                  for column, value in self.pending.pop(key).items()}
+        record['Text_reaction'] = text_reaction
+        record['SMILES_reaction'] = smiles_reaction
+        self.sink.add(record)
+
+    async def parse_reaction_page(self, response):
+        rhea_id = response.meta["rhea_id"]
+        reaction = None
+
+        selector = Selector(text=response.text)
+        text_reaction = selector.css('#equationtext::text').get()
+
+        if text_reaction:
+            smiles_list = []
+            participant_elements = selector.css('.reaction-participants > ul > li.participant')
+            for element in participant_elements:
+                smiles = element.css("span.cell:contains('SMILES') + span.cell::text").get() or "$"
+                smiles_list.append(smiles)
+
+            reactants, _, products = text_reaction.partition('=')
+            reactants = reactants.strip().split(' + ')
+            products = products.strip().split(' + ')
+
+            if len(reactants) + len(products) == len(smiles_list):
+                smiles_reaction = '.'.join(smiles_list[:len(reactants)]) + '>>' + '.'.join(smiles_list[len(reactants):])
+            else:
+                smiles_reaction = None
+            reaction = (text_reaction, smiles_reaction)
+
+        self.finish_reaction(rhea_id, reaction)
+
+    def errback(self, failure):
+        self.logger.error(f"Error encountered: {failure}")
+        request = failure.request
+        if not failure.check(HttpError):
+            # Ответы с HTTP ошибкой уже учтены в response_received
+            metrics.inc(metrics.HTTP_REQUESTS, host=metrics.host_of(request.url), status='error')
+            if request.meta.get('retry_times'):
+                metrics.inc(metrics.HTTP_RETRIES, request.meta['retry_times'], host=metrics.host_of(request.url))
+        rhea_id = request.meta.get("rhea_id")
+        if rhea_id is not None:
+            # Ошибка одной реакции не сбрасывает остальные реакции ожидающих её строк
+            self.failed_reactions.add(rhea_id)
+            self.finish_reaction(rhea_id, None)
+            return
+        keys = request.meta.get("keys", [request.meta.get("key")])
+        for key in keys:
+            if key in self.pending:
+                self.waiting_rows.pop(key, None)
+                self.complete(key, None, None)
+
+    def closed(self, reason):
+        unique = sum(1 for reaction in self.reactions.values() if reaction)
+        self.logger.info(f"Реакции Rhea: {unique} уникальных, {self.reaction_refs} ссылок из записей UniProt")
+        self.crawler.stats.set_value('rhea/reactions_unique', unique)
+        self.crawler.stats.set_value('rhea/reactions_referenced', self.reaction_refs)
+        if self.pending:
+            self.logger.warning(f"{len(self.pending)} записей не обработаны до остановки паука ({reason})")
+        self.sink.close()
+        if self.store is not None and reason == 'finished':
+            self.store.mark_done(REACTIONS)
+
+def run_spider(data=None, run_id=None, output_file=None, follow=False, batched=False, resume=False):
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    # Устанавливаем правильный событийный цикл для Windows
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    # В составе оркестратора журнал уже настроен (setup_logging): второй обработчик Scrapy
+    # дублировал бы каждую строку, поэтому свой обработчик паук ставит только при отдельном запуске
+    process = CrawlerProcess(get_project_settings(), install_root_handler=not logging.getLogger().handlers)
+    process.crawl(RheaSpider, data=data, run_id=run_id, output_file=output_file, follow=follow,
+                  batched=batched, resume=resume)
+    with metrics.stage(REACTIONS):
+        process.start()
+
+# Запуск паука
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Получение реакций и SMILES из Rhea для записей UniProt")
+    parser.add_argument('--run-id', type=str, required=True, help="Идентификатор запуска для ключей Redis")
+    parser.add_argument('--output', type=str, help="Путь к итоговому CSV или Excel (.xlsx) файлу")
+    parser.add_argument('--follow', action='store_true', help="Читать последовательности по мере их записи предыдущим этапом")
+    parser.add_argument('--batched', action='store_true', help="Пакетные табличные запросы к UniProt и Rhea без браузера")
+    parser.add_argument('--resume', action='store_true', help="Пропустить записи, уже обработанные в этом запуске (по журналу)")
+    args = parser.parse_args()
+    run_spider(run_id=args.run_id, output_file=args.output, follow=args.follow, batched=args.batched,
+               resume=args.resume)
+    metrics.publish(RunStore(args.run_id), REACTIONS)
\ No newline at end of file
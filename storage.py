@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import time
+import uuid
+
+import metrics
+from config import get_config
+
+# Хранилище результатов этапов в Redis. Все ключи запуска начинаются с enzyme:<run_id>:,
+# каждая запись — отдельный элемент Redis Stream, поэтому несколько запусков могут работать
+# с одним Redis одновременно, а этапы читают результаты предыдущего этапа порциями
+
+# Контракт этапов: имена потоков, в которые пишет каждый этап и из которых читает следующий
+NAMES_EC = 'names_ec'                   # names_ec -> ec_entries: {"EC Number", "Protein"}
+NAMES_NOT_FOUND = 'names_ec_not_found'  # {"Protein"}
+EC_ENTRIES = 'ec_entries'               # ec_entries -> ent_seq_v2: {"EC number", "Accepted Name", ...}
+EC_NOT_FOUND = 'ec_entries_not_found'   # {"EC number"}
+SEQUENCES = 'ent_seq'                   # ent_seq_v2 -> smile_spider: записи UniProt
+REACTIONS = 'rhea'                      # smile_spider: записи UniProt с реакциями
+
+KEY_PREFIX = 'enzyme'
+DEFAULT_TTL = 7 * 24 * 60 * 60
+NAME_HIT_TTL = 30 * 24 * 60 * 60
+NAME_MISS_TTL = 24 * 60 * 60
+MEMO_BATCH = 1000
+
+def get_redis():
+    # Клиент Redis создаётся при первом обращении, а не при импорте модуля
+    return get_config().redis()
+
+def new_run_id():
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+def next_stream_id(entry_id):
+    # Следующий возможный ID после entry_id, чтобы XRANGE продолжал чтение без повторов
+    milliseconds, sequence = entry_id.decode().split('-')
+    return f"{milliseconds}-{int(sequence) + 1}"
+
+class RunStore:
+    def __init__(self, run_id, client=None, ttl=DEFAULT_TTL):
+        self.run_id = run_id
+        self.client = client or get_redis()
+        self.ttl = ttl
+
+    def key(self, stream):
+        return f"{KEY_PREFIX}:{self.run_id}:{stream}"
+
+    def write(self, stream, records, batch_size=500):
+        # Записи отправляются пачками через pipeline: один сетевой обмен на batch_size записей
+        key = self.key(stream)
+        written = 0
+        pipe = self.client.pipeline(transaction=False)
+        for record in records:
+            data = json.dumps(record)
+            metrics.observe_payload(stream, 'write', len(data))
+            pipe.xadd(key, {'data': data})
+            written += 1
+            if written % batch_size == 0:
+                pipe.execute()
+        if self.ttl:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+        logging.debug(f"В поток {key} записано {written} записей")
+        return written
+
+    def iter_records(self, stream, batch_size=500):
+        key = self.key(stream)
+        start = '-'
+        while True:
+            entries = self.client.xrange(key, min=start, max='+', count=batch_size)
+            for _, fields in entries:
+                metrics.observe_payload(stream, 'read', len(fields[b'data']))
+                yield json.loads(fields[b'data'])
+            if len(entries) < batch_size:
+                return
+            start = next_stream_id(entries[-1][0])
+
+    def read(self, stream):
+        return list(self.iter_records(stream))
+
+    def read_new(self, stream, last_id='0-0', count=500):
+        # Неблокирующее чтение записей, появившихся после last_id (потоковый режим).
+        # Возвращает записи и ID, с которого продолжать чтение
+        entries = self.client.xread({self.key(stream): last_id}, count=count)
+        if not entries:
+            return [], last_id
+        _, stream_entries = entries[0]
+        records = []
+        for _, fields in stream_entries:
+            metrics.observe_payload(stream, 'read', len(fields[b'data']))
+            records.append(json.loads(fields[b'data']))
+        entry_id = stream_entries[-1][0]
+        return records, entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+
+    def count(self, stream):
+        return self.client.xlen(self.key(stream))
+
+    def mark_done(self, stage):
+        self.client.hset(self.key('stages'), stage, time.time())
+        if self.ttl:
+            self.client.expire(self.key('stages'), self.ttl)
+
+    def is_done(self, stage):
+        return self.client.hexists(self.key('stages'), stage)
+
+    def clear_done(self, stage):
+        self.client.hdel(self.key('stages'), stage)
+
+    def save_metrics(self, name, snapshot):
+        self.client.hset(self.key('metrics'), name, json.dumps(snapshot))
+        if self.ttl:
+            self.client.expire(self.key('metrics'), self.ttl)
+
+    def load_metrics(self):
+        return {name.decode(): json.loads(snapshot)
+                for name, snapshot in self.client.hgetall(self.key('metrics')).items()}
+
+    def delete(self, stream):
+        self.client.delete(self.key(stream))
+
+class NameMemo:
+    # Память поиска по названию между запусками: enzyme:memo:names:<нормализованное название> ->
+    # строки результатов поиска [[EC номер, [названия]], ...]. Пустой список — фермент не найден,
+    # такие записи хранятся меньше (NAME_MISS_TTL), чтобы новые записи ExPASy находились.
+    # prefetch загружает записи для всей партии названий за одно обращение к Redis
+    def __init__(self, client=None, hit_ttl=None, miss_ttl=None):
+        self.client = client or get_redis()
+        self.hit_ttl = hit_ttl or int(os.environ.get('ENZYME_MEMO_HIT_TTL', NAME_HIT_TTL))
+        self.miss_ttl = miss_ttl or int(os.environ.get('ENZYME_MEMO_MISS_TTL', NAME_MISS_TTL))
+        self.local = {}
+
+    @staticmethod
+    def key(name_key):
+        return f"{KEY_PREFIX}:memo:names:{name_key}"
+
+    def prefetch(self, name_keys):
+        # Ключи запрашиваются пачками MGET в одном pipeline
+        name_keys = [name_key for name_key in dict.fromkeys(name_keys) if name_key not in self.local]
+        if not name_keys:
+            return 0
+        batches = [name_keys[start:start + MEMO_BATCH] for start in range(0, len(name_keys), MEMO_BATCH)]
+        pipe = self.client.pipeline(transaction=False)
+        for batch in batches:
+            pipe.mget([self.key(name_key) for name_key in batch])
+        for batch, values in zip(batches, pipe.execute()):
+            for name_key, value in zip(batch, values):
+                self.local[name_key] = json.loads(value) if value is not None else None
+        found = sum(1 for name_key in name_keys if self.local[name_key] is not None)
+        logging.info(f"Память поиска по названиям: известно {found} из {len(name_keys)} названий")
+        return found
+
+    def get(self, name_key):
+        # None — названия нет в памяти; после prefetch обращения к Redis не нужны
+        if name_key not in self.local:
+            value = self.client.get(self.key(name_key))
+            self.local[name_key] = json.loads(value) if value is not None else None
+        rows = self.local[name_key]
+        metrics.inc(metrics.CACHE_REQUESTS, source='name_memo', result='miss' if rows is None else 'hit')
+        return rows
+
+    def put(self, name_key, rows):
+        rows = [[ec_number, list(descriptions)] for ec_number, descriptions in rows]
+        self.client.set(self.key(name_key), json.dumps(rows), ex=self.hit_ttl if rows else self.miss_ttl)
+        self.local[name_key] = rows
+
+def name_memo():
+    # ENZYME_NAME_MEMO=0 (orchestrator --no-memo) отключает память: все названия ищутся заново
+    if os.environ.get('ENZYME_NAME_MEMO', '1') == '0':
+        return None
+    return NameMemo()
\ No newline at end of file
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+# Модули проекта лежат в корне репозитория, бенчмарки — в benchmarks/
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+import uuid
+
+import pytest
+
+@pytest.fixture
+def redis_run():
+    # Тесты распределённого режима идут на Redis из ENZYME_REDIS_URL (как у рабочих) и пропускаются,
+    # если он недоступен. Каждый тест получает свой run_id; его ключи удаляются после теста
+    redis = pytest.importorskip('redis')
+    from config import get_config
+    from storage import KEY_PREFIX
+    client = get_config().redis()
+    try:
+        client.ping()
+    except redis.RedisError as e:
+        pytest.skip(f"Redis недоступен: {e}")
+    run_id = f"test-{uuid.uuid4().hex[:8]}"
+    yield run_id
+    keys = list(client.scan_iter(f"{KEY_PREFIX}:{run_id}:*"))
+    if keys:
+        client.delete(*keys)
\ No newline at end of file
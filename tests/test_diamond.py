@@ -0,0 +1,146 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+import ent_seq_v2
+
+# Поддельный DIAMOND: makedb копирует FASTA в базу, blastp пишет по строке m8 на каждую запись запроса.
+# Каждый вызов дописывается в журнал, FAKE_DIAMOND_FAIL=1 имитирует ошибку
+FAKE_DIAMOND = """#!{python}
+import os, sys
+args = sys.argv[1:]
+options = dict(zip(args[1::2], args[2::2]))
+with open({log!r}, 'a') as log:
+    log.write(args[0] + '\\n')
+if os.environ.get('FAKE_DIAMOND_FAIL'):
+    sys.stderr.write('fake failure')
+    sys.exit(1)
+if args[0] == 'makedb':
+    with open(options['--in']) as src, open(options['--db'], 'w') as db:
+        db.write(src.read())
+elif args[0] == 'blastp':
+    with open(options['--query']) as query, open(options['--out'], 'w') as out:
+        for line in query:
+            if line.startswith('>'):
+                out.write(line[1:].split()[0] + '\\tHIT\\t100.0\\n')
+"""
+
+@pytest.fixture
+def diamond(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    log = tmp_path / 'diamond.log'
+    script = bin_dir / 'diamond'
+    script.write_text(FAKE_DIAMOND.format(python=sys.executable, log=str(log)))
+    script.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+    monkeypatch.delenv('FAKE_DIAMOND_FAIL', raising=False)
+    return lambda: log.read_text().split() if log.exists() else []
+
+def write_fasta(path, ids):
+    path.write_text(''.join(f">{seq_id} protein\nMKV{seq_id}\n" for seq_id in ids))
+    return path
+
+def test_cached_database_is_rebuilt_only_when_content_changes(diamond, tmp_path):
+    fasta = write_fasta(tmp_path / 'db.fasta', ['P1', 'P2'])
+    cache_dir = tmp_path / 'cache'
+
+    first = ent_seq_v2.cached_diamond_database(str(fasta), str(cache_dir))
+    os.utime(fasta, (0, 0))
+    assert ent_seq_v2.cached_diamond_database(str(fasta), str(cache_dir)) == first
+    assert diamond() == ['makedb']
+
+    write_fasta(fasta, ['P1', 'P3'])
+    second = ent_seq_v2.cached_diamond_database(str(fasta), str(cache_dir))
+    assert second != first
+    assert diamond() == ['makedb', 'makedb']
+    assert sorted(os.listdir(cache_dir)) == sorted([os.path.basename(first), os.path.basename(second)])
+
+def test_failed_build_leaves_no_database(diamond, tmp_path, monkeypatch):
+    fasta = write_fasta(tmp_path / 'db.fasta', ['P1'])
+    monkeypatch.setenv('FAKE_DIAMOND_FAIL', '1')
+    with pytest.raises(RuntimeError, match='fake failure'):
+        ent_seq_v2.cached_diamond_database(str(fasta), str(tmp_path / 'cache'))
+    assert os.listdir(tmp_path / 'cache') == []
+
+def test_sharded_search_merges_shard_outputs_in_order(diamond, tmp_path, monkeypatch):
+    monkeypatch.setattr(ent_seq_v2, 'DIAMOND_MIN_SHARD_BYTES', 1)
+    ids = [f"Q{k:03d}" for k in range(30)]
+    query = write_fasta(tmp_path / 'query.fasta', ids)
+    output = tmp_path / 'hits.m8'
+
+    ent_seq_v2.run_diamond_sharded(str(query), 'db.dmnd', str(output), threads=3, mode='fast', shards=3)
+
+    assert diamond() == ['blastp'] * 3
+    assert [line.split('\t')[0] for line in output.read_text().splitlines()] == ids
+    # Временный каталог с частями удаляется после склейки
+    assert sorted(os.listdir(tmp_path)) == ['bin', 'diamond.log', 'hits.m8', 'query.fasta']
+
+@pytest.mark.parametrize('shards', [1, 3])
+def test_failed_search_raises(diamond, tmp_path, monkeypatch, shards):
+    monkeypatch.setattr(ent_seq_v2, 'DIAMOND_MIN_SHARD_BYTES', 1)
+    monkeypatch.setenv('FAKE_DIAMOND_FAIL', '1')
+    query = write_fasta(tmp_path / 'query.fasta', [f"Q{k}" for k in range(9)])
+    with pytest.raises(RuntimeError, match='fake failure'):
+        ent_seq_v2.run_diamond_sharded(str(query), 'db.dmnd', str(tmp_path / 'hits.m8'),
+                                       threads=3, mode='fast', shards=shards)
+def m8_line(query, subject, evalue, bitscore):
+    return f"{query}\t{subject}\t90.0\t100\t10\t0\t1\t100\t1\t100\t{evalue}\t{bitscore}\n"
+
+# Q1: у двух попаданий равный bitscore, лучшим считается меньший evalue; попадания Q2 разнесены по пачкам
+M8 = (m8_line('Q1', 'sp|P1|A_HUMAN', 1e-5, 50) + m8_line('Q1', 'P2 protein', 1e-9, 50)
+      + m8_line('Q1', 'P3', 1e-3, 20) + m8_line('Q2', 'P4', 1e-2, 10) + m8_line('Q2', 'P5', 1e-20, 90)
+      + m8_line('Q2', 'P1', 1e-4, 40) + m8_line('Q3', 'P6', 1e-1, 5))
+
+def hits_of(tops):
+    return [(row.qseqid, row.sseqid, row.rank) for top in tops for row in top.itertuples()]
+
+def test_top_hits_per_query(tmp_path):
+    m8 = tmp_path / 'hits.m8'
+    m8.write_text(M8)
+    assert hits_of(ent_seq_v2.iter_top_hits(str(m8), top_k=2)) == [
+        ('Q1', 'P2 protein', 1), ('Q1', 'sp|P1|A_HUMAN', 2), ('Q2', 'P5', 1), ('Q2', 'P1', 2), ('Q3', 'P6', 1)]
+
+@pytest.mark.parametrize('top_k', [1, 2])
+def test_query_split_across_chunks(tmp_path, top_k):
+    m8 = tmp_path / 'hits.m8'
+    m8.write_text(M8)
+    whole = hits_of(ent_seq_v2.iter_top_hits(str(m8), top_k=top_k))
+    assert hits_of(ent_seq_v2.iter_top_hits(str(m8), top_k=top_k, chunksize=1)) == whole
+    assert hits_of(ent_seq_v2.iter_top_hits(str(m8), top_k=top_k, chunksize=2)) == whole
+
+def test_ingest_joins_annotations(tmp_path):
+    m8 = tmp_path / 'hits.m8'
+    m8.write_text(M8)
+    annotations_file = tmp_path / 'annotations.csv'
+    annotations_file.write_text('Entry,Organism,EC number,Sequence\nP1,Human,1.1.1.1,MK\nP1,Human,1.1.1.1,MK\n'
+                                'P5,Yeast,,MV\n')
+    annotations = ent_seq_v2.load_annotations(str(annotations_file))
+    assert annotations['Entry'].tolist() == ['P1', 'P5']
+    assert 'Sequence' not in annotations.columns
+
+    output = tmp_path / 'top.tsv'
+    assert ent_seq_v2.ingest_m8(str(m8), str(output), annotations=annotations, chunksize=2) == 3
+    top = pd.read_csv(output, sep='\t', dtype='string')
+    assert top['subject_accession'].tolist() == ['P2', 'P5', 'P6']
+    assert top['Organism'].tolist() == [pd.NA, 'Yeast', pd.NA]
+
+class StoreStub:
+    def iter_records(self, stage):
+        return iter([{"Entry": 'P5', "Organism": 'Yeast', "Sequence": 'MV'}])
+
+def test_annotations_from_store():
+    annotations = ent_seq_v2.load_annotations(store=StoreStub())
+    assert annotations.iloc[0]['Organism'] == 'Yeast'
+    assert ent_seq_v2.load_annotations() is None
+
+def test_empty_m8_writes_header_only(tmp_path):
+    # Без попаданий DIAMOND оставляет пустой файл
+    m8 = tmp_path / 'hits.m8'
+    m8.write_text('')
+    assert list(ent_seq_v2.iter_top_hits(str(m8))) == []
+    output = tmp_path / 'top.tsv'
+    assert ent_seq_v2.ingest_m8(str(m8), str(output)) == 0
+    assert output.read_text().splitlines() == ['\t'.join(ent_seq_v2.M8_COLUMNS + ['rank', 'subject_accession'])]
\ No newline at end of file
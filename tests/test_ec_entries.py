@@ -0,0 +1,47 @@
+import ec_entries
+from benchmarks.ec_parser_bench import legacy_parse
+from benchmarks.replay_server import ec_page, ec_transfer_target, ec_number, seed
+
+# Разметка страницы ExPASy: секции таблицы начинаются строкой с <th>, названий может быть несколько.
+# Текстовые узлы строки склеиваются через пробел, как и в прежнем разборе
+EXPASY_PAGE = b"""<!DOCTYPE html><html><body><main><div>
+<table class="type-1">
+<tr><th>EC</th><th>1.1.1.1</th></tr>
+<tr><th colspan="2">Accepted Name</th></tr>
+<tr><td colspan="2">alcohol dehydrogenase</td></tr>
+<tr><th colspan="2">Alternative Name(s)</th></tr>
+<tr><td colspan="2">aldehyde reductase</td></tr>
+<tr><td colspan="2">aldehyde <i>reductase</i> (NADPH)</td></tr>
+<tr><th colspan="2">Cross-references</th></tr>
+<tr><td>PROSITE</td><td><a href="https://prosite.expasy.org/PDOC00058">PDOC00058</a></td></tr>
+<tr><td>UniProtKB/Swiss-Prot</td><td>
+<a href="https://www.uniprot.org/uniprot/P07327">P07327, ADH1A_HUMAN</a>;
+<a href="https://www.uniprot.org/uniprot/P28469">P28469, ADH1A_MACMU</a>;
+</td></tr>
+</table>
+</div></main></body></html>"""
+
+TRANSFERRED_PAGE = b"""<!DOCTYPE html><html><body><main><div>
+<h3>Transferred entry: <a href="/EC/1.1.1.2">1.1.1.2</a></h3>
+</div></main></body></html>"""
+
+def synthetic_pages(count=200):
+    pages = [ec_page(ec_number(seed('test', k))).encode() for k in range(count)]
+    # Синтетический сервер отдаёт страницу переноса для части номеров
+    assert any(ec_transfer_target(ec_number(seed('test', k))) for k in range(count))
+    return pages
+
+def test_parse_ec_page_matches_legacy_parser():
+    for number, content in enumerate([EXPASY_PAGE, TRANSFERRED_PAGE] + synthetic_pages()):
+        assert ec_entries.parse_ec_page(content) == legacy_parse(content), f"страница {number}: {content[:200]!r}"
+
+def test_parse_enzyme_page():
+    record, transferred_to = ec_entries.parse_enzyme_page(EXPASY_PAGE, '1.1.1.1')
+    assert transferred_to is None
+    assert record == {
+        "EC number": '1.1.1.1',
+        "Accepted Name": 'alcohol dehydrogenase',
+        "Alternative Name(s)": 'aldehyde reductase\naldehyde  reductase  (NADPH)',
+        "Entries": 'P07327\nP28469',
+    }
+    assert ec_entries.parse_enzyme_page(TRANSFERRED_PAGE, '1.1.1.3') == (None, '1.1.1.2')
\ No newline at end of file
@@ -0,0 +1,53 @@
+import sqlite3
+
+import enzyme_index
+
+ENZYME_DAT = """CC   ENZYME nomenclature database
+CC   Release of 05-Mar-2025
+//
+ID   1.1.1.1
+DE   alcohol dehydrogenase.
+AN   aldehyde reductase.
+DR   P07327, ADH1A_HUMAN;  P28469, ADH1A_MACMU;
+//
+ID   1.1.1.2
+DE   alcohol dehydrogenase (NADP(+)).
+//
+ID   1.1.1.5
+DE   Transferred entry: 1.1.1.303 and 1.1.1.304.
+//
+""".splitlines(keepends=True)
+
+def build(path):
+    index = enzyme_index.EnzymeIndex(path, readonly=False)
+    index.refresh(ENZYME_DAT)
+    index.close()
+    return enzyme_index.open_index(path)
+
+def test_search_names_matches_substrings(tmp_path):
+    index = build(tmp_path / 'enzyme.sqlite')
+    assert index.release() == '05-Mar-2025'
+    assert index.search_names('HYDROGENASE') == [
+        ('1.1.1.1', ['alcohol dehydrogenase']),
+        ('1.1.1.2', ['alcohol dehydrogenase (NADP(+))']),
+    ]
+    assert index.search_names('reductase') == [('1.1.1.1', ['aldehyde reductase'])]
+    assert index.search_names('transferred') == []
+    assert index.lookup_ec('1.1.1.5') == ('1.1.1.303', 'missing')
+
+def test_version_1_index_is_upgraded_on_refresh(tmp_path):
+    path = tmp_path / 'enzyme.sqlite'
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE name_tokens (token TEXT, ec TEXT);
+        INSERT INTO meta VALUES ('schema', '1');
+    """)
+    connection.commit()
+    connection.close()
+    assert enzyme_index.open_index(path) is None
+
+    index = build(path)
+    tables = {name for name, in index.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'name_tokens' not in tables
+    assert index.search_names('aldehyde') == [('1.1.1.1', ['aldehyde reductase'])]
\ No newline at end of file
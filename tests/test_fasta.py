@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import ent_seq_v2
+
+RECORDS = [
+    (['P1'], 'β-galactosidase', 'MKV' * 40),
+    (['P2'], 'α/β hydrolase fold protein', 'ACDEFGHIKLMNPQRSTVWY' * 7),
+    (['P3', 'P4'], 'plain name', 'M'),
+    (['P5'], 'duplicate of β-galactosidase', 'MKV' * 40),
+]
+
+@pytest.mark.parametrize('suffix', ['.fasta', '.fasta.gz', '.fasta.zst'])
+@pytest.mark.parametrize('block_size', [1, ent_seq_v2.FASTA_BLOCK_SIZE])
+def test_indexed_read_with_non_ascii_headers(tmp_path, suffix, block_size):
+    if suffix == '.fasta.zst':
+        pytest.importorskip('zstandard')
+    fasta = str(tmp_path / f"out{suffix}")
+    with ent_seq_v2.FastaWriter(fasta, block_size=block_size) as writer:
+        for accessions, description, sequence in RECORDS:
+            writer.add(accessions, description, sequence)
+
+    for accessions, _, sequence in RECORDS:
+        for accession in accessions:
+            assert ent_seq_v2.read_fasta_sequence(fasta, accession) == sequence
+    assert ent_seq_v2.read_fasta_sequence(fasta, 'missing') is None
+
+def test_index_is_reloaded_after_append(tmp_path):
+    fasta = str(tmp_path / 'out.fasta')
+    with ent_seq_v2.FastaWriter(fasta) as writer:
+        writer.add(['P1'], 'β-galactosidase', 'MKV')
+    assert ent_seq_v2.read_fasta_sequence(fasta, 'P2') is None
+
+    with ent_seq_v2.FastaWriter(fasta, append=True) as writer:
+        writer.add(['P2'], 'γ-glutamyltransferase', 'MAA')
+    assert ent_seq_v2.read_fasta_sequence(fasta, 'P2') == 'MAA'
+    assert ent_seq_v2.read_fasta_sequence(fasta, 'P1') == 'MKV'
+@pytest.mark.parametrize('suffix', ['.fasta', '.fasta.gz'])
+def test_resumed_writer_deduplicates_against_existing_file(tmp_path, suffix):
+    fasta = str(tmp_path / f"out{suffix}")
+    with ent_seq_v2.FastaWriter(fasta, block_size=1) as writer:
+        for accessions, description, sequence in RECORDS[:3]:
+            writer.add(accessions, description, sequence)
+    size = os.path.getsize(fasta)
+
+    # Последовательность P5 уже записана для P1: при возобновлении в индекс добавляется только ссылка на неё
+    with ent_seq_v2.FastaWriter(fasta, append=True) as writer:
+        writer.add(['P5'], 'duplicate of β-galactosidase', 'MKV' * 40)
+    assert os.path.getsize(fasta) == size
+    index = ent_seq_v2.load_fasta_index(fasta)
+    assert index['P5'][1:] == index['P1'][1:]
+    assert ent_seq_v2.read_fasta_sequence(fasta, 'P5') == 'MKV' * 40
\ No newline at end of file
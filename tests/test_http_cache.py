@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+import ent_seq_v2
+import http_cache
+
+URL = 'https://enzyme.expasy.org/EC/1.1.1.1'
+
+def test_hit_and_miss(tmp_path):
+    cache = http_cache.HttpCache(tmp_path)
+    assert cache.get(URL, 'expasy_ec') is None
+    cache.put(URL, 'expasy_ec', 200, b'page')
+    cached = cache.get(URL, 'expasy_ec')
+    assert (cached.status, cached.body, cached.negative) == (200, b'page', False)
+    # Другой источник — другой ключ; ошибки сервера не кэшируются
+    assert cache.get(URL, 'rhea') is None
+    cache.put(URL, 'rhea', 503, b'busy')
+    assert cache.get(URL, 'rhea') is None
+    assert cache.stats() == {'expasy_ec': {'hits': 1, 'misses': 1}, 'rhea': {'hits': 0, 'misses': 2}}
+
+def test_negative_entries_expire_sooner(tmp_path, monkeypatch):
+    cache = http_cache.HttpCache(tmp_path)
+    now = 1_000_000.0
+    monkeypatch.setattr(http_cache.time, 'time', lambda: now)
+    cache.put(URL, 'expasy_ec', 404, b'')
+    cache.put(f"{URL}.2", 'expasy_ec', 200, b'page')
+    assert cache.get(URL, 'expasy_ec').negative
+
+    now += http_cache.NEGATIVE_TTL + 1
+    assert cache.get(URL, 'expasy_ec') is None
+    assert cache.get(f"{URL}.2", 'expasy_ec').body == b'page'
+
+    now += http_cache.SOURCE_TTLS['expasy_ec']
+    assert cache.get(f"{URL}.2", 'expasy_ec') is None
+
+def test_offline_miss_raises_and_stale_entries_are_served(tmp_path, monkeypatch):
+    http_cache.HttpCache(tmp_path).put(URL, 'expasy_ec', 200, b'page')
+    cache = http_cache.HttpCache(tmp_path, offline=True)
+    monkeypatch.setattr(http_cache.time, 'time', lambda: 10 ** 12)
+    assert cache.get(URL, 'expasy_ec').body == b'page'
+    with pytest.raises(http_cache.CacheMiss):
+        cache.get(f"{URL}.2", 'expasy_ec')
+
+    async def get_async():
+        return await cache.get_async(f"{URL}.2", 'expasy_ec')
+    with pytest.raises(http_cache.CacheMiss):
+        asyncio.run(get_async())
+
+# Поддельный UniProt: S1 — вторичный accession записи P9, остальные accession без записей отсутствуют
+UNIPROT = {'P1': 'P1', 'P2': 'P2', 'S1': 'P9'}
+HEADER = 'Entry\tSequence'
+
+def fake_uniprot(requests):
+    def request_uniprot_rows(accessions, fields, session=None, timeout=60):
+        requests.append(list(accessions))
+        entries = dict.fromkeys(UNIPROT[accession] for accession in accessions if accession in UNIPROT)
+        return HEADER, [f"{entry}\tM{entry}" for entry in entries]
+    return request_uniprot_rows
+
+def uniprot_lines(text):
+    return sorted(text.splitlines()[1:])
+
+def test_uniprot_rows_are_cached_per_requested_accession(tmp_path, monkeypatch):
+    requests = []
+    monkeypatch.setattr(ent_seq_v2, 'request_uniprot_rows', fake_uniprot(requests))
+    cache = http_cache.HttpCache(tmp_path)
+    ids = ['P1', 'P2', 'S1'] + [f"X{k}" for k in range(13)]
+
+    text = ent_seq_v2.cached_uniprot_request(cache, ids, ['Entry', 'Sequence'], '&fields=x')
+    assert uniprot_lines(text) == ['P1\tMP1', 'P2\tMP2', 'P9\tMP9']
+    # Соответствие S1 -> P9 найдено делением несовпавших accession пополам, а не запросом на каждый
+    assert ['S1'] in requests
+    assert len(requests) < len(ids) // 2
+
+    # Повторный запрос (в том числе вторичного и отсутствующих accession) отвечается из кэша
+    requests.clear()
+    assert uniprot_lines(ent_seq_v2.cached_uniprot_request(cache, ['S1', 'X3', 'P1'], ['Entry', 'Sequence'],
+                                                            '&fields=x')) == ['P1\tMP1', 'P9\tMP9']
+    assert requests == []
+
+    offline = http_cache.HttpCache(tmp_path, offline=True)
+    with pytest.raises(http_cache.CacheMiss):
+        ent_seq_v2.cached_uniprot_request(offline, ['P1', 'P3'], ['Entry', 'Sequence'], '&fields=x')
\ No newline at end of file
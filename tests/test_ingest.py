@@ -0,0 +1,101 @@
+import csv
+import io
+import os
+import sys
+
+import pytest
+
+import ingest
+from journal import ERROR, FOUND, NOT_FOUND, Journal
+from storage import NAMES_EC
+
+VALUES = ['Alcohol  dehydrogenase', '', 'catalase', 'ALCOHOL DEHYDROGENASE', None, ' Catalase ', 'ﬁcolin']
+
+@pytest.mark.parametrize('value, expected', [
+    ('  Alcohol\tdehydrogenase ', ('alcohol dehydrogenase', 'Alcohol dehydrogenase')),
+    # NFKC раскрывает лигатуры и полноширинные символы
+    ('ﬁcolin', ('ficolin', 'ficolin')),
+    ('ＡＢＣ', ('abc', 'ABC')),
+    (42, ('42', '42')),
+    ('   ', None),
+    (None, None),
+    (float('nan'), None),
+])
+def test_normalize_name(value, expected):
+    assert ingest.normalize_name(value) == expected
+
+def check_names(names):
+    assert names.pending() == ['Alcohol dehydrogenase', 'catalase', 'ficolin']
+    assert names.rows == {'alcohol dehydrogenase': [1, 4], 'catalase': [3, 6], 'ficolin': [7]}
+    assert names.blank_rows == [2, 5]
+    assert names.inputs == {1: 'Alcohol  dehydrogenase', 4: 'ALCOHOL DEHYDROGENASE', 6: ' Catalase ', 7: 'ﬁcolin'}
+
+def test_read_names_from_csv(tmp_path):
+    path = tmp_path / 'names.csv'
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Id', 'Protein'])
+        writer.writerows([k, value or ''] for k, value in enumerate(VALUES))
+    check_names(ingest.read_names(path))
+    with pytest.raises(ValueError):
+        ingest.read_names(path, column='Name')
+
+def test_read_names_from_xlsx(tmp_path):
+    from openpyxl import Workbook
+    workbook = Workbook()
+    workbook.active.append(['Protein', 'Id'])
+    for k, value in enumerate(VALUES):
+        workbook.active.append([value, k])
+    path = tmp_path / 'names.xlsx'
+    workbook.save(path)
+    check_names(ingest.read_names(path))
+
+def test_read_names_from_stdin(monkeypatch):
+    # Заголовок в первой строке необязателен
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('Protein\n' + '\n'.join(value or '' for value in VALUES) + '\n'))
+    check_names(ingest.read_names('-'))
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('catalase\r\ncatalase\n'))
+    names = ingest.read_names('-')
+    assert (names.pending(), names.rows) == (['catalase'], {'catalase': [1, 2]})
+
+def journal(run_id, outcomes):
+    Journal(run_id, NAMES_EC).record_all(outcomes)
+    # Порядок журналов определяется временем изменения файла
+    path = Journal(run_id, NAMES_EC).path
+    os.utime(path, (len(run_id), len(run_id)))
+
+def test_skip_resolved_uses_latest_journals(tmp_path, monkeypatch):
+    monkeypatch.setenv('ENZYME_JOURNAL_DIR', str(tmp_path))
+    journal('old', {'Catalase': NOT_FOUND, 'ficolin': FOUND})
+    journal('newer', {'catalase': FOUND, 'alcohol dehydrogenase': ERROR})
+    journal('current', {'ficolin': FOUND})
+    journal('current.1', {'alcohol dehydrogenase': FOUND})
+    names = ingest.InputNames()
+    for row, value in enumerate(VALUES, start=1):
+        names.add(row, value)
+
+    ingest.skip_resolved(names, exclude_run_ids=['current'])
+    # Названия с ошибкой не считаются обработанными, журналы текущего запуска не учитываются
+    assert names.skipped == {'catalase': (FOUND, 'newer'), 'ficolin': (FOUND, 'old')}
+    assert names.pending() == ['Alcohol dehydrogenase']
+
+def test_write_input_map(tmp_path):
+    names = ingest.InputNames()
+    for row, value in enumerate(VALUES, start=1):
+        names.add(row, value)
+    names.skipped = {'catalase': (NOT_FOUND, 'old')}
+    path = tmp_path / 'out.input.csv'
+    ingest.write_input_map(path, names, {'Alcohol dehydrogenase': (FOUND, 'run')})
+
+    assert ingest.input_map_path('results/out.xlsx') == 'results/out.input.csv'
+    with open(path, newline='', encoding='utf-8') as f:
+        assert list(csv.reader(f)) == [
+            ingest.INPUT_MAP_COLUMNS,
+            ['1', 'Alcohol  dehydrogenase', 'Alcohol dehydrogenase', FOUND, 'run'],
+            ['2', '', '', ingest.BLANK, ''],
+            ['3', 'catalase', 'catalase', NOT_FOUND, 'old'],
+            ['4', 'ALCOHOL DEHYDROGENASE', 'Alcohol dehydrogenase', FOUND, 'run'],
+            ['5', '', '', ingest.BLANK, ''],
+            ['6', ' Catalase ', 'catalase', NOT_FOUND, 'old'],
+            ['7', 'ﬁcolin', 'ficolin', '', ''],
+        ]
\ No newline at end of file
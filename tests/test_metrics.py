@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+import metrics
+import worker
+from storage import EC_ENTRIES, SEQUENCES, RunStore
+from workqueue import WorkQueue
+
+@pytest.fixture
+def registry(monkeypatch):
+    # Метрики процесса копятся в metrics.registry: тест получает пустой реестр
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    return registry
+
+def process_snapshot(seconds, items_in, latencies):
+    registry = metrics.Registry()
+    registry.inc(metrics.STAGE_SECONDS, seconds, stage='names_ec')
+    registry.inc(metrics.STAGE_ITEMS_IN, items_in, stage='names_ec')
+    registry.inc(metrics.HTTP_REQUESTS, len(latencies), host='enzyme.expasy.org', status='200')
+    for latency in latencies:
+        registry.observe(metrics.HTTP_SECONDS, latency, host='enzyme.expasy.org')
+    return registry.snapshot()
+
+def test_merge_and_summary():
+    merged = metrics.Registry()
+    merged.merge(process_snapshot(2.0, 10, [0.02, 0.2]))
+    merged.merge(process_snapshot(3.0, 15, [0.02, 0.02]))
+    summary = metrics.summary(merged)
+    assert summary["stages"] == {'names_ec': {'seconds': 5.0, 'items_in': 25, 'items_per_second': 5.0}}
+    host = summary["hosts"]['enzyme.expasy.org']
+    assert (host['requests'], host['mean_ms'], host['p95_ms_le']) == (4, 65.0, 250)
+
+def test_prometheus_text():
+    merged = metrics.Registry()
+    merged.merge(process_snapshot(2.0, 10, [0.02, 0.2]))
+    lines = metrics.prometheus_text(merged).splitlines()
+    assert '# TYPE enzyme_stage_seconds_total counter' in lines
+    assert 'enzyme_stage_items_in_total{stage="names_ec"} 10' in lines
+    assert '# TYPE enzyme_http_request_seconds histogram' in lines
+    assert 'enzyme_http_request_seconds_bucket{host="enzyme.expasy.org",le="0.025"} 1' in lines
+    assert 'enzyme_http_request_seconds_bucket{host="enzyme.expasy.org",le="+Inf"} 2' in lines
+    assert 'enzyme_http_request_seconds_count{host="enzyme.expasy.org"} 2' in lines
+
+def test_published_snapshots_are_merged_per_run(redis_run, registry, tmp_path):
+    store = RunStore(redis_run)
+    registry.inc(metrics.STAGE_ITEMS_OUT, 3, stage='names_ec')
+    metrics.publish(store, 'names_ec')
+    # Снимок другого процесса того же запуска
+    store.save_metrics('ec_entries:1', process_snapshot(1.0, 4, [0.1]))
+    report = metrics.write_run_report(redis_run, [store], tmp_path)
+    assert report["stages"]['names_ec'] == {'seconds': 1.0, 'items_in': 4, 'items_out': 3, 'items_per_second': 4.0}
+    assert (tmp_path / f"{redis_run}.prom").read_text().startswith('# TYPE')
+
+def test_worker_records_stage_seconds(redis_run, registry):
+    store = RunStore(redis_run)
+    store.mark_done(EC_ENTRIES)
+    queue = WorkQueue(redis_run, SEQUENCES)
+    queue.put(['P1', 'P2'])
+
+    async def handler(messages):
+        await asyncio.sleep(0.05)
+        queue.finish(messages)
+        store.mark_done(SEQUENCES)
+
+    stub = worker.Worker.__new__(worker.Worker)
+    stub.store, stub.stages, stub.consumer = store, [SEQUENCES], 'test'
+    stub.queues, stub.handlers = {SEQUENCES: queue}, {SEQUENCES: handler}
+    asyncio.run(stub.loop())
+
+    stages = metrics.summary(registry)["stages"]
+    assert stages[SEQUENCES]['items_in'] == 2
+    assert stages[SEQUENCES]['seconds'] >= 0.05
\ No newline at end of file
@@ -0,0 +1,66 @@
+import asyncio
+import sys
+
+import pytest
+from lxml import html
+
+import names_ec
+from journal import Journal
+from storage import NAMES_EC
+
+RESULTS_PAGE = b"""<html><body><main><div><table class="type-1">
+<tr><td><a href="/EC/1.1.1.1">1.1.1.1</a></td><td>alcohol dehydrogenase</td></tr>
+</table></div></main></body></html>"""
+
+NOT_FOUND_PAGE = f"""<html><body><main><div><p>{names_ec.NOT_FOUND_TEXT} 'unknownase'</p>
+</div></main></body></html>""".encode()
+
+class Memo:
+    def __init__(self):
+        self.rows = {}
+
+    def get(self, name_key):
+        return self.rows.get(name_key)
+
+    def put(self, name_key, rows):
+        self.rows[name_key] = rows
+
+def lookup(monkeypatch, browser_rows):
+    async def fetch_ec_rows_browser(pool, ferment_name):
+        return browser_rows
+    monkeypatch.setattr(names_ec, 'fetch_ec_rows_browser', fetch_ec_rows_browser)
+    monkeypatch.delenv('ENZYME_CACHE_DIR', raising=False)
+    memo = Memo()
+    result = asyncio.run(names_ec.fetch_ec_numbers_by_name(None, 'alcohol dehydrogenase', set(), memo=memo))
+    return result, memo.rows
+
+def test_browser_failure_is_not_memoized(monkeypatch):
+    assert lookup(monkeypatch, None) == (None, {})
+
+def test_browser_not_found_is_memoized(monkeypatch):
+    assert lookup(monkeypatch, []) == ([], {'alcohol dehydrogenase': []})
+
+def test_browser_rows_are_memoized(monkeypatch):
+    rows = [('1.1.1.1', ['alcohol dehydrogenase'])]
+    result, remembered = lookup(monkeypatch, rows)
+    assert [record["EC Number"] for record in result] == ['1.1.1.1']
+    assert remembered == {'alcohol dehydrogenase': rows}
+
+@pytest.mark.parametrize('content, matches', [(RESULTS_PAGE, 1), (NOT_FOUND_PAGE, 1), (b"<html><body/></html>", 0)])
+def test_browser_results_xpath_matches_results_or_not_found(content, matches):
+    assert len(html.fromstring(content).xpath(names_ec.RESULTS_XPATH)) == matches
+
+@pytest.mark.parametrize('content, expected', [(NOT_FOUND_PAGE, []), (b"<html><body>busy</body></html>", None)])
+def test_parse_byname_page_distinguishes_not_found(content, expected):
+    assert names_ec.parse_byname_page(content) == expected
+@pytest.mark.parametrize('ferment, expected', [('alcohol dehydrogenase', 'found'), ('unknownase', 'not_found'),
+                                               ('failase', 'error')])
+def test_standalone_run_journals_each_name(redis_run, monkeypatch, tmp_path, ferment, expected):
+    async def fetch_ec_numbers_by_name(pool, ferment_name, existing_ec_numbers, session=None, index=None, memo=None):
+        return {'alcohol dehydrogenase': [{"EC Number": '1.1.1.1'}], 'unknownase': []}.get(ferment_name)
+    monkeypatch.setattr(names_ec, 'fetch_ec_numbers_by_name', fetch_ec_numbers_by_name)
+    monkeypatch.setenv('ENZYME_JOURNAL_DIR', str(tmp_path))
+    monkeypatch.setattr(sys, 'argv', ['names_ec.py', ferment, '--run-id', redis_run, '--no-memo'])
+    asyncio.run(names_ec.main())
+    # Журнал читают оркестратор в режиме --subprocess и --skip-resolved
+    assert Journal(redis_run, NAMES_EC).load() == {ferment: expected}
\ No newline at end of file
@@ -0,0 +1,78 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+import ec_entries
+import ent_seq_v2
+import pipeline
+from journal import ERROR, FOUND, NOT_FOUND, Journal
+from storage import EC_ENTRIES, EC_NOT_FOUND, SEQUENCES, RunStore
+
+@pytest.fixture(autouse=True)
+def journal_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('ENZYME_JOURNAL_DIR', str(tmp_path / 'journal'))
+
+def queue_of(items):
+    queue = asyncio.Queue()
+    for item in items + [None]:
+        queue.put_nowait(item)
+    return queue
+
+def fake_uniprot(requests):
+    # P* есть в UniProt, X* нет; пачка с E* завершается ошибкой
+    def fetch_uniprot_chunk(ids, columns=None, session=None, dtype=None):
+        requests.append(list(ids))
+        if any(accession.startswith('E') for accession in ids):
+            return None
+        rows = [{"Entry": accession, "Protein names": f"protein {accession}", "Sequence": f"MK{accession}"}
+                for accession in ids if accession.startswith('P')]
+        return pd.DataFrame(rows, columns=ent_seq_v2.PROTEIN_COLUMNS)
+    return fetch_uniprot_chunk
+
+def run_sequences(store, accessions, fasta, resume=False):
+    asyncio.run(pipeline.stream_sequences(store, queue_of(accessions), pipeline.FirstResults(), fasta_file=fasta,
+                                          batch_size=2, flush_interval=0.05, resume=resume))
+
+def test_stream_sequences_batches_and_resumes(redis_run, monkeypatch, tmp_path):
+    requests = []
+    monkeypatch.setattr(ent_seq_v2, 'fetch_uniprot_chunk', fake_uniprot(requests))
+    store = RunStore(redis_run)
+    fasta = str(tmp_path / 'out.fasta')
+
+    run_sequences(store, ['P1', 'X1', 'P1', 'X2', 'X3', 'E1'], fasta)
+    assert requests == [['P1', 'X1'], ['X2', 'X3'], ['E1']]
+    assert [record['Entry'] for record in store.read(SEQUENCES)] == ['P1']
+    assert Journal(redis_run, SEQUENCES).load() == {'P1': FOUND, 'X1': NOT_FOUND, 'X2': NOT_FOUND,
+                                                    'X3': NOT_FOUND, 'E1': ERROR}
+    assert store.is_done(SEQUENCES)
+
+    # При возобновлении запрашиваются только новые и ошибочные accession, FASTA дописывается
+    requests.clear()
+    run_sequences(store, ['E1', 'P1', 'X1', 'X4', 'P2'], fasta, resume=True)
+    assert requests == [['E1', 'X4'], ['P2']]
+    assert ent_seq_v2.read_fasta_sequence(fasta, 'P1') == 'MKP1'
+    assert ent_seq_v2.read_fasta_sequence(fasta, 'P2') == 'MKP2'
+
+def test_stream_ec_entries_forwards_accessions_once(redis_run, monkeypatch):
+    record = {"EC number": '1.1.1.1', "Accepted Name": 'alcohol dehydrogenase', "Entries": 'P1\nP2'}
+
+    async def resolve_with_index(fetcher, ec_number, index=None):
+        if ec_number == '6.6.6.6':
+            raise RuntimeError('parse error')
+        if ec_number == '9.9.9.9':
+            return None, "not_found"
+        # 1.1.1.5 перенесён в 1.1.1.1
+        return dict(record), "found"
+    monkeypatch.setattr(ec_entries, 'resolve_with_index', resolve_with_index)
+    store = RunStore(redis_run)
+    accession_queue = asyncio.Queue()
+
+    asyncio.run(pipeline.stream_ec_entries(store, queue_of(['1.1.1.1', '1.1.1.5', '9.9.9.9', '6.6.6.6']),
+                                           accession_queue, pipeline.FirstResults()))
+    assert store.read(EC_ENTRIES) == [record]
+    assert sorted(entry["EC number"] for entry in store.read(EC_NOT_FOUND)) == ['6.6.6.6', '9.9.9.9']
+    forwarded = [accession_queue.get_nowait() for _ in range(accession_queue.qsize())]
+    assert forwarded == ['P1', 'P2', None]
+    assert Journal(redis_run, EC_ENTRIES).load() == {'1.1.1.1': FOUND, '1.1.1.5': FOUND, '9.9.9.9': NOT_FOUND,
+                                                     '6.6.6.6': ERROR}
\ No newline at end of file
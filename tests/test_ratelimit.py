@@ -0,0 +1,50 @@
+import asyncio
+import sqlite3
+import threading
+
+import ratelimit
+
+def test_acquire_async_does_not_block_event_loop(tmp_path):
+    limiter = ratelimit.RateLimiter(tmp_path / 'ratelimit.sqlite')
+    # Другой процесс держит блокировку записи базы планировщика
+    blocker = sqlite3.connect(tmp_path / 'ratelimit.sqlite', isolation_level=None, check_same_thread=False)
+    blocker.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.3, blocker.commit).start()
+
+    async def main():
+        ticks = 0
+        acquire = asyncio.ensure_future(limiter.acquire_async('https://rest.uniprot.org/uniprotkb/P1'))
+        while not acquire.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        await acquire
+        return ticks
+
+    try:
+        assert asyncio.run(main()) >= 10
+    finally:
+        blocker.close()
+        limiter.close()
+
+def test_scrapy_middleware_records_only_downloaded_responses(tmp_path, monkeypatch):
+    from scrapy.http import Request, Response
+    limiter = ratelimit.RateLimiter(tmp_path / 'ratelimit.sqlite')
+    recorded = []
+    monkeypatch.setattr(limiter, 'record', lambda url, status, *args: recorded.append((url, status)))
+    monkeypatch.setattr(ratelimit, 'get_limiter', lambda: limiter)
+    middleware = ratelimit.ScrapyRateLimitMiddleware()
+    url = 'https://www.rhea-db.org/rhea/10000'
+
+    async def respond(meta, flags):
+        request = Request(url, meta=meta)
+        response = Response(url, status=429, flags=flags, request=request)
+        return await middleware.process_response(request, response)
+
+    try:
+        asyncio.run(respond({'download_latency': 0.1}, ['cached']))
+        asyncio.run(respond({}, []))
+        assert recorded == []
+        asyncio.run(respond({'download_latency': 0.1}, []))
+        assert recorded == [(url, 429)]
+    finally:
+        limiter.close()
\ No newline at end of file
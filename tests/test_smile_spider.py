@@ -0,0 +1,131 @@
+import asyncio
+import csv
+import json
+
+import pandas as pd
+from scrapy.http import HtmlResponse, Request, TextResponse
+
+import smile_spider
+
+RHEA_TSV = """Reaction identifier\tEquation\tChEBI identifier\tReaction participants SMILES
+RHEA:10001\tA + B = C\tCHEBI:1\tA.B>>C
+RHEA:20000\tD = E\tCHEBI:2\t
+"""
+
+def test_parse_uniprot_rhea_tsv_maps_directional_ids_to_master():
+    text = "Entry\tRhea ID\nP1\tRHEA:10001 RHEA:10002 RHEA:20000\nP2\t\n"
+    assert smile_spider.parse_uniprot_rhea_tsv(text) == {'P1': [10000, 20000], 'P2': []}
+
+def test_parse_rhea_tsv_and_reaction_columns():
+    reactions = smile_spider.parse_rhea_tsv(RHEA_TSV)
+    assert reactions == {10000: ('A + B = C', 'A.B>>C'), 20000: ('D = E', None)}
+    assert smile_spider.parse_rhea_tsv('') == {}
+    # Неизвестные реакции пропускаются, SMILES перечисляются только для реакций, где они есть
+    assert smile_spider.reaction_columns([20000, 30000, 10000], reactions) == ('D = E; A + B = C', 'A.B>>C')
+    assert smile_spider.reaction_columns([], reactions) == ('', '')
+
+def spider(tmp_path, records, **kwargs):
+    return smile_spider.RheaSpider(data=records, output_file=str(tmp_path / 'out.csv'), **kwargs)
+
+def collect(generator):
+    async def run():
+        return [request async for request in generator]
+    return asyncio.run(run())
+
+def search_page(key, rhea_ids):
+    links = ''.join(f'<a href="/rhea/{rhea_id}">RHEA:{rhea_id}</a>' for rhea_id in rhea_ids)
+    url = 'https://www.rhea-db.org/rhea?query=x'
+    return HtmlResponse(url, body=f"<html><body>{links}</body></html>".encode(),
+                        request=Request(url, meta={"key": key}))
+
+def reaction_page(rhea_id, equation):
+    url = f'https://www.rhea-db.org/rhea/{rhea_id}'
+    body = f'<html><body><div id="equationtext">{equation}</div></body></html>'.encode()
+    return HtmlResponse(url, body=body, request=Request(url, meta={"rhea_id": rhea_id}))
+
+def test_rows_share_reactions_in_flight(tmp_path):
+    rhea = spider(tmp_path, [{"Entry": 'P1'}, {"Entry": 'P2'}, {"Entry": 'P3'}])
+    (first, _), (second, _), (third, _) = rhea.keyed_records(rhea.records)
+
+    requests = collect(rhea.parse_search_results(search_page(first, [10000, 20000])))
+    assert sorted(request.meta["rhea_id"] for request in requests) == [10000, 20000]
+    # Реакция 10000 уже загружается: вторая строка ждёт её без нового запроса
+    assert collect(rhea.parse_search_results(search_page(second, [10001]))) == []
+    assert rhea.in_flight[10000] == [first, second]
+
+    asyncio.run(rhea.parse_reaction_page(reaction_page(10000, 'A = B')))
+    assert [record['Entry'] for record in rhea.sink.buffer] == ['P2']
+    asyncio.run(rhea.parse_reaction_page(reaction_page(20000, 'C = D')))
+    assert [(record['Entry'], record['Text_reaction']) for record in rhea.sink.buffer] == [
+        ('P2', 'A = B'), ('P1', 'A = B; C = D')]
+
+    # Уже полученная реакция заполняет строку сразу
+    assert collect(rhea.parse_search_results(search_page(third, [20000]))) == []
+    assert rhea.sink.buffer[-1]['Text_reaction'] == 'C = D'
+    assert rhea.pending == {} and rhea.waiting_rows == {}
+
+def test_batched_mapping_skips_known_reactions(tmp_path):
+    rhea = spider(tmp_path, [{"Entry": 'P1'}, {"Entry": 'P2'}, {"Entry": 'P3'}], batched=True, batch_size=2)
+    first, second = rhea.start_requests()
+    mapping = "Entry\tRhea ID\nP1\tRHEA:10001\nP2\t\n"
+    url = first.url
+    table_requests = list(rhea.parse_rhea_mapping(TextResponse(url, body=mapping.encode(), request=first)))
+    assert len(table_requests) == 1 and table_requests[0].meta["keys"] == [0]
+    rhea.parse_rhea_table(TextResponse(table_requests[0].url, body=RHEA_TSV.encode(), request=table_requests[0]))
+
+    # Реакции P3 получены с первой пачкой: табличный запрос Rhea не нужен
+    mapping = "Entry\tRhea ID\nP3\tRHEA:20000\n"
+    assert list(rhea.parse_rhea_mapping(TextResponse(second.url, body=mapping.encode(), request=second))) == []
+    assert [(record['Entry'], record['Text_reaction'], record['SMILES_reaction']) for record in rhea.sink.buffer] == [
+        ('P2', '', ''), ('P1', 'A + B = C', 'A.B>>C'), ('P3', 'D = E', '')]
+
+class JournalStub:
+    def __init__(self):
+        self.records = []
+
+    def record(self, item, status):
+        self.records.append((item, status))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+def row(entry, text_reaction='A = B'):
+    return {"Entry": entry, "Sequence": 'MK', "Text_reaction": text_reaction, "SMILES_reaction": ''}
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.reader(f))
+
+def test_result_sink_writes_batches_with_checkpoint(tmp_path):
+    journal = JournalStub()
+    sink = smile_spider.ResultSink(tmp_path / 'out.csv', journal=journal, batch_size=2)
+    sink.add(row('P1'))
+    assert not (tmp_path / 'out.csv').exists()
+    sink.add(row('P2', None))
+    assert len(read_csv(tmp_path / 'out.csv')) == 3
+    assert json.loads((tmp_path / 'out.csv.checkpoint.json').read_text())["rows"] == 2
+    # В журнал попадают только сохранённые в файл строки
+    assert journal.records == [('P1', 'found'), ('P2', 'error')]
+    sink.add(row('P3'))
+    sink.close()
+    assert json.loads((tmp_path / 'out.csv.checkpoint.json').read_text())["rows"] == 3
+
+def test_result_sink_appends_on_resume_in_existing_column_order(tmp_path):
+    path = tmp_path / 'out.csv'
+    path.write_text('Entry,Text_reaction,SMILES_reaction,Sequence\r\nP1,A = B,,MK\r\n', encoding='utf-8')
+    sink = smile_spider.ResultSink(path, append=True)
+    sink.add(row('P2'))
+    sink.close()
+    assert read_csv(path) == [['Entry', 'Text_reaction', 'SMILES_reaction', 'Sequence'],
+                              ['P1', 'A = B', '', 'MK'], ['P2', 'A = B', '', 'MK']]
+
+def test_result_sink_converts_to_xlsx_on_close(tmp_path):
+    sink = smile_spider.ResultSink(tmp_path / 'out.xlsx', batch_size=1)
+    sink.add(row('P1'))
+    sink.add(row('P2'))
+    sink.close()
+    assert (tmp_path / 'out.csv').exists()
+    assert pd.read_excel(tmp_path / 'out.xlsx')['Entry'].tolist() == ['P1', 'P2']
\ No newline at end of file
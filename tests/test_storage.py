@@ -0,0 +1,50 @@
+from storage import NAMES_EC, NameMemo, RunStore
+
+def test_write_and_read_in_batches(redis_run):
+    store = RunStore(redis_run)
+    records = [{"EC Number": f"1.1.1.{k}", "Protein": "dehydrogenase"} for k in range(7)]
+    assert store.write(NAMES_EC, records, batch_size=3) == 7
+    assert list(store.iter_records(NAMES_EC, batch_size=3)) == records
+    assert store.count(NAMES_EC) == 7
+    assert store.client.ttl(store.key(NAMES_EC)) > 0
+
+def test_read_new_continues_after_last_id(redis_run):
+    store = RunStore(redis_run)
+    store.write(NAMES_EC, [{"n": 1}, {"n": 2}])
+    records, last_id = store.read_new(NAMES_EC, count=1)
+    assert records == [{"n": 1}]
+    records, last_id = store.read_new(NAMES_EC, last_id)
+    assert records == [{"n": 2}]
+    assert store.read_new(NAMES_EC, last_id) == ([], last_id)
+    store.write(NAMES_EC, [{"n": 3}])
+    assert store.read_new(NAMES_EC, last_id)[0] == [{"n": 3}]
+
+def test_stage_marks_and_metrics(redis_run):
+    store = RunStore(redis_run)
+    assert not store.is_done(NAMES_EC)
+    store.mark_done(NAMES_EC)
+    assert store.is_done(NAMES_EC)
+    store.clear_done(NAMES_EC)
+    assert not store.is_done(NAMES_EC)
+
+    store.save_metrics('names_ec:1', {"counters": [], "histograms": []})
+    assert store.load_metrics() == {'names_ec:1': {"counters": [], "histograms": []}}
+
+def test_name_memo_remembers_hits_and_misses(redis_run):
+    store = RunStore(redis_run)
+    # Ключи памяти общие для всех запусков, поэтому названия теста уникальны для запуска
+    hit, miss = f"{redis_run} dehydrogenase", f"{redis_run} unknownase"
+    memo = NameMemo(store.client, hit_ttl=100, miss_ttl=10)
+    try:
+        memo.put(hit, [('1.1.1.1', ('alcohol dehydrogenase',))])
+        memo.put(miss, [])
+        assert 10 < store.client.ttl(memo.key(hit)) <= 100
+        assert 0 < store.client.ttl(memo.key(miss)) <= 10
+
+        fresh = NameMemo(store.client)
+        assert fresh.prefetch([hit, miss, f"{redis_run} other", hit]) == 2
+        assert fresh.get(hit) == [['1.1.1.1', ['alcohol dehydrogenase']]]
+        assert fresh.get(miss) == []
+        assert fresh.get(f"{redis_run} other") is None
+    finally:
+        store.client.delete(memo.key(hit), memo.key(miss))
\ No newline at end of file
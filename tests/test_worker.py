@@ -0,0 +1,81 @@
+import asyncio
+
+import pandas as pd
+
+import ec_entries
+import ent_seq_v2
+import names_ec
+import worker
+from journal import ERROR, FOUND, NOT_FOUND
+from storage import EC_ENTRIES, NAMES_EC, REACTIONS, SEQUENCES, RunStore
+from workqueue import WorkQueue
+
+def process_accessions(run_id, monkeypatch, chunk):
+    monkeypatch.setattr(ent_seq_v2, 'fetch_uniprot_chunk', lambda *args, **kwargs: chunk)
+    queue = WorkQueue(run_id, SEQUENCES)
+    queue.put(['P1', 'P2'])
+    # Обработчик этапа вызывается без запуска рабочего: ему нужны только очереди
+    stub = worker.Worker.__new__(worker.Worker)
+    stub.queues, stub.executor, stub.http = {SEQUENCES: queue}, None, None
+    asyncio.run(worker.Worker.process_accessions(stub, queue.claim('test', 10)))
+    return queue
+
+def test_empty_uniprot_chunk_is_not_found(redis_run, monkeypatch):
+    queue = process_accessions(redis_run, monkeypatch, pd.DataFrame(columns=ent_seq_v2.PROTEIN_COLUMNS))
+    assert queue.statuses() == {'P1': NOT_FOUND, 'P2': NOT_FOUND}
+    assert queue.backlog() == 0
+
+def test_failed_uniprot_chunk_is_error(redis_run, monkeypatch):
+    queue = process_accessions(redis_run, monkeypatch, None)
+    assert queue.statuses() == {'P1': ERROR, 'P2': ERROR}
+def run_worker(store, stages):
+    stub = worker.Worker.__new__(worker.Worker)
+    stub.store, stub.stages, stub.consumer = store, stages, 'test'
+    stub.queues = {stage: WorkQueue(store.run_id, stage) for stage in worker.STAGES}
+    stub.handlers = {NAMES_EC: stub.process_names, EC_ENTRIES: stub.process_ec_numbers}
+    stub.pool = stub.session = stub.index = stub.memo = stub.fetcher = None
+    asyncio.run(stub.loop())
+    return stub.queues
+
+def test_failed_ec_number_is_retried_on_resume(redis_run, monkeypatch):
+    monkeypatch.setattr(worker, 'POLL_INTERVAL', 0.01)
+
+    async def fetch_ec_numbers_by_name(pool, name, existing_ec_numbers, session=None, index=None, memo=None):
+        return [{"EC Number": '1.1.1.1', "Protein": name}, {"EC Number": '1.1.1.2', "Protein": name}]
+    monkeypatch.setattr(names_ec, 'fetch_ec_numbers_by_name', fetch_ec_numbers_by_name)
+    calls = []
+
+    async def resolve_with_index(fetcher, ec_number, index=None):
+        calls.append(ec_number)
+        # Первая попытка для 1.1.1.2 завершается ошибкой разбора
+        if ec_number == '1.1.1.2' and calls.count(ec_number) == 1:
+            raise RuntimeError('parse error')
+        return {"EC number": ec_number, "Entries": f"P{ec_number[-1]}"}, "found"
+    monkeypatch.setattr(ec_entries, 'resolve_with_index', resolve_with_index)
+    store = RunStore(redis_run)
+
+    worker.enqueue_names(store, ['alcohol dehydrogenase'])
+    queues = run_worker(store, [NAMES_EC, EC_ENTRIES])
+    assert queues[EC_ENTRIES].statuses() == {'1.1.1.1': FOUND, '1.1.1.2': ERROR}
+    assert queues[SEQUENCES].backlog() == 1
+
+    # При возобновлении название уже обработано, а EC номер с ошибкой ставится в очередь заново
+    worker.enqueue_names(store, ['alcohol dehydrogenase'], resume=True)
+    assert not store.is_done(EC_ENTRIES)
+    queues = run_worker(store, [NAMES_EC, EC_ENTRIES])
+    assert sorted(calls) == ['1.1.1.1', '1.1.1.2', '1.1.1.2']
+    assert queues[EC_ENTRIES].statuses() == {'1.1.1.1': FOUND, '1.1.1.2': FOUND}
+    assert [record["EC number"] for record in store.read(EC_ENTRIES)] == ['1.1.1.1', '1.1.1.2']
+    assert queues[SEQUENCES].backlog() == 2
+
+def test_failed_reaction_rows_are_requeued_with_their_records(redis_run):
+    store = RunStore(redis_run)
+    records = [{"Entry": 'P1', "Sequence": 'MK'}, {"Entry": 'P2', "Sequence": 'MV'}]
+    store.write(SEQUENCES, records)
+    queue = WorkQueue(redis_run, REACTIONS)
+    queue.put(records, key=lambda record: record['Entry'])
+    queue.finish(queue.claim('test', 10), {'P1': FOUND, 'P2': ERROR})
+
+    worker.requeue_errors(store)
+    assert [message.item for message in queue.claim('test', 10)] == [records[1]]
+    assert queue.statuses() == {'P1': FOUND}
\ No newline at end of file
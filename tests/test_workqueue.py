@@ -0,0 +1,68 @@
+import json
+import time
+
+from journal import ERROR, FOUND
+from workqueue import MAX_DELIVERIES, WorkQueue
+
+VISIBILITY_TIMEOUT = 0.5
+
+def queues(run_id, count=2):
+    # Очереди одного этапа в разных рабочих процессах
+    return [WorkQueue(run_id, 'stage', visibility_timeout=VISIBILITY_TIMEOUT) for _ in range(count)]
+
+def test_put_skips_queued_items(redis_run):
+    queue, = queues(redis_run, 1)
+    assert queue.put(['A', 'B', 'A']) == ['A', 'B']
+    assert queue.put(['A', 'C']) == ['C']
+    assert queue.put([{'Entry': 'C'}, {'Entry': 'D'}], key=lambda record: record['Entry']) == [{'Entry': 'D'}]
+    assert queue.backlog() == 4
+
+def test_leased_items_are_not_given_to_other_workers(redis_run):
+    first, second = queues(redis_run)
+    first.put(['A', 'B', 'C'])
+    assert [message.item for message in first.claim('w1', 2)] == ['A', 'B']
+    assert [message.item for message in second.claim('w2', 10)] == ['C']
+    assert second.claim('w2', 10) == []
+
+def test_expired_lease_is_reclaimed(redis_run):
+    first, second = queues(redis_run)
+    first.put(['A'])
+    leased = first.claim('w1', 10)
+    time.sleep(VISIBILITY_TIMEOUT * 1.5)
+    reclaimed = second.claim('w2', 10)
+    assert [message.item for message in reclaimed] == ['A']
+    second.finish(reclaimed, {'A': FOUND})
+    assert second.backlog() == 0
+    assert first.statuses() == {'A': FOUND}
+    assert [message.id for message in leased] == [message.id for message in reclaimed]
+
+def test_renew_keeps_lease(redis_run):
+    first, second = queues(redis_run)
+    first.put(['A'])
+    first.claim('w1', 10)
+    for _ in range(3):
+        time.sleep(VISIBILITY_TIMEOUT * 0.6)
+        first.renew('w1')
+    assert second.claim('w2', 10) == []
+
+def test_duplicate_messages_are_processed_once(redis_run):
+    # Два рабочих одновременно поставили один элемент: оба сообщения попали в поток
+    first, second = queues(redis_run)
+    first.put(['A'])
+    first.client.xadd(first.stream, {'key': 'A', 'item': json.dumps('A')})
+    claimed = first.claim('w1', 1) + second.claim('w2', 1)
+    assert [message.item for message in claimed] == ['A']
+    first.finish(claimed, {'A': FOUND})
+    assert first.backlog() == 0
+
+def test_item_is_error_after_max_deliveries(redis_run):
+    queue, = queues(redis_run, 1)
+    queue.put(['A'])
+    assert queue.claim('w1', 10)
+    for _ in range(MAX_DELIVERIES - 1):
+        time.sleep(VISIBILITY_TIMEOUT * 1.5)
+        assert queue.claim('w1', 10)
+    time.sleep(VISIBILITY_TIMEOUT * 1.5)
+    assert queue.claim('w1', 10) == []
+    assert queue.statuses() == {'A': ERROR}
+    assert queue.backlog() == 0
\ No newline at end of file
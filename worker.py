@@ -0,0 +1,363 @@
+import argparse
+import asyncio
+import logging
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import ec_entries
+import ent_seq_v2
+import metrics
+import names_ec
+from config import configure, lazy_module, setup_logging
+from enzyme_index import open_index
+from journal import ERROR, FOUND, NOT_FOUND, Journal
+from ratelimit import THROTTLE_STATUSES
+from storage import EC_ENTRIES, EC_NOT_FOUND, NAMES_EC, NAMES_NOT_FOUND, REACTIONS, SEQUENCES, RunStore, name_memo
+from workqueue import QUEUED, WorkQueue, consumer_name, update_done
+
+aiohttp = lazy_module('aiohttp')
+requests = lazy_module('requests')
+
+# Распределённый режим: элементы всех этапов (названия, EC номера, accession UniProt, записи для запросов
+# Rhea) проходят через общие очереди в Redis (workqueue.py). Рабочие процессы (python worker.py --run-id ...)
+# на любом числе машин с доступом к одному Redis берут элементы пачками, выполняют функции этапов
+# и ставят найденное в очередь следующего этапа. Координатор (orchestrator.py --distributed) ставит
+# в очередь названия, ждёт завершения всех этапов и собирает FASTA и итоговый файл из потоков Redis.
+# Реакции Rhea запрашиваются пакетными табличными запросами (как smile_spider --batched), без браузера
+
+STAGES = [NAMES_EC, EC_ENTRIES, SEQUENCES, REACTIONS]
+BATCH_SIZES = {NAMES_EC: 10, EC_ENTRIES: 20, SEQUENCES: 500, REACTIONS: 100}
+FLUSH_INTERVAL = 2.0  # Сколько пакетные этапы ждут заполнения пачки, пока предыдущий этап не завершён, с
+POLL_INTERVAL = 1.0
+PROGRESS_INTERVAL = 30.0
+QUEUE_BATCH = 1000
+
+def get_text(url, session=None, max_tries=3, backoff=1.0):
+    for attempt in range(max_tries):
+        try:
+            response = ent_seq_v2.timed_get(url, session)
+            response.raise_for_status()
+            return response.text
+        except requests.RequestException as e:
+            if attempt + 1 == max_tries:
+                raise
+            metrics.inc(metrics.HTTP_RETRIES, host=metrics.host_of(url))
+            # После 429/503 паузу выдерживает общий планировщик хоста
+            if getattr(e.response, 'status_code', None) not in THROTTLE_STATUSES:
+                time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+def fetch_rhea_rows(records, session=None):
+    # Пачка записей UniProt: соответствие accession -> ID Rhea из UniProt, затем одна табличная выборка Rhea
+    import smile_spider
+    accessions = [record['Entry'] for record in records]
+    mapping = smile_spider.parse_uniprot_rhea_tsv(get_text(smile_spider.uniprot_rhea_url(accessions), session))
+    with_reactions = [accession for accession in accessions if mapping.get(accession)]
+    reactions = {}
+    if with_reactions:
+        reactions = smile_spider.parse_rhea_tsv(get_text(smile_spider.rhea_query_url(with_reactions), session))
+    rows = []
+    for record in records:
+        text_reaction, smiles_reaction = smile_spider.reaction_columns(mapping.get(record['Entry'], []), reactions)
+        rows.append(dict(record, Text_reaction=text_reaction, SMILES_reaction=smiles_reaction))
+    return rows
+
+class Worker:
+    def __init__(self, store, stages=None, concurrency=4, index=None):
+        self.store = store
+        self.stages = [stage for stage in STAGES if stage in (stages or STAGES)]
+        self.concurrency = concurrency
+        self.index = index
+        self.consumer = consumer_name()
+        self.queues = {stage: WorkQueue(store.run_id, stage) for stage in STAGES}
+        self.handlers = {NAMES_EC: self.process_names, EC_ENTRIES: self.process_ec_numbers,
+                         SEQUENCES: self.process_accessions, REACTIONS: self.process_reactions}
+        self.session = None
+        self.pool = None
+        self.fetcher = None
+        self.memo = None
+        self.http = None
+        self.executor = None
+
+    def finished(self):
+        return all(self.store.is_done(stage) for stage in self.stages)
+
+    def ready(self, stage):
+        # Пакетные этапы (UniProt, Rhea) ждут полную пачку, пока предыдущий этап не завершён,
+        # но не дольше FLUSH_INTERVAL от постановки самого старого элемента
+        queue = self.queues[stage]
+        backlog = queue.backlog()
+        if not backlog:
+            return False
+        if stage not in (SEQUENCES, REACTIONS) or backlog >= BATCH_SIZES[stage]:
+            return True
+        return self.store.is_done(STAGES[STAGES.index(stage) - 1]) or queue.age() >= FLUSH_INTERVAL
+
+    async def loop(self):
+        while not self.finished():
+            # Сначала последние этапы: найденное быстрее доходит до итогового файла
+            for stage in reversed(self.stages):
+                if not self.ready(stage):
+                    continue
+                messages = self.queues[stage].claim(self.consumer, BATCH_SIZES[stage])
+                if messages:
+                    # Время этапа — сумма времени обработки его пачек, как у этапов в одном процессе
+                    with metrics.stage(stage, items_in=len(messages), profile=False):
+                        await self.handlers[stage](messages)
+                    break
+            else:
+                update_done(self.store, list(self.queues.values()))
+                await asyncio.sleep(POLL_INTERVAL * random.uniform(0.5, 1.5))
+
+    def heartbeat(self, stop):
+        # Отдельный поток: владение продлевается, даже пока цикл событий занят разбором ответов или Redis
+        interval = self.queues[NAMES_EC].visibility_timeout / 3
+        while not stop.wait(interval):
+            try:
+                for queue in self.queues.values():
+                    queue.renew(self.consumer)
+                metrics.publish(self.store, f"worker-{socket.gethostname()}")
+            except Exception as e:
+                logging.warning(f"Не удалось продлить владение элементами: {e}")
+
+    async def process_names(self, messages):
+        names_ec.prefetch_memo(self.memo, [message.item for message in messages])
+        lookups = await asyncio.gather(*(
+            names_ec.fetch_ec_numbers_by_name(self.pool, message.item, set(), session=self.session,
+                                              index=self.index, memo=self.memo)
+            for message in messages
+        ))
+        statuses = {}
+        found = {}
+        not_found = []
+        for message, records in zip(messages, lookups):
+            statuses[message.item] = ERROR if records is None else FOUND if records else NOT_FOUND
+            for record in records or ():
+                found.setdefault(record['EC Number'], (record, message))
+            if not records:
+                not_found.append({"Protein": message.item})
+        # EC номер, уже найденный по другому названию, повторно не записывается. Владение записью
+        # привязано к сообщению, поэтому забранное у остановившегося рабочего название запишет её снова
+        owned = self.queues[NAMES_EC].claim_records({key: message for key, (_, message) in found.items()})
+        records = [record for key, (record, _) in found.items() if key in owned]
+        self.queues[EC_ENTRIES].put([record['EC Number'] for record in records])
+        self.store.write(NAMES_EC, records)
+        self.store.write(NAMES_NOT_FOUND, not_found)
+        metrics.items_out(NAMES_EC, len(records))
+        self.queues[NAMES_EC].finish(messages, statuses)
+
+    async def process_ec_numbers(self, messages):
+        queue = self.queues[EC_ENTRIES]
+        outcomes = await asyncio.gather(*(
+            ec_entries.resolve_with_index(self.fetcher, message.item, self.index) for message in messages
+        ), return_exceptions=True)
+        statuses = {}
+        found = {}
+        not_found = []
+        for message, outcome in zip(messages, outcomes):
+            ec_number = message.item
+            if isinstance(outcome, BaseException):
+                logging.error(f"Error processing data for EC number '{ec_number}': {outcome}")
+                outcome = (None, "error")
+                not_found.append({"EC number": ec_number})
+            record, status = outcome
+            if status == "not_found":
+                not_found.append({"EC number": ec_number})
+            elif record:
+                found.setdefault(record["EC number"], (record, message))
+            statuses[ec_number] = {"found": FOUND, "not_found": NOT_FOUND}.get(status, ERROR)
+        # Несколько EC номеров могут быть перенесены в одну и ту же запись
+        owned = queue.claim_records({key: message for key, (_, message) in found.items()})
+        records = [record for key, (record, _) in found.items() if key in owned]
+        self.store.write(EC_ENTRIES, records)
+        self.store.write(EC_NOT_FOUND, not_found)
+        metrics.items_out(EC_ENTRIES, len(records))
+        self.queues[SEQUENCES].put([item for record in records for item in record.get('Entries', '').split('\n') if item])
+        queue.finish(messages, statuses)
+
+    async def process_accessions(self, messages):
+        ids = [message.item for message in messages]
+        loop = asyncio.get_running_loop()
+        try:
+            chunk = await loop.run_in_executor(self.executor, partial(
+                ent_seq_v2.fetch_uniprot_chunk, ids, ent_seq_v2.PROTEIN_COLUMNS, session=self.http,
+                dtype=ent_seq_v2.COMPACT_DTYPES))
+        except Exception as e:
+            logging.error(f"Ошибка при запросе {len(ids)} accession в UniProt: {e}")
+            chunk = None
+        if chunk is None:
+            self.queues[SEQUENCES].finish(messages, {accession: ERROR for accession in ids})
+            return
+        if chunk.empty:
+            # Ответ без записей (только заголовок): ни одного accession пачки нет в UniProt
+            logging.info(f"No data found for {len(ids)} UniProtKB ACs")
+            self.queues[SEQUENCES].finish(messages, {accession: NOT_FOUND for accession in ids})
+            return
+        records = ent_seq_v2.chunk_records(chunk)
+        self.store.write(SEQUENCES, records)
+        metrics.items_out(SEQUENCES, len(records))
+        self.queues[REACTIONS].put(records, key=lambda record: record['Entry'])
+        found = {record['Entry'] for record in records}
+        self.queues[SEQUENCES].finish(messages, {accession: FOUND if accession in found else NOT_FOUND
+                                                 for accession in ids})
+
+    async def process_reactions(self, messages):
+        records = [message.item for message in messages]
+        loop = asyncio.get_running_loop()
+        try:
+            rows = await loop.run_in_executor(self.executor, fetch_rhea_rows, records, self.http)
+        except Exception as e:
+            logging.error(f"Ошибка при запросе реакций Rhea для {len(records)} записей: {e}")
+            rows = [dict(record, Text_reaction=None, SMILES_reaction=None) for record in records]
+        self.store.write(REACTIONS, rows)
+        metrics.items_out(REACTIONS, len(rows))
+        self.queues[REACTIONS].finish(messages, {row['Entry']: ERROR if row['Text_reaction'] is None else FOUND
+                                                 for row in rows})
+
+    async def run(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency * 4),
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+        self.pool = names_ec.BrowserPool(size=self.concurrency)
+        self.fetcher = ec_entries.EnzymeFetcher(self.session)
+        self.memo = name_memo()
+        self.http = ent_seq_v2.pooled_session(self.concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        logging.info(f"Рабочий {self.consumer}: запуск {self.store.run_id}, этапы {', '.join(self.stages)}")
+        stop = threading.Event()
+        threading.Thread(target=self.heartbeat, args=(stop,), daemon=True).start()
+        try:
+            await asyncio.gather(*(self.loop() for _ in range(self.concurrency)))
+        finally:
+            stop.set()
+            await self.session.close()
+            await self.pool.close()
+            self.executor.shutdown(wait=False)
+            self.http.close()
+        logging.info(f"Рабочий {self.consumer}: все этапы завершены")
+
+# Координатор
+
+def requeue_errors(store):
+    # Элементы всех этапов, обработка которых завершилась ошибкой, ставятся в очередь заново.
+    # Элементы следующих этапов ставит в очередь обработка предыдущего, но для них она уже завершена,
+    # поэтому EC номера и accession ставятся здесь же, а записи для запросов Rhea берутся из потока sequences
+    requeued = 0
+    for stage in STAGES:
+        queue = WorkQueue(store.run_id, stage)
+        errors = [item for item, status in queue.statuses().items() if status == ERROR]
+        if not errors:
+            continue
+        queue.requeue(errors)
+        if stage == REACTIONS:
+            failed = set(errors)
+            queue.put([record for record in store.iter_records(SEQUENCES) if record['Entry'] in failed],
+                      key=lambda record: record['Entry'])
+        else:
+            queue.put(errors)
+        requeued += len(errors)
+        logging.info(f"Повторная обработка {len(errors)} элементов этапа {stage}, завершившихся ошибкой")
+    if requeued:
+        for stage in STAGES:
+            store.clear_done(stage)
+
+def enqueue_names(store, enzymes, resume=False):
+    queue = WorkQueue(store.run_id, NAMES_EC)
+    if resume:
+        requeue_errors(store)
+    added = 0
+    for start in range(0, len(enzymes), QUEUE_BATCH):
+        added += len(queue.put(enzymes[start:start + QUEUE_BATCH]))
+    store.mark_done(QUEUED)
+    logging.info(f"В очередь поставлено {added} названий")
+
+def start_workers(run_id, count, concurrency=4, index_path=None):
+    command = [sys.executable, str(Path(__file__).resolve()), '--run-id', run_id, '--concurrency', str(concurrency)]
+    if index_path:
+        command.extend(['--index', index_path])
+    return [subprocess.Popen(command) for _ in range(count)]
+
+def wait_for_run(store, processes):
+    queues = [WorkQueue(store.run_id, stage) for stage in STAGES]
+    last_report = time.monotonic()
+    while not update_done(store, queues):
+        if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            logging.info("Ход запуска: " + "; ".join(
+                f"{queue.stage} {progress['finished']}/{progress['queued']} (в очереди {progress['backlog']})"
+                for queue, progress in ((queue, queue.progress()) for queue in queues)))
+        if processes and all(process.poll() is not None for process in processes):
+            logging.error("Все локальные рабочие процессы завершились до окончания запуска")
+            return False
+        time.sleep(POLL_INTERVAL)
+    for process in processes:
+        process.wait()
+    return True
+
+def export_results(store, output_file=None, fasta_file='output_sequences.fasta'):
+    import smile_spider
+    # Элемент, забранный у остановившегося рабочего, мог быть записан дважды: записи берутся по Entry
+    sequences = {record['Entry']: record for record in store.read(SEQUENCES)}
+    ent_seq_v2.save_to_fasta(list(sequences.values()), fasta_file)
+    sink = smile_spider.ResultSink(output_file or smile_spider.DEFAULT_OUTPUT_FILE)
+    # Строка реакций, завершившаяся ошибкой, записывается заново при --resume: берётся последняя запись Entry
+    last = {}
+    for position, record in enumerate(store.iter_records(REACTIONS)):
+        last[record['Entry']] = position
+    for position, record in enumerate(store.iter_records(REACTIONS)):
+        if last[record['Entry']] == position:
+            sink.add(record)
+    sink.close()
+    logging.info(f"Итоговый файл: {sink.output_file} ({sink.written} строк)")
+
+def run_distributed(enzymes, output_file=None, run_id=None, workers=1, concurrency=4, index_path=None, resume=False):
+    store = RunStore(run_id)
+    logging.info(f"Идентификатор запуска: {store.run_id} (распределённый режим)" + (" (возобновление)" if resume else ""))
+    enqueue_names(store, enzymes, resume=resume)
+    logging.info(f"Рабочие на других машинах: python worker.py --run-id {store.run_id} --redis-url <адрес Redis>")
+    start = time.perf_counter()
+    processes = start_workers(store.run_id, workers, concurrency, index_path)
+    try:
+        if not wait_for_run(store, processes):
+            return False
+    except BaseException:
+        for process in processes:
+            process.terminate()
+        raise
+    logging.info(f"Все этапы завершены за {time.perf_counter() - start:.2f} с")
+    # Статусы названий попадают в локальный журнал: по нему строится <output>.input.csv и работает --skip-resolved
+    journal = Journal(store.run_id, NAMES_EC)
+    journal.record_all(WorkQueue(store.run_id, NAMES_EC).statuses())
+    journal.close()
+    export_results(store, output_file)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Рабочий процесс распределённого режима: обрабатывает элементы "
+                                                 "этапов из общих очередей Redis")
+    parser.add_argument('--run-id', type=str, required=True, help="Идентификатор запуска (выводится orchestrator.py --distributed)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Количество пачек, обрабатываемых одновременно")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, help="Обрабатывать только эти этапы (например, names_ec на машинах с браузером)")
+    parser.add_argument('--index', type=str, help="Путь к локальному индексу ENZYME (enzyme_index.py)")
+    parser.add_argument('--redis-url', type=str, help="Адрес общего Redis (по умолчанию ENZYME_REDIS_URL или redis://localhost:6379/0)")
+    parser.add_argument('--log-level', type=str, help="Уровень журнала (по умолчанию ENZYME_LOG_LEVEL или INFO)")
+    args = parser.parse_args()
+    configure(redis_url=args.redis_url, log_level=args.log_level)
+    setup_logging()
+
+    store = RunStore(args.run_id)
+    worker = Worker(store, stages=args.stages, concurrency=args.concurrency, index=open_index(args.index))
+    try:
+        asyncio.run(worker.run())
+    finally:
+        metrics.publish(store, f"worker-{socket.gethostname()}")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+import socket
+import uuid
+from collections import namedtuple
+
+from journal import ERROR
+from storage import DEFAULT_TTL, KEY_PREFIX, get_redis
+
+# Общая очередь работы распределённого режима (worker.py). Для каждого этапа запуска свой поток Redis
+# enzyme:<run_id>:queue:<этап>:items с группой потребителей: элемент (название, EC номер, accession или
+# запись последовательности для запроса Rhea) выдаётся одному рабочему процессу и остаётся за ним,
+# пока тот не подтвердит обработку (finish). Рабочий продлевает владение (renew) не реже чем раз
+# в VISIBILITY_TIMEOUT, поэтому элементы остановившегося рабочего через VISIBILITY_TIMEOUT забирает
+# другой рабочий. Элемент, выданный больше MAX_DELIVERIES раз, считается ошибочным.
+# Повторно поставленные элементы отбрасываются: при постановке по множеству queued, а при одновременной
+# постановке одного элемента разными рабочими — при выдаче (первое сообщение становится владельцем).
+# Подтверждённые сообщения удаляются из потока, поэтому этап завершён, когда завершён предыдущий
+# этап и поток этапа пуст
+
+GROUP = 'workers'
+VISIBILITY_TIMEOUT = 300
+MAX_DELIVERIES = 3
+QUEUED = 'queued'  # Отметка в enzyme:<run_id>:stages: все названия поставлены в очередь
+
+Message = namedtuple('Message', ['id', 'item'])
+
+def consumer_name():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:4]}"
+
+class WorkQueue:
+    def __init__(self, run_id, stage, client=None, visibility_timeout=None, ttl=DEFAULT_TTL):
+        self.run_id = run_id
+        self.stage = stage
+        self.client = client or get_redis()
+        self.visibility_timeout = float(visibility_timeout or os.environ.get('ENZYME_VISIBILITY_TIMEOUT',
+                                                                             VISIBILITY_TIMEOUT))
+        self.ttl = ttl
+        self.stream = self.key('items')
+        self.leased = {}  # ID сообщения -> элемент, выданный этому процессу и ещё не подтверждённый
+        self.group_ready = False
+
+    def key(self, name):
+        return f"{KEY_PREFIX}:{self.run_id}:queue:{self.stage}:{name}"
+
+    def ensure_group(self):
+        if self.group_ready:
+            return
+        import redis
+        # Группа создаётся первым обратившимся процессом; остальные находят её без ответа-ошибки
+        if self.client.exists(self.stream) and any(group['name'].decode() == GROUP
+                                                   for group in self.client.xinfo_groups(self.stream)):
+            self.group_ready = True
+            return
+        try:
+            self.client.xgroup_create(self.stream, GROUP, id='0', mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self.group_ready = True
+
+    def expire(self, pipe):
+        if self.ttl:
+            for name in ('items', 'queued', 'owners', 'status', 'deliveries', 'records'):
+                pipe.expire(self.key(name), self.ttl)
+
+    def put(self, items, key=None):
+        # Ставит в очередь ещё не поставленные элементы; возвращает их список.
+        # Сообщение и отметка в queued добавляются одной транзакцией, поэтому при сбое
+        # рабочего между ними элемент не теряется: исходный элемент будет обработан заново
+        self.ensure_group()
+        keys = {}
+        for item in items:
+            keys.setdefault(key(item) if key else item, item)
+        if not keys:
+            return []
+        pipe = self.client.pipeline(transaction=False)
+        for item_key in keys:
+            pipe.sismember(self.key('queued'), item_key)
+        new = [(item_key, item) for (item_key, item), queued in zip(keys.items(), pipe.execute()) if not queued]
+        if not new:
+            return []
+        pipe = self.client.pipeline(transaction=True)
+        for item_key, item in new:
+            pipe.xadd(self.stream, {'key': item_key, 'item': json.dumps(item)})
+            pipe.sadd(self.key('queued'), item_key)
+        self.expire(pipe)
+        pipe.execute()
+        return [item for _, item in new]
+
+    def claim(self, consumer, count):
+        # Сначала забираем элементы, владелец которых не продлевал владение дольше VISIBILITY_TIMEOUT,
+        # затем новые элементы
+        self.ensure_group()
+        messages = []
+        _, reclaimed, *_ = self.client.xautoclaim(self.stream, GROUP, consumer, int(self.visibility_timeout * 1000),
+                                                  '0-0', count=count)
+        if reclaimed:
+            messages.extend(self.check_deliveries(reclaimed))
+        if len(messages) < count:
+            for _, entries in self.client.xreadgroup(GROUP, consumer, {self.stream: '>'}, count=count - len(messages)):
+                messages.extend(entries)
+        return self.own(messages)
+
+    def check_deliveries(self, entries):
+        pipe = self.client.pipeline(transaction=False)
+        for message_id, _ in entries:
+            pipe.hincrby(self.key('deliveries'), message_id, 1)
+        valid = []
+        # Счётчик считает повторные выдачи, поэтому его значение равно числу прежних выдач
+        for (message_id, fields), deliveries in zip(entries, pipe.execute()):
+            if deliveries >= MAX_DELIVERIES:
+                item_key = fields[b'key'].decode()
+                logging.error(f"Элемент '{item_key}' этапа {self.stage} выдан {deliveries} раз без подтверждения, "
+                              f"он отмечается как ошибочный")
+                self.finish([Message(message_id, None)], {item_key: ERROR})
+            else:
+                logging.warning(f"Элемент '{fields[b'key'].decode()}' этапа {self.stage} забран у остановившегося рабочего")
+                valid.append((message_id, fields))
+        return valid
+
+    def own(self, entries):
+        # Из нескольких сообщений с одним элементом обрабатывается только первое выданное
+        if not entries:
+            return []
+        pipe = self.client.pipeline(transaction=False)
+        for message_id, fields in entries:
+            pipe.hsetnx(self.key('owners'), fields[b'key'], message_id)
+            pipe.hget(self.key('owners'), fields[b'key'])
+        owners = pipe.execute()[1::2]
+        messages = []
+        duplicates = []
+        for (message_id, fields), owner in zip(entries, owners):
+            message = Message(message_id, json.loads(fields[b'item']))
+            if owner == message_id:
+                messages.append(message)
+                self.leased[message_id] = message.item
+            else:
+                duplicates.append(message)
+        if duplicates:
+            self.finish(duplicates)
+        return messages
+
+    def renew(self, consumer):
+        # Продление владения: сбрасывает время простоя сообщений, выданных этому процессу
+        if self.leased:
+            self.client.xclaim(self.stream, GROUP, consumer, 0, list(self.leased), justid=True)
+
+    def claim_records(self, records):
+        # records: ключ записи результата -> сообщение. Запись с одним ключом выполняет только одно
+        # сообщение (например, несколько EC номеров перенесены в одну запись); возвращает ключи этих сообщений
+        if not records:
+            return set()
+        pipe = self.client.pipeline(transaction=False)
+        for record_key, message in records.items():
+            pipe.hsetnx(self.key('records'), record_key, message.id)
+            pipe.hget(self.key('records'), record_key)
+        owners = pipe.execute()[1::2]
+        return {record_key for (record_key, message), owner in zip(records.items(), owners) if owner == message.id}
+
+    def finish(self, messages, statuses=None):
+        # Подтверждение обработки и статус элементов (journal.FOUND, NOT_FOUND или ERROR)
+        pipe = self.client.pipeline(transaction=True)
+        if statuses:
+            pipe.hset(self.key('status'), mapping=statuses)
+        ids = [message.id for message in messages]
+        pipe.xack(self.stream, GROUP, *ids)
+        pipe.xdel(self.stream, *ids)
+        pipe.hdel(self.key('deliveries'), *ids)
+        self.expire(pipe)
+        pipe.execute()
+        for message_id in ids:
+            self.leased.pop(message_id, None)
+
+    def requeue(self, item_keys):
+        # Элементы снова можно поставить в очередь (повтор ошибочных при --resume)
+        if not item_keys:
+            return
+        pipe = self.client.pipeline(transaction=True)
+        pipe.srem(self.key('queued'), *item_keys)
+        pipe.hdel(self.key('owners'), *item_keys)
+        pipe.hdel(self.key('status'), *item_keys)
+        pipe.execute()
+
+    def backlog(self):
+        return self.client.xlen(self.stream)
+
+    def age(self):
+        # Сколько секунд в потоке самое старое сообщение (ID сообщения — время Redis в мс)
+        entries = self.client.xrange(self.stream, count=1)
+        if not entries:
+            return 0.0
+        seconds, microseconds = self.client.time()
+        return seconds + microseconds / 1e6 - int(entries[0][0].split(b'-')[0]) / 1000
+
+    def statuses(self):
+        return {item.decode(): status.decode() for item, status in self.client.hgetall(self.key('status')).items()}
+
+    def progress(self):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.scard(self.key('queued'))
+        pipe.hlen(self.key('status'))
+        pipe.xlen(self.stream)
+        queued, finished, backlog = pipe.execute()
+        return {"queued": queued, "finished": finished, "backlog": backlog}
+
+def update_done(store, queues):
+    # Отмечает завершённые этапы; queues — очереди этапов по порядку. Отметка предыдущего этапа
+    # читается раньше длины потока: рабочий ставит элементы следующего этапа до подтверждения своих,
+    # поэтому после завершения предыдущего этапа в поток этого этапа ничего не добавится
+    upstream_done = store.is_done(QUEUED)
+    for queue in queues:
+        if store.is_done(queue.stage):
+            upstream_done = True
+            continue
+        if not upstream_done or queue.backlog():
+            return False
+        store.mark_done(queue.stage)
+        logging.info(f"Этап {queue.stage} завершён")
+    return True
\ No newline at end of file